@@ -21,8 +21,15 @@ celery_app.conf.update(
     task_soft_time_limit=25 * 60,  # Мягкий лимит 25 минут
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=1000,
-    imports=['tasks.analysis_task'],
+    imports=['tasks.analysis_task', 'tasks.health_task'],
+    beat_schedule={
+        # Фоновая проверка провайдеров LLM вместо проверки в каждой задаче
+        'probe-llm-health': {
+            'task': 'tasks.probe_llm_health',
+            'schedule': settings.LLM_HEALTH_INTERVAL,
+        },
+    },
 )
 
 # Автоматическое обнаружение задач
-celery_app.autodiscover_tasks(['tasks.analysis_task'])
\ No newline at end of file
+celery_app.autodiscover_tasks(['tasks.analysis_task', 'tasks.health_task'])
\ No newline at end of file
@@ -45,6 +45,121 @@ class Settings:
     CELERY_BROKER_URL: str = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
     CELERY_RESULT_BACKEND: str = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
 
+    # Режим извлечения сканированного паспорта: iterative (страница за страницей
+    # с накоплением) или parallel (страницы независимо и параллельно, затем слияние)
+    PASSPORT_EXTRACTION_MODE: str = os.getenv("PASSPORT_EXTRACTION_MODE", "iterative")
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+
+    # Пакетирование страниц: не больше LLM_PAGES_PER_REQUEST страниц и LLM_BATCH_TOKEN_BUDGET
+    # токенов (0 — использовать LLM_MAX_TOKENS) на запрос; лимит страниц адаптируется к задержкам
+    LLM_PAGES_PER_REQUEST: int = int(os.getenv("LLM_PAGES_PER_REQUEST", 1))
+    LLM_BATCH_TOKEN_BUDGET: int = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", 0))
+    LLM_BATCH_TARGET_LATENCY: float = float(os.getenv("LLM_BATCH_TARGET_LATENCY", 60))
+
+    # Асинхронный клиент LLM: все запросы задачи на одном event loop
+    LLM_ASYNC: bool = os.getenv("LLM_ASYNC", "False").lower() == "true"
+    LLM_ASYNC_MAX_CONCURRENCY: int = int(os.getenv("LLM_ASYNC_MAX_CONCURRENCY", 16))
+    # Лимиты по провайдерам в формате "local:2,openrouter:8"; для остальных — LLM_MAX_CONCURRENCY
+    LLM_ASYNC_PROVIDER_CONCURRENCY: str = os.getenv("LLM_ASYNC_PROVIDER_CONCURRENCY", "")
+
+    # Потоковые ответы LLM: JSON разбирается по мере поступления токенов
+    LLM_STREAMING: bool = os.getenv("LLM_STREAMING", "False").lower() == "true"
+
+    # Повторы, circuit breaker и резервные провайдеры ("openrouter:model,openai:gpt-4o")
+    LLM_RETRY_MAX_ATTEMPTS: int = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", 4))
+    LLM_RETRY_BASE_DELAY: float = float(os.getenv("LLM_RETRY_BASE_DELAY", 1.0))
+    LLM_RETRY_MAX_DELAY: float = float(os.getenv("LLM_RETRY_MAX_DELAY", 60))
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 5))
+    LLM_CIRCUIT_RESET_TIMEOUT: float = float(os.getenv("LLM_CIRCUIT_RESET_TIMEOUT", 60))
+    LLM_FALLBACKS: str = os.getenv("LLM_FALLBACKS", "")
+
+    # Фоновая проверка провайдеров LLM (задача Celery beat) и срок жизни статуса
+    LLM_HEALTH_INTERVAL: int = int(os.getenv("LLM_HEALTH_INTERVAL", 300))
+    LLM_HEALTH_TTL: int = int(os.getenv("LLM_HEALTH_TTL", 900))
+
+    # Распределённый лимит запросов к LLM (token bucket в Redis), 0 — без ограничения.
+    # LLM_RATE_LIMITS переопределяет лимит для пары: "openrouter:model=60/200000,local:m=0/0"
+    LLM_RATE_RPM: int = int(os.getenv("LLM_RATE_RPM", 0))
+    LLM_RATE_TPM: int = int(os.getenv("LLM_RATE_TPM", 0))
+    LLM_RATE_LIMITS: str = os.getenv("LLM_RATE_LIMITS", "")
+    LLM_RATE_BURST_SECONDS: float = float(os.getenv("LLM_RATE_BURST_SECONDS", 10))
+    LLM_RATE_MAX_WAIT: float = float(os.getenv("LLM_RATE_MAX_WAIT", 600))
+    # Веса пользователей при делении лимита: "1:2,5:0.5" (user_id:вес, по умолчанию 1)
+    LLM_RATE_USER_WEIGHTS: str = os.getenv("LLM_RATE_USER_WEIGHTS", "")
+
+    # HTTP-транспорт к LLM (общий пул соединений на процесс)
+    LLM_HTTP_POOL_SIZE: int = int(os.getenv("LLM_HTTP_POOL_SIZE", 20))
+    LLM_HTTP_POOL_CONNECTIONS: int = int(os.getenv("LLM_HTTP_POOL_CONNECTIONS", 4))
+    LLM_HTTP_TIMEOUT: float = float(os.getenv("LLM_HTTP_TIMEOUT", 300))
+    LLM_HTTP_CONNECT_TIMEOUT: float = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", 10))
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", 60))
+    LLM_HTTP2: bool = os.getenv("LLM_HTTP2", "False").lower() == "true"
+
+    # Кэш ответов LLM: disk, redis или none
+    LLM_CACHE_BACKEND: str = os.getenv("LLM_CACHE_BACKEND", "disk")
+    LLM_CACHE_DIR: str = os.getenv("LLM_CACHE_DIR", os.path.join(BASE_DIR, "cache", "llm"))
+    LLM_CACHE_TTL: int = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+    LLM_CACHE_MAX_SIZE_MB: int = int(os.getenv("LLM_CACHE_MAX_SIZE_MB", 512))
+
+    # Растеризация PDF в пуле процессов: 0 — по числу ядер, 1 — в процессе воркера
+    PDF_RENDER_WORKERS: int = int(os.getenv("PDF_RENDER_WORKERS", 0))
+    PDF_RENDER_CHUNK_PAGES: int = int(os.getenv("PDF_RENDER_CHUNK_PAGES", 2))
+    # Сколько диапазонов страниц рендерится впрок, пока потребитель не забрал готовые
+    PDF_RENDER_PREFETCH_CHUNKS: int = int(os.getenv("PDF_RENDER_PREFETCH_CHUNKS", 4))
+    # Пресет растеризации: png (прежнее качество), jpeg, webp, gray, binary; длинная сторона в пикселях
+    PDF_RENDER_PRESET: str = os.getenv("PDF_RENDER_PRESET", "png")
+    PDF_RENDER_MAX_SIZE: int = int(os.getenv("PDF_RENDER_MAX_SIZE", 2048))
+    # DPI рендера подбирается для каждой страницы по размеру текста и плотности содержимого
+    PDF_RENDER_ADAPTIVE: bool = os.getenv("PDF_RENDER_ADAPTIVE", "True").lower() == "true"
+    PDF_RENDER_MIN_DPI: int = int(os.getenv("PDF_RENDER_MIN_DPI", 100))
+    PDF_RENDER_MAX_DPI: int = int(os.getenv("PDF_RENDER_MAX_DPI", 300))
+    # Высота строки самого мелкого текста в пикселях после рендера
+    PDF_RENDER_TARGET_FONT_PX: int = int(os.getenv("PDF_RENDER_TARGET_FONT_PX", 24))
+
+    # Нарезка сканов на фрагменты с содержимым (блоки текста и таблиц) для vision-модели;
+    # при нарезке страницы рендерятся с длинной стороной до PAGE_TILING_RENDER_MAX_SIZE
+    PAGE_TILING_ENABLED: bool = os.getenv("PAGE_TILING_ENABLED", "True").lower() == "true"
+    PAGE_TILE_MAX_SIZE: int = int(os.getenv("PAGE_TILE_MAX_SIZE", 2048))
+    PAGE_TILING_RENDER_MAX_SIZE: int = int(os.getenv("PAGE_TILING_RENDER_MAX_SIZE", 3072))
+
+    # ТЗ больше этого числа токенов данных извлекается частями по позициям параллельно (0 — одним запросом)
+    TZ_CHUNK_TOKENS: int = int(os.getenv("TZ_CHUNK_TOKENS", 6000))
+
+    # ТЗ стандартного вида (Наименование / Ед. изм. / Кол-во / характеристики) разбирается
+    # по правилам без LLM, если доля разобранных характеристик не ниже порога
+    TZ_RULES_ENABLED: bool = os.getenv("TZ_RULES_ENABLED", "True").lower() == "true"
+    TZ_RULES_MIN_CONFIDENCE: float = float(os.getenv("TZ_RULES_MIN_CONFIDENCE", 0.85))
+
+    # Формат таблиц в текстовых промптах: markdown или tsv (ещё короче, без разделителей)
+    PROMPT_TABLE_FORMAT: str = os.getenv("PROMPT_TABLE_FORMAT", "markdown")
+
+    # Таблицы в текстовых PDF: auto (2 колонки — "ключ: значение", иначе TSV), tsv, kv, off (плоский текст)
+    PDF_TABLE_EXTRACTION: str = os.getenv("PDF_TABLE_EXTRACTION", "auto")
+
+    # Дисковый кэш отрендеренных страниц PDF (ключ — sha256 файла, страница, пресет)
+    PDF_PAGE_CACHE_ENABLED: bool = os.getenv("PDF_PAGE_CACHE_ENABLED", "True").lower() == "true"
+    PDF_PAGE_CACHE_DIR: str = os.getenv("PDF_PAGE_CACHE_DIR", os.path.join(BASE_DIR, "cache", "pages"))
+    PDF_PAGE_CACHE_MAX_SIZE_MB: int = int(os.getenv("PDF_PAGE_CACHE_MAX_SIZE_MB", 1024))
+
+    # Выгрузка отрендеренных страниц во временные файлы (если кэш страниц выключен)
+    PDF_SPOOL_ENABLED: bool = os.getenv("PDF_SPOOL_ENABLED", "True").lower() == "true"
+    PDF_SPOOL_MIN_KB: int = int(os.getenv("PDF_SPOOL_MIN_KB", 64))
+    PDF_SPOOL_DIR: str = os.getenv("PDF_SPOOL_DIR", "")
+
+    # Отсев пустых и повторяющихся страниц перед vision-запросами
+    PAGE_FILTER_ENABLED: bool = os.getenv("PAGE_FILTER_ENABLED", "True").lower() == "true"
+    PAGE_BLANK_INK_THRESHOLD: float = float(os.getenv("PAGE_BLANK_INK_THRESHOLD", 0.001))
+    PAGE_DUPLICATE_MAX_DISTANCE: int = int(os.getenv("PAGE_DUPLICATE_MAX_DISTANCE", 6))
+    PAGE_DUPLICATE_MAX_DIFF: float = float(os.getenv("PAGE_DUPLICATE_MAX_DIFF", 0.001))
+
+    # Ранжирование страниц паспорта: в LLM сначала уходят страницы, набирающие
+    # PAGE_RANK_COVERAGE суммарной оценки; остальные — если характеристик меньше PAGE_RANK_MIN_CHARACTERISTICS
+    PAGE_RANK_ENABLED: bool = os.getenv("PAGE_RANK_ENABLED", "True").lower() == "true"
+    PAGE_RANK_COVERAGE: float = float(os.getenv("PAGE_RANK_COVERAGE", 0.8))
+    PAGE_RANK_MIN_PAGES: int = int(os.getenv("PAGE_RANK_MIN_PAGES", 2))
+    PAGE_RANK_MIN_DOCUMENT_PAGES: int = int(os.getenv("PAGE_RANK_MIN_DOCUMENT_PAGES", 6))
+    PAGE_RANK_MIN_CHARACTERISTICS: int = int(os.getenv("PAGE_RANK_MIN_CHARACTERISTICS", 10))
+
     DEBUG: bool = os.getenv("DEBUG", "True").lower() == "true"
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
 
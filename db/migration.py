@@ -85,6 +85,13 @@ def create_database():
         return False
 
 
+def add_missing_columns(conn):
+    """Добавляет в существующие таблицы колонки, появившиеся в моделях позже"""
+    conn.execute(text("ALTER TABLE analyses ADD COLUMN IF NOT EXISTS extraction_details TEXT"))
+    conn.commit()
+    print("✅ Колонка analyses.extraction_details проверена")
+
+
 def create_tables():
     """Создает все таблицы в базе данных"""
 
@@ -115,6 +122,7 @@ def create_tables():
             if existing_tables:
                 print(f"📊 Найдены существующие таблицы: {', '.join(existing_tables)}")
                 print("ℹ️  Таблицы уже созданы, пропускаем создание.")
+                add_missing_columns(conn)
                 return True
 
         # Создаем все таблицы
@@ -1,24 +1,140 @@
 import time
+import zipfile
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from xml.etree.ElementTree import iterparse
+
 from docx import Document
 from handlers.file_handler import FileHandler
 
 
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+TBL = W_NS + "tbl"
+TR = W_NS + "tr"
+TC = W_NS + "tc"
+P = W_NS + "p"
+T = W_NS + "t"
+TAB = W_NS + "tab"
+BR = W_NS + "br"
+CR = W_NS + "cr"
+GRID_SPAN = W_NS + "gridSpan"
+V_MERGE = W_NS + "vMerge"
+VAL = W_NS + "val"
+
+
 class DocxHandler(FileHandler):
 
     def get_data_from_docx_file(self, file_path):
         start_time = time.time()
+        stats = {"cells": 0, "merged": 0}
 
-        doc = Document(file_path)
-        tz_data = self.search_table(doc)
+        try:
+            tz_data = list(self.iter_docx_tables(file_path, stats))
+            mode = "stream"
+        except (zipfile.BadZipFile, KeyError, SyntaxError) as e:
+            # Не OOXML-пакет или повреждённая разметка — пробуем python-docx
+            print(f"[DEBUG] Потоковый разбор DOCX не удался ({str(e)}), чтение через python-docx")
+            doc = Document(file_path)
+            tz_data = self.search_table(doc)
+            stats = {"cells": sum(len(row) for table in tz_data for row in table), "merged": 0}
+            mode = "python-docx"
 
         elapsed_time = time.time() - start_time
         total_tables = len(tz_data)
         total_rows = sum(len(table) for table in tz_data)
-        print(f"[DEBUG] DOCX парсинг | tables={total_tables} | rows={total_rows} | time={elapsed_time:.2f}s")
+        print(
+            f"[DEBUG] DOCX парсинг ({mode}) | tables={total_tables} | rows={total_rows} | "
+            f"cells={stats['cells']} | merged_skipped={stats['merged']} | time={elapsed_time:.2f}s"
+        )
 
         return tz_data
 
+    def iter_docx_tables(self, file_path, stats: Optional[Dict[str, int]] = None) -> Iterator[List[List[str]]]:
+        """
+        Таблицы документа по одной, потоковым разбором word/document.xml (без объектной
+        модели python-docx). В строке по ячейке на каждую колонку сетки, как в шапке:
+        текст объединённой по горизонтали (gridSpan) ячейки стоит в первой колонке,
+        остальные колонки объединения пустые; продолжения объединения по вертикали
+        (vMerge) тоже пустые. Абзацы ячейки разделены "\n", вложенные таблицы входят
+        в текст ячейки внешней таблицы.
+        Таблицы меньше чем из двух строк пропускаются, как и раньше.
+        """
+        stats = stats if stats is not None else {"cells": 0, "merged": 0}
+
+        with zipfile.ZipFile(file_path) as package:
+            with package.open("word/document.xml") as document:
+                depth = 0
+                rows: List[List[str]] = []
+                row: List[str] = []
+                cell_parts: List[str] = []
+                paragraph: List[str] = []
+                span = 1
+                v_merge: Optional[str] = None
+
+                for event, elem in iterparse(document, events=("start", "end")):
+                    tag = elem.tag
+
+                    if event == "start":
+                        if tag == TBL:
+                            depth += 1
+                            if depth == 1:
+                                rows = []
+                        elif depth == 1 and tag == TR:
+                            row = []
+                        elif depth == 1 and tag == TC:
+                            cell_parts = []
+                            span = 1
+                            v_merge = None
+                        elif depth >= 1 and tag == P:
+                            paragraph = []
+                        continue
+
+                    if depth == 0:
+                        if tag == P:
+                            # Текст вне таблиц не нужен — не держим его в памяти
+                            elem.clear()
+                        continue
+
+                    if tag == T:
+                        paragraph.append(elem.text or "")
+                    elif tag == TAB:
+                        paragraph.append(" ")
+                    elif tag in (BR, CR):
+                        # Разрыв строки внутри абзаца делит ячейку так же, как новый абзац
+                        paragraph.append("\n")
+                    elif tag == P:
+                        cell_parts.append("".join(paragraph))
+                        paragraph = []
+                    elif depth == 1 and tag == GRID_SPAN:
+                        span = int(elem.get(VAL, "1") or 1)
+                    elif depth == 1 and tag == V_MERGE:
+                        v_merge = elem.get(VAL, "continue")
+                    elif depth == 1 and tag == TC:
+                        # Абзацы ячейки разделяются переводом строки — по ним делятся характеристики
+                        text = "\n".join(
+                            " ".join(line.split()) for part in cell_parts for line in part.split("\n") if line.strip()
+                        )
+                        if v_merge == "continue":
+                            # Продолжение вертикального объединения: текст уже в строке выше
+                            text = ""
+                            stats["merged"] += 1
+
+                        stats["cells"] += 1
+                        stats["merged"] += span - 1
+                        # Колонки под горизонтальным объединением пустые — строка выровнена по шапке
+                        row.extend([text] + [""] * (span - 1))
+                        elem.clear()
+                    elif depth == 1 and tag == TR:
+                        if any(row):
+                            rows.append(row)
+                        elem.clear()
+                    elif tag == TBL:
+                        depth -= 1
+                        if depth == 0:
+                            if len(rows) >= 2:
+                                yield rows
+                            elem.clear()
+
     def search_table(self, doc: Document):
         tables_data = []
 
@@ -28,12 +144,21 @@ class DocxHandler(FileHandler):
 
             table_rows = []
 
+            # python-docx возвращает объединённую ячейку в каждой её колонке и строке —
+            # повторы пустые, как и в потоковом разборе
+            seen_cells = set()
+
             for row in table.rows:
                 row_cells = []
                 for cell in row.cells:
-                    text = " ".join(cell.text.split())
+                    if cell._tc in seen_cells:
+                        row_cells.append("")
+                        continue
+                    seen_cells.add(cell._tc)
+                    text = "\n".join(" ".join(line.split()) for line in cell.text.split("\n") if line.strip())
                     row_cells.append(text)
-                table_rows.append(row_cells)
+                if any(row_cells):
+                    table_rows.append(row_cells)
 
             tables_data.append(table_rows)
 
@@ -1,6 +1,7 @@
 import shutil
 from operator import truediv
 from pathlib import Path
+from typing import Any, Iterator
 
 from fastapi import UploadFile, HTTPException
 
@@ -50,6 +51,33 @@ class FileHandler:
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    @staticmethod
+    def iter_data_from_file(file_path: Path) -> Iterator[Any]:
+        """
+        Ленивое чтение документа: страницы PDF отдаются по мере извлечения/растеризации
+        (сканы — memoryview над файлом, без накопления байтов в памяти), листы XLS — по
+        одному. Таблицы DOCX читаются целиком: при повреждённой разметке нужен откат
+        на python-docx, а начать его после отданных таблиц нельзя.
+        """
+        file_path = Path(file_path)
+        if file_path.suffix.lower() == '.pdf':
+            print(f'[DEBUG] Обработка файла: {file_path.name} | type=PDF (stream)')
+            from handlers.pdf_handler import PdfHandler
+            yield from PdfHandler().iter_pdf_pages(file_path)
+            return
+
+        if file_path.suffix.lower() in ['.xlsx', '.xls']:
+            print(f'[DEBUG] Обработка файла: {file_path.name} | type=XLS (stream)')
+            from handlers.xls_handler import XlsHandler
+            yield from XlsHandler().iter_xls_sheets(file_path)
+            return
+
+        data = FileHandler.get_data_from_file(file_path)
+        if isinstance(data, list):
+            yield from data
+        else:
+            yield data
+
     @staticmethod
     def get_data_from_file(file_path: Path):
         ext = file_path.suffix.lower()
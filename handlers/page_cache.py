@@ -0,0 +1,112 @@
+"""
+Дисковый кэш растеризованных страниц PDF.
+
+Ключ — (sha256 файла, номер страницы, пресет и размер рендера), поэтому повторная
+загрузка того же паспорта не растеризует страницы заново. Страницы читаются через
+mmap и отдаются как memoryview — в памяти процесса они не копируются, данные
+подтягивает page cache ОС по мере кодирования в base64.
+Размер ограничен, вытеснение по LRU (mtime обновляется при чтении).
+"""
+import hashlib
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+from config import settings
+
+
+def file_sha256(file_path: Union[str, Path], chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RenderedPageCache:
+
+    def __init__(self, cache_dir: str, max_size_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._total_size = sum(p.stat().st_size for p in self.cache_dir.glob("*/*.page"))
+
+    def _path(self, file_hash: str, page_num: int, preset_key: str) -> Path:
+        return self.cache_dir / file_hash[:2] / f"{file_hash}_{page_num}_{preset_key}.page"
+
+    def get(self, file_hash: str, page_num: int, preset_key: str) -> Optional[memoryview]:
+        path = self._path(file_hash, page_num, preset_key)
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Обновляем mtime — отметка последнего обращения для LRU
+            os.utime(path, None)
+        except (FileNotFoundError, ValueError):
+            # ValueError — пустой файл (запись оборвалась), считаем промахом
+            return None
+        return memoryview(mapped)
+
+    def set(self, file_hash: str, page_num: int, preset_key: str, data: bytes) -> None:
+        path = self._path(file_hash, page_num, preset_key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+
+        with self._lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self._total_size += len(data) - old_size
+
+            if self._total_size > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for p in self.cache_dir.glob("*/*.page"):
+            try:
+                stat = p.stat()
+                entries.append((stat.st_mtime, stat.st_size, p))
+            except FileNotFoundError:
+                continue
+
+        # Кэш общий для всех процессов воркера — пересчитываем размер по факту
+        self._total_size = sum(size for _, size, _ in entries)
+        target = int(self.max_size_bytes * 0.9)
+
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if self._total_size <= target:
+                break
+            try:
+                # Уже отображённые в память страницы остаются доступны до закрытия mmap
+                p.unlink()
+                self._total_size -= size
+            except FileNotFoundError:
+                continue
+
+
+_page_cache: Optional[RenderedPageCache] = None
+_page_cache_initialized = False
+
+
+def get_page_cache() -> Optional[RenderedPageCache]:
+    """Кэш страниц процесса или None, если он выключен (PDF_PAGE_CACHE_ENABLED=false)."""
+    global _page_cache, _page_cache_initialized
+
+    if _page_cache_initialized:
+        return _page_cache
+
+    if settings.PDF_PAGE_CACHE_ENABLED:
+        try:
+            _page_cache = RenderedPageCache(
+                settings.PDF_PAGE_CACHE_DIR,
+                settings.PDF_PAGE_CACHE_MAX_SIZE_MB * 1024 * 1024
+            )
+        except Exception as e:
+            print(f"[DEBUG] Кэш страниц PDF отключён: {str(e)}")
+            _page_cache = None
+
+    _page_cache_initialized = True
+    return _page_cache
@@ -0,0 +1,31 @@
+"""
+Выгрузка отрендеренных страниц во временные файлы.
+
+Крупная страница записывается в безымянный временный файл и отдаётся как
+memoryview над mmap — как страницы из кэша страниц. В памяти процесса остаются
+только отображения: данные подтягивает page cache ОС при кодировании в base64,
+поэтому пиковое потребление памяти не растёт с числом страниц документа.
+Файл удаляется сразу после создания и освобождается вместе с последней ссылкой
+на memoryview.
+"""
+import mmap
+import tempfile
+from typing import Union
+
+from config import settings
+
+
+def spool_page(data: bytes) -> Union[bytes, memoryview]:
+    """Страница во временном файле (memoryview) или исходные bytes, если она мала или выгрузка выключена."""
+    if not settings.PDF_SPOOL_ENABLED or len(data) < settings.PDF_SPOOL_MIN_KB * 1024:
+        return data
+
+    try:
+        with tempfile.TemporaryFile(dir=settings.PDF_SPOOL_DIR or None) as f:
+            f.write(data)
+            f.flush()
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError as e:
+        print(f"[DEBUG] Не удалось выгрузить страницу во временный файл: {str(e)}")
+        return data
+    return memoryview(mapped)
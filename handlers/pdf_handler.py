@@ -1,74 +1,279 @@
 import io
+import multiprocessing
+import os
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union, Iterator, Iterable, Optional
 
 import fitz
-from PIL import Image, ImageEnhance, ImageFilter
 from yu.extractors.csv import extract
 
+from config import settings
 from handlers.file_handler import FileHandler
+from handlers.page_cache import file_sha256, get_page_cache
+from handlers.page_spool import spool_page
+from handlers.render_presets import get_render_preset
 
 
-class PdfHandler(FileHandler):
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_pid: Optional[int] = None
+_render_pool_lock = threading.Lock()
+# Процесс, в котором пул создать нельзя (демон-процесс пула воркеров), — больше не пытаемся
+_render_pool_unavailable_pid: Optional[int] = None
 
-    def get_data_from_pdf_file(self, file_path: Path):
-        if self.is_pdf_text_based(file_path):
-            print('[DEBUG] PDF содержит текст, парсинг текстовым методом')
-            return self.extract_pdf_text(file_path)
-        print('[DEBUG] PDF сканированный, конвертация в изображения')
-        return self.pdf_to_images(file_path)
 
-    def pdf_to_images(self, file_path: Path) -> List[bytes]:
-        start_time = time.time()
+def _get_render_pool() -> Optional[ProcessPoolExecutor]:
+    """Пул процессов растеризации, один на процесс воркера (после fork создаётся заново)."""
+    global _render_pool, _render_pool_pid
 
-        images = []
-        doc = fitz.open(file_path)
-        total_pages = len(doc)
+    workers = settings.PDF_RENDER_WORKERS or os.cpu_count() or 1
+    if workers <= 1 or _render_pool_unavailable_pid == os.getpid():
+        return None
 
-        for page_num in range(total_pages):
-            page = doc.load_page(page_num)
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool_pid != os.getpid():
+            # spawn: воркер Celery многопоточный, fork такого процесса может зависнуть
+            _render_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _render_pool_pid = os.getpid()
+        return _render_pool
 
-            mat = fitz.Matrix(3.0, 3.0)
-            pix = page.get_pixmap(matrix=mat)
 
-            img_bytes = self._compress_image(pix.tobytes("png"))
-            images.append(img_bytes)
+def _discard_render_pool(unavailable: bool = False) -> None:
+    global _render_pool, _render_pool_unavailable_pid
 
-        doc.close()
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+        if unavailable:
+            _render_pool_unavailable_pid = os.getpid()
 
-        elapsed_time = time.time() - start_time
-        print(f"[DEBUG] PDF парсинг | mode=images | pages={total_pages} | time={elapsed_time:.2f}s")
-
-        return images
 
-    def _compress_image(self, png_bytes: bytes, max_size: int = 2048, quality: int = 95) -> bytes:
+def _render_page_range(file_path: str, page_numbers: List[int], preset: str) -> List[bytes]:
+    """Выполняется в процессе пула: открывает свой экземпляр документа и рендерит страницы."""
+    render_preset = get_render_preset(preset)
+    with fitz.open(file_path) as doc:
+        return [render_preset.render(doc.load_page(page_num)) for page_num in page_numbers]
 
-        img = Image.open(io.BytesIO(png_bytes))
 
-        if max(img.size) > max_size:
-            ratio = max_size / max(img.size)
-            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
+class PdfHandler(FileHandler):
+    # Страница считается текстовой, если в текстовом слое больше TEXT_PAGE_MIN_CHARS символов
+    TEXT_PAGE_MIN_CHARS = 30
+    # ...но если изображения занимают большую часть страницы, а текста мало (подпись, колонтитул),
+    # это скан с текстовой вставкой — такую страницу растеризуем
+    SCAN_IMAGE_COVERAGE = 0.5
+    SCAN_MAX_CHARS = 200
+
+    def get_data_from_pdf_file(self, file_path: Path) -> List[Union[Dict[str, Any], bytes, memoryview]]:
+        return list(self.iter_pdf_pages(file_path))
+
+    def iter_pdf_pages(self, file_path: Path) -> Iterator[Union[Dict[str, Any], bytes, memoryview]]:
+        """
+        Один проход по документу с классификацией каждой страницы: у страниц с текстовым
+        слоем берётся текст ({"page", "text"}, таблицы — в "tables"), растеризуются
+        только сканы (изображения).
+        Страницы отдаются в исходном порядке по мере готовности.
+        """
+        start_time = time.time()
 
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        with fitz.open(file_path) as doc:
+            total_pages = len(doc)
+            is_text: List[bool] = []
 
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(1.5)  # 1.5x резкость
+            for page_num in range(total_pages):
+                page = doc.load_page(page_num)
+                is_text.append(self._is_text_page(page, page.get_text("text").strip()))
 
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.3)  # 1.3x контраст
+            scan_pages = [page_num for page_num in range(total_pages) if not is_text[page_num]]
+            rendered = self._iter_rendered_pages(file_path, doc, scan_pages)
 
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(1.1)  # 1.1x яркость
+            for page_num in range(total_pages):
+                if is_text[page_num]:
+                    yield self._extract_text_page(doc.load_page(page_num))
+                else:
+                    yield next(rendered)
 
-        buffer = io.BytesIO()
+        elapsed_time = time.time() - start_time
+        print(f"[DEBUG] PDF парсинг | mode=hybrid | pages={total_pages} | text={total_pages - len(scan_pages)} | images={len(scan_pages)} | time={elapsed_time:.2f}s")
+
+    def _extract_text_page(self, page: fitz.Page) -> Dict[str, Any]:
+        """
+        Текст страницы с сохранением структуры таблиц: таблицы (find_tables) выдаются
+        отдельно в компактном виде, в "text" остаётся только текст вне таблиц.
+        """
+        mode = (settings.PDF_TABLE_EXTRACTION or "off").lower()
+        if mode == "off":
+            return {"page": page.number + 1, "text": page.get_text("text").strip()}
+
+        try:
+            tables = [table for table in page.find_tables().tables if table.row_count >= 2]
+        except Exception as e:
+            print(f"[DEBUG] Поиск таблиц на странице {page.number + 1} не удался: {str(e)}")
+            tables = []
+
+        if not tables:
+            return {"page": page.number + 1, "text": page.get_text("text").strip()}
+
+        table_rects = [fitz.Rect(table.bbox) for table in tables]
+        prose = []
+        for x0, y0, x1, y1, block_text, _, block_type in page.get_text("blocks"):
+            block = fitz.Rect(x0, y0, x1, y1)
+            block_area = abs(block) or 1
+            # Блок, большей частью лежащий в таблице, уже есть в её строках
+            if block_type == 0 and all(abs(block & rect) / block_area < 0.5 for rect in table_rects):
+                prose.append(block_text.strip())
+
+        return {
+            "page": page.number + 1,
+            "text": "\n".join(line for line in prose if line),
+            "tables": [self._format_table(table.extract(), mode) for table in tables],
+        }
+
+    @staticmethod
+    def _format_table(rows: List[List[Optional[str]]], mode: str) -> str:
+        """
+        Таблица в компактном виде: две колонки — пары "ключ: значение" (режим auto/kv),
+        иначе TSV. Переносы внутри ячеек заменяются пробелами, пустые строки пропускаются.
+        """
+        cleaned = []
+        for row in rows:
+            cells = [" ".join((cell or "").split()) for cell in row]
+            if any(cells):
+                cleaned.append(cells)
+
+        width = max((len(row) for row in cleaned), default=0)
+        if mode in ("auto", "kv") and width == 2:
+            return "\n".join(f"{key}: {value}" if value else key for key, value in cleaned)
+        if mode == "kv":
+            # Первая колонка — ключ, остальные значения через " | "
+            return "\n".join(f"{row[0]}: {' | '.join(c for c in row[1:] if c)}" for row in cleaned)
+        return "\n".join("\t".join(row) for row in cleaned)
+
+    def _is_text_page(self, page: fitz.Page, text: str) -> bool:
+        if len(text) <= self.TEXT_PAGE_MIN_CHARS:
+            return False
+        if len(text) >= self.SCAN_MAX_CHARS:
+            return True
+
+        page_area = abs(page.rect) or 1
+        image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+        return image_area / page_area < self.SCAN_IMAGE_COVERAGE
+
+    def _render_page(self, page: fitz.Page, preset: Optional[str] = None) -> bytes:
+        return get_render_preset(preset).render(page)
+
+    def _iter_rendered_pages(self, file_path: Path, doc: fitz.Document, page_numbers: Iterable[int]) -> Iterator[Union[bytes, memoryview]]:
+        """
+        Страницы из кэша отрендеренных страниц отдаются без растеризации (memoryview
+        над mmap), остальные рендерятся и сохраняются в кэш. Порядок страниц сохраняется.
+        Отрендеренные страницы тоже отдаются как memoryview над файлом (из кэша или
+        временным), чтобы список страниц документа не держал их байты в памяти.
+        """
+        page_numbers = list(page_numbers)
+        preset = get_render_preset()
+        cache = get_page_cache() if page_numbers else None
+
+        if cache is None:
+            for image in self._render_pages_in_order(file_path, doc, page_numbers, preset.name):
+                yield spool_page(image)
+            return
+
+        file_hash = file_sha256(file_path)
+        preset_key = preset.cache_key
+
+        cached = {}
+        for page_num in page_numbers:
+            view = cache.get(file_hash, page_num, preset_key)
+            if view is not None:
+                cached[page_num] = view
+
+        if cached:
+            print(f"[DEBUG] Кэш страниц PDF: {len(cached)}/{len(page_numbers)} страниц без растеризации")
+
+        missing = [page_num for page_num in page_numbers if page_num not in cached]
+        rendered = self._render_pages_in_order(file_path, doc, missing, preset.name)
+
+        for page_num in page_numbers:
+            if page_num in cached:
+                yield cached.pop(page_num)
+                continue
+
+            image = next(rendered)
+            view = None
+            try:
+                cache.set(file_hash, page_num, preset_key, image)
+                view = cache.get(file_hash, page_num, preset_key)
+            except Exception as e:
+                print(f"[DEBUG] Не удалось сохранить страницу в кэш: {str(e)}")
+            yield view if view is not None else spool_page(image)
+
+    def _render_pages_in_order(self, file_path: Path, doc: fitz.Document, page_numbers: List[int], preset: str) -> Iterator[bytes]:
+        """
+        Растеризация и постобработка страниц в пуле процессов диапазонами по
+        PDF_RENDER_CHUNK_PAGES. Страницы отдаются строго по порядку: пока потребитель
+        обрабатывает первый диапазон, остальные рендерятся на других ядрах.
+        Вперёд рендерится не больше PDF_RENDER_PREFETCH_CHUNKS диапазонов, чтобы готовые,
+        но ещё не забранные страницы не копились в памяти.
+        Если пул недоступен, страницы рендерятся в текущем процессе.
+        """
+        chunk_size = max(1, settings.PDF_RENDER_CHUNK_PAGES)
+        chunks = [page_numbers[i:i + chunk_size] for i in range(0, len(page_numbers), chunk_size)]
+        prefetch = max(1, settings.PDF_RENDER_PREFETCH_CHUNKS)
+
+        pool = _get_render_pool() if len(chunks) > 1 else None
+        futures = {}
+
+        def submit_ahead(start: int) -> None:
+            nonlocal pool
+            for idx in range(start, min(start + prefetch, len(chunks))):
+                if pool is None:
+                    return
+                if idx in futures:
+                    continue
+                try:
+                    futures[idx] = pool.submit(_render_page_range, str(file_path), chunks[idx], preset)
+                except Exception as e:
+                    # Например, "daemonic processes are not allowed to have children"
+                    print(f"[DEBUG] Пул растеризации недоступен, рендер в текущем процессе: {str(e)}")
+                    _discard_render_pool(unavailable=True)
+                    pool = None
+
+        try:
+            for chunk_idx, chunk in enumerate(chunks):
+                submit_ahead(chunk_idx)
+                images = None
+                future = futures.pop(chunk_idx, None)
+                if future is not None:
+                    try:
+                        images = future.result()
+                    except BrokenProcessPool as e:
+                        print(f"[DEBUG] Пул растеризации упал, рендер в текущем процессе: {str(e)}")
+                        _discard_render_pool()
+                        pool = None
+
+                if images is None:
+                    images = [self._render_page(doc.load_page(page_num), preset) for page_num in chunk]
+
+                yield from images
+        finally:
+            # Генератор закрыт досрочно — не рендерим оставшиеся страницы зря
+            for future in futures.values():
+                future.cancel()
+
+    def pdf_to_images(self, file_path: Path) -> List[Union[bytes, memoryview]]:
+        start_time = time.time()
 
-        img.save(buffer, format='PNG', optimize=True)
+        with fitz.open(file_path) as doc:
+            total_pages = len(doc)
+            images = list(self._iter_rendered_pages(file_path, doc, range(total_pages)))
 
+        elapsed_time = time.time() - start_time
+        print(f"[DEBUG] PDF парсинг | mode=images | pages={total_pages} | time={elapsed_time:.2f}s")
 
-        return buffer.getvalue()
+        return images
 
     def is_pdf_text_based(self, file_path: Path) -> bool:
         doc = fitz.open(file_path)
@@ -100,12 +305,7 @@ class PdfHandler(FileHandler):
 
         for page_number in range(total_pages):
             page = doc.load_page(page_number)
-            text = page.get_text("text")  # чистый текст
-
-            pages.append({
-                "page": page_number + 1,
-                "text": text.strip()
-            })
+            pages.append(self._extract_text_page(page))
 
         doc.close()
 
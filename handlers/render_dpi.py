@@ -0,0 +1,97 @@
+"""
+Выбор разрешения растеризации для каждой страницы.
+
+Вместо фиксированного масштаба DPI подбирается по содержимому страницы:
+- есть текстовый слой (в том числе OCR-слой скана) — по размеру самого мелкого
+  текста, чтобы строка занимала PDF_RENDER_TARGET_FONT_PX пикселей;
+- текста нет — по плотности «чернил» на пробном рендере в низком разрешении:
+  плотные таблицы получают больше пикселей, почти пустые страницы — меньше;
+- для сканов DPI не поднимается выше собственного разрешения изображения —
+  лишние пиксели не добавляют информации.
+Результат ограничен PDF_RENDER_MIN_DPI..PDF_RENDER_MAX_DPI.
+"""
+from typing import List, Tuple
+
+import fitz
+from PIL import Image
+
+from config import settings
+
+
+PDF_DPI = 72
+# Пробный рендер для оценки плотности
+PROBE_DPI = 36
+# Пиксель считается «чернилами», если он темнее фона на INK_CONTRAST
+INK_CONTRAST = 50
+# Доля чернил, ниже которой страница разреженная (минимальный DPI), и выше которой плотная (максимальный)
+SPARSE_INK = 0.02
+DENSE_INK = 0.12
+# Мелкий текст — этот перцентиль размеров шрифта на странице (единичные сноски не в счёт)
+SMALL_FONT_PERCENTILE = 0.2
+# Изображение считается сканом страницы, если занимает такую долю её площади
+SCAN_IMAGE_COVERAGE = 0.5
+
+
+def _font_sizes(page: fitz.Page) -> List[float]:
+    sizes = []
+    for block in page.get_text("dict")["blocks"]:
+        if block.get("type") != 0:
+            continue
+        for line in block["lines"]:
+            for span in line["spans"]:
+                if span["text"].strip() and span["size"] > 0:
+                    sizes.append(span["size"])
+    return sorted(sizes)
+
+
+def _ink_coverage(page: fitz.Page) -> float:
+    zoom = PROBE_DPI / PDF_DPI
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    histogram = Image.frombytes("L", (pix.width, pix.height), pix.samples).histogram()
+    total = max(pix.width * pix.height, 1)
+
+    # Фон — уровень, ниже которого лежат 90% пикселей (сканы бывают серыми)
+    count = 0
+    background = 255
+    for level, pixels in enumerate(histogram):
+        count += pixels
+        if count >= total * 0.9:
+            background = level
+            break
+    return sum(histogram[:max(0, background - INK_CONTRAST)]) / total
+
+
+def _native_scan_dpi(page: fitz.Page) -> float:
+    """Разрешение скана, занимающего страницу, или 0, если такого изображения нет."""
+    page_area = abs(page.rect) or 1
+    best = 0.0
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"])
+        if abs(bbox & page.rect) / page_area < SCAN_IMAGE_COVERAGE or bbox.width <= 0:
+            continue
+        best = max(best, info["width"] * PDF_DPI / bbox.width)
+    return best
+
+
+def choose_render_dpi(page: fitz.Page) -> Tuple[float, str]:
+    """DPI растеризации страницы и причина выбора (для отладки и отчёта бенчмарка)."""
+    min_dpi = settings.PDF_RENDER_MIN_DPI
+    max_dpi = settings.PDF_RENDER_MAX_DPI
+
+    sizes = _font_sizes(page)
+    if sizes:
+        small_font = sizes[int(len(sizes) * SMALL_FONT_PERCENTILE)]
+        dpi = settings.PDF_RENDER_TARGET_FONT_PX * PDF_DPI / small_font
+        reason = f"font={small_font:.1f}pt"
+    else:
+        ink = _ink_coverage(page)
+        density = min(1.0, max(0.0, (ink - SPARSE_INK) / (DENSE_INK - SPARSE_INK)))
+        dpi = min_dpi + (max_dpi - min_dpi) * density
+        reason = f"ink={ink:.3f}"
+
+    native_dpi = _native_scan_dpi(page)
+    if native_dpi and dpi > native_dpi:
+        dpi = native_dpi
+        reason += f" native={native_dpi:.0f}"
+
+    return min(max_dpi, max(min_dpi, dpi)), reason
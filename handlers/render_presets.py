@@ -0,0 +1,149 @@
+"""
+Пресеты растеризации страниц PDF для vision-запросов.
+
+Страница рендерится сразу в целевом размере (без рендера в 3x и последующего
+LANCZOS), в нужном цветовом пространстве; улучшения резкости/контраста/яркости
+включаются пресетом. Кодек и качество выбираются под тип документа:
+фото сканов — JPEG/WebP, текстовые страницы — оттенки серого или ч/б.
+"""
+import io
+from typing import Dict, Optional, Union
+
+import fitz
+from PIL import Image, ImageEnhance
+
+from config import settings
+from handlers.render_dpi import PDF_DPI, choose_render_dpi
+
+
+# Фиксированный масштаб рендера без PDF_RENDER_ADAPTIVE (прежний Matrix(3.0, 3.0))
+MAX_ZOOM = 3.0
+
+
+class RenderPreset:
+
+    def __init__(
+        self,
+        name: str,
+        image_format: str = "PNG",
+        quality: Optional[int] = None,
+        grayscale: bool = False,
+        binarize_threshold: Optional[int] = None,
+        enhance: bool = False,
+        optimize: bool = False,
+        max_size: Optional[int] = None
+    ):
+        self.name = name
+        self.image_format = image_format
+        self.quality = quality
+        self.grayscale = grayscale or binarize_threshold is not None
+        self.binarize_threshold = binarize_threshold
+        self.enhance = enhance
+        self.optimize = optimize
+        self._max_size = max_size
+
+    @property
+    def max_size(self) -> int:
+        if self._max_size:
+            return self._max_size
+        # Крупную страницу нарежут на фрагменты — рендерим её в большем разрешении
+        if settings.PAGE_TILING_ENABLED:
+            return max(settings.PDF_RENDER_MAX_SIZE, settings.PAGE_TILING_RENDER_MAX_SIZE)
+        return settings.PDF_RENDER_MAX_SIZE
+
+    def __repr__(self) -> str:
+        return f"RenderPreset({self.name})"
+
+    @property
+    def cache_key(self) -> str:
+        """Ключ пресета в кэше страниц: всё, от чего зависит результат рендера."""
+        if settings.PDF_RENDER_ADAPTIVE:
+            return (
+                f"{self.name}-{self.max_size}-dpi{settings.PDF_RENDER_MIN_DPI}"
+                f"-{settings.PDF_RENDER_MAX_DPI}-{settings.PDF_RENDER_TARGET_FONT_PX}"
+            )
+        return f"{self.name}-{self.max_size}"
+
+    def render(self, page: fitz.Page) -> bytes:
+        return self.encode(self.postprocess(self.rasterize(page)))
+
+    def zoom_for(self, page: fitz.Page, adaptive: Optional[bool] = None) -> float:
+        """
+        Масштаб рендера: по DPI, подобранному под страницу (PDF_RENDER_ADAPTIVE), или
+        прежний фиксированный MAX_ZOOM. В обоих случаях длинная сторона не больше max_size.
+        """
+        adaptive = settings.PDF_RENDER_ADAPTIVE if adaptive is None else adaptive
+        zoom = choose_render_dpi(page)[0] / PDF_DPI if adaptive else MAX_ZOOM
+
+        longest_side = max(page.rect.width, page.rect.height) or 1
+        return min(zoom, self.max_size / longest_side)
+
+    def rasterize(self, page: fitz.Page, adaptive: Optional[bool] = None) -> Image.Image:
+        """Рендер страницы сразу в целевом размере (см. zoom_for)."""
+        zoom = self.zoom_for(page, adaptive)
+
+        colorspace = fitz.csGRAY if self.grayscale else fitz.csRGB
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+        return Image.frombytes("L" if self.grayscale else "RGB", (pix.width, pix.height), pix.samples)
+
+    def postprocess(self, img: Image.Image) -> Image.Image:
+        if self.enhance:
+            img = ImageEnhance.Sharpness(img).enhance(1.5)  # 1.5x резкость
+            img = ImageEnhance.Contrast(img).enhance(1.3)  # 1.3x контраст
+            img = ImageEnhance.Brightness(img).enhance(1.1)  # 1.1x яркость
+
+        if self.binarize_threshold is not None:
+            threshold = self.binarize_threshold
+            img = img.point(lambda value: 255 if value > threshold else 0, mode="1")
+
+        return img
+
+    def encode(self, img: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        params = {}
+        if self.quality is not None:
+            params["quality"] = self.quality
+        if self.optimize:
+            params["optimize"] = True
+        if self.image_format == "WEBP":
+            # method 4 — компромисс скорости и размера (по умолчанию у Pillow 4, максимум 6)
+            params["method"] = 4
+
+        img.save(buffer, format=self.image_format, **params)
+        return buffer.getvalue()
+
+
+RENDER_PRESETS: Dict[str, RenderPreset] = {
+    # Прежнее поведение: PNG с улучшениями и optimize — максимум качества, самый медленный
+    "png": RenderPreset("png", "PNG", enhance=True, optimize=True),
+    "jpeg": RenderPreset("jpeg", "JPEG", quality=85),
+    "webp": RenderPreset("webp", "WEBP", quality=80),
+    # Для текстовых страниц: цвет модели не нужен
+    "gray": RenderPreset("gray", "JPEG", quality=85, grayscale=True),
+    "binary": RenderPreset("binary", "PNG", binarize_threshold=180),
+}
+
+
+def get_render_preset(name: Optional[str] = None) -> RenderPreset:
+    name = (name or settings.PDF_RENDER_PRESET or "png").lower()
+    if name not in RENDER_PRESETS:
+        raise ValueError(f"Неизвестный пресет растеризации '{name}'. Доступны: {', '.join(RENDER_PRESETS)}")
+    return RENDER_PRESETS[name]
+
+
+# Закодированная страница: bytes после рендера или memoryview над mmap из кэша страниц
+IMAGE_DATA_TYPES = (bytes, bytearray, memoryview)
+
+
+def is_image_data(value) -> bool:
+    return isinstance(value, IMAGE_DATA_TYPES)
+
+
+def get_image_mime_type(img_bytes: Union[bytes, memoryview]) -> str:
+    """MIME-тип изображения по сигнатуре (для data URL в vision-запросах)."""
+    header = bytes(img_bytes[:12])
+    if header.startswith(b"\x89PNG"):
+        return "image/png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
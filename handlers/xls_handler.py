@@ -1,6 +1,7 @@
+import datetime
 import time
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 
 from openpyxl import load_workbook
 import xlrd
@@ -9,74 +10,140 @@ from handlers.file_handler import FileHandler
 
 
 class XlsHandler(FileHandler):
+    # Заголовок таблицы ищется среди первых строк листа
+    HEADER_SCAN_ROWS = 10
+    # Строка — заголовок, если текстом заполнена хотя бы такая доля колонок
+    HEADER_MIN_FILL = 0.5
 
     def get_data_from_xls_file(self, file_path: Path) -> List[Dict[str, Any]]:
         start_time = time.time()
+        stats = {"rows": 0, "dropped_columns": 0}
 
-        file_extension = file_path.suffix.lower()
-
-        if file_extension == '.xls':
-            return self._parse_xls(file_path, start_time)
-        else:
-            return self._parse_xlsx(file_path, start_time)
-
-    def _parse_xls(self, file_path: Path, start_time: float) -> List[Dict[str, Any]]:
-        workbook = xlrd.open_workbook(file_path)
-        sheets_data = []
-        total_rows = 0
-
-        for sheet in workbook.sheets():
-            sheet_rows = []
-
-            for row_idx in range(sheet.nrows):
-                row = sheet.row(row_idx)
-                row_cells = [
-                    str(cell.value).strip() if cell.value is not None else ""
-                    for cell in row
-                ]
-                # Пропускаем полностью пустые строки
-                if any(cell for cell in row_cells):
-                    sheet_rows.append(row_cells)
-                    total_rows += 1
-
-            sheets_data.append({
-                "sheet_name": sheet.name,
-                "rows": sheet_rows
-            })
+        sheets_data = list(self.iter_xls_sheets(file_path, stats))
 
         elapsed_time = time.time() - start_time
-        print(f"[DEBUG] XLS парсинг (xlrd) | sheets={len(workbook.sheets())} | rows={total_rows} | time={elapsed_time:.2f}s")
+        engine = "xlrd" if Path(file_path).suffix.lower() == '.xls' else "openpyxl"
+        print(
+            f"[DEBUG] XLS парсинг ({engine}, stream) | sheets={len(sheets_data)} | rows={stats['rows']} | "
+            f"dropped_columns={stats['dropped_columns']} | time={elapsed_time:.2f}s"
+        )
 
         return sheets_data
 
-    def _parse_xlsx(self, file_path: Path, start_time: float) -> List[Dict[str, Any]]:
-        workbook = load_workbook(filename=file_path, data_only=True)
-        sheets_data = []
-        total_rows = 0
-
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-
-            sheet_rows = []
-            for row in sheet.iter_rows(values_only=True):
-
-                row_cells = [
-                    str(cell).strip() if cell is not None else ""
-                    for cell in row
-                ]
-                # Пропускаем полностью пустые строки
-                if any(cell for cell in row_cells):
-                    sheet_rows.append(row_cells)
-                    total_rows += 1
-
-            sheets_data.append({
-                "sheet_name": sheet_name,
-                "rows": sheet_rows
-            })
-
-        workbook.close()
-
-        elapsed_time = time.time() - start_time
-        print(f"[DEBUG] XLSX парсинг (openpyxl) | sheets={len(workbook.sheetnames)} | rows={total_rows} | time={elapsed_time:.2f}s")
-
-        return sheets_data
\ No newline at end of file
+    def iter_xls_sheets(self, file_path: Path, stats: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Листы книги по одному: {"sheet_name", "title", "header", "rows"}. Книга читается
+        в режиме read-only (openpyxl) или on_demand (xlrd) — в памяти только текущий лист
+        в виде строк. Пустые строки, пустые колонки и хвостовые пустые ячейки отбрасываются;
+        строка заголовка таблицы выносится в "header", строки над ней — в "title".
+        """
+        file_path = Path(file_path)
+        stats = stats if stats is not None else {"rows": 0, "dropped_columns": 0}
+
+        if file_path.suffix.lower() == '.xls':
+            sheets = self._iter_xls_rows(file_path)
+        else:
+            sheets = self._iter_xlsx_rows(file_path)
+
+        for sheet_name, rows in sheets:
+            yield self._build_sheet(sheet_name, rows, stats)
+
+    def _iter_xls_rows(self, file_path: Path) -> Iterator[tuple]:
+        workbook = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            for sheet_idx in range(workbook.nsheets):
+                sheet = workbook.sheet_by_index(sheet_idx)
+                rows = (
+                    [self._cell_text(cell.value, cell.ctype, workbook.datemode) for cell in sheet.row(row_idx)]
+                    for row_idx in range(sheet.nrows)
+                )
+                yield sheet.name, rows
+                workbook.unload_sheet(sheet_idx)
+        finally:
+            workbook.release_resources()
+
+    def _iter_xlsx_rows(self, file_path: Path) -> Iterator[tuple]:
+        workbook = load_workbook(filename=file_path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                rows = ([self._cell_text(value) for value in row] for row in sheet.iter_rows(values_only=True))
+                yield sheet.title, rows
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def _cell_text(value, ctype: Optional[int] = None, datemode: int = 0) -> str:
+        if value is None:
+            return ""
+        if ctype == xlrd.XL_CELL_DATE:
+            try:
+                value = xlrd.xldate_as_datetime(value, datemode)
+            except Exception:
+                pass
+        if isinstance(value, float) and value.is_integer():
+            # xlrd отдаёт все числа как float: 12.0 -> "12"
+            value = int(value)
+        if isinstance(value, datetime.datetime) and value.time() == datetime.time(0):
+            value = value.date()
+        # Переводы строк внутри ячейки сохраняются — по ним делятся списки характеристик
+        return "\n".join(" ".join(line.split()) for line in str(value).splitlines() if line.strip())
+
+    def _build_sheet(self, sheet_name: str, rows: Iterator[List[str]], stats: Dict[str, int]) -> Dict[str, Any]:
+        sheet_rows = []
+        used_columns = set()
+
+        for row in rows:
+            # Хвостовые пустые ячейки (форматирование до конца листа) не нужны
+            while row and not row[-1]:
+                row.pop()
+            if not row:
+                continue
+            used_columns.update(idx for idx, cell in enumerate(row) if cell)
+            sheet_rows.append(row)
+
+        width = max(used_columns) + 1 if used_columns else 0
+        keep = [idx for idx in range(width) if idx in used_columns]
+        stats["dropped_columns"] += width - len(keep)
+        if len(keep) < width:
+            sheet_rows = [[row[idx] if idx < len(row) else "" for idx in keep] for row in sheet_rows]
+            for row in sheet_rows:
+                while row and not row[-1]:
+                    row.pop()
+
+        header_idx = self._find_header_row(sheet_rows, len(keep))
+        stats["rows"] += len(sheet_rows)
+
+        if header_idx is None:
+            return {"sheet_name": sheet_name, "title": [], "header": None, "rows": sheet_rows}
+
+        return {
+            "sheet_name": sheet_name,
+            "title": [" ".join(cell for cell in row if cell) for row in sheet_rows[:header_idx]],
+            "header": sheet_rows[header_idx],
+            "rows": sheet_rows[header_idx + 1:],
+        }
+
+    def _find_header_row(self, rows: List[List[str]], width: int) -> Optional[int]:
+        """
+        Первая строка среди HEADER_SCAN_ROWS, где текстом (не числами) заполнено не меньше
+        HEADER_MIN_FILL колонок и под которой есть данные. Строки выше — название таблицы.
+        """
+        if width < 2:
+            return None
+
+        for idx, row in enumerate(rows[:self.HEADER_SCAN_ROWS]):
+            filled = [cell for cell in row if cell]
+            if len(filled) < max(2, width * self.HEADER_MIN_FILL):
+                continue
+            if any(self._is_number(cell) for cell in filled):
+                continue
+            return idx if idx + 1 < len(rows) else None
+        return None
+
+    @staticmethod
+    def _is_number(text: str) -> bool:
+        try:
+            float(text.replace(",", ".").replace(" ", ""))
+            return True
+        except ValueError:
+            return False
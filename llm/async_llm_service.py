@@ -0,0 +1,442 @@
+"""
+Асинхронный аналог LLMService.
+
+Все запросы к LLM выполняются на одном event loop, поэтому воркер не простаивает
+во время долгих vision-запросов: страницы и сравнения идут одновременно.
+Параллелизм ограничен глобальным семафором и семафором на провайдера.
+"""
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+from config import settings
+from llm.http_transport import create_async_http_client
+from llm.llm_provider import LLMTarget
+from llm.llm_service import LLMService
+from llm.page_batcher import create_page_batcher
+from llm.rate_limiter import estimate_messages_tokens, get_rate_limiter
+from llm.resilience import async_call_with_resilience
+from services import prompts_service
+from utils.json_stream import IncrementalJsonParser
+from utils.prompt_serializer import build_text_prompt
+
+
+# Семафоры привязаны к event loop, поэтому храним их отдельно для каждого loop
+_loop_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _parse_provider_limits(value: str) -> Dict[str, int]:
+    limits = {}
+    for part in (value or "").split(","):
+        if ":" not in part:
+            continue
+        name, limit = part.split(":", 1)
+        try:
+            limits[name.strip()] = int(limit)
+        except ValueError:
+            continue
+    return limits
+
+
+def _get_semaphores(provider: str):
+    loop = asyncio.get_running_loop()
+    state = _loop_semaphores.get(loop)
+
+    if state is None:
+        state = {
+            "global": asyncio.Semaphore(settings.LLM_ASYNC_MAX_CONCURRENCY),
+            "providers": {},
+        }
+        _loop_semaphores[loop] = state
+
+    provider_semaphore = state["providers"].get(provider)
+    if provider_semaphore is None:
+        limits = _parse_provider_limits(settings.LLM_ASYNC_PROVIDER_CONCURRENCY)
+        provider_semaphore = asyncio.Semaphore(limits.get(provider, settings.LLM_MAX_CONCURRENCY))
+        state["providers"][provider] = provider_semaphore
+
+    return state["global"], provider_semaphore
+
+
+class AsyncLLMService(LLMService):
+
+    def __init__(self, target: Optional[LLMTarget] = None):
+        super().__init__(target)
+        self._http: Optional[httpx.AsyncClient] = None
+        self._openai: Optional[AsyncOpenAI] = None
+
+    def _get_http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = create_async_http_client()
+        return self._http
+
+    def _get_openai(self) -> AsyncOpenAI:
+        if self._openai is None:
+            http_client = self._get_http()
+            self._openai = AsyncOpenAI(
+                api_key=self.provider.api_key,
+                http_client=http_client,
+                timeout=http_client.timeout,
+            )
+        return self._openai
+
+    def _create_fallback_service(self, target: LLMTarget) -> 'AsyncLLMService':
+        service = super()._create_fallback_service(target)
+        # Резервные сервисы используют пул соединений основного и закрываются вместе с ним
+        service._http = self._get_http()
+        return service
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._openai = None
+
+    @asynccontextmanager
+    async def _limit(self):
+        global_semaphore, provider_semaphore = _get_semaphores(self.provider_name)
+        async with global_semaphore:
+            async with provider_semaphore:
+                yield
+
+    async def extract_characteristics_via_llm(self, input_data, prompt):
+        input_data = self._collect_pages(input_data)
+        mixed = self._split_mixed_pages(input_data)
+        if mixed is not None:
+            text_pages, images = mixed
+            print(f"[DEBUG] Смешанный документ (async) | текстовых страниц={len(text_pages)} | сканов={len(images)}")
+            # Текстовые страницы и сканы извлекаются одновременно
+            results = await asyncio.gather(
+                self.extract_characteristics_via_llm(text_pages, prompt),
+                self.extract_characteristics_via_llm(images, prompt),
+            )
+            return self._reduce_page_results(list(results))
+
+        try:
+            if self._is_image_batch(input_data):
+                if settings.PASSPORT_EXTRACTION_MODE == 'parallel':
+                    return await self._extract_images_parallel(input_data, prompt)
+
+                accumulated_data = {}
+
+                batcher = create_page_batcher(self.pages_per_request, self.max_tokens)
+                total_pages = len(input_data)
+                page_idx = 0
+                batch_idx = 0
+                last_error: Optional[Exception] = None
+
+                print(f"[DEBUG] Обработка {total_pages} страниц (async) | до {batcher.max_pages} страниц на запрос")
+
+                while page_idx < total_pages:
+                    batch_start = time.time()
+
+                    if batch_idx == 0:
+                        current_prompt = prompt
+                    else:
+                        current_prompt = prompts_service._create_passport_iterative_prompt(accumulated_data, prompt)
+
+                    batch_size = batcher.take(input_data, page_idx, current_prompt)
+                    batch = input_data[page_idx:page_idx + batch_size]
+
+                    try:
+                        new_data = await self._extract_batch_data(batch, current_prompt, page_idx + 1)
+                    except Exception as e:
+                        # Несработавший батч пропускается, остальные страницы извлекаются
+                        batcher.record(batch_size, time.time() - batch_start, success=False)
+                        self._record_failed_scans(page_idx + 1, batch_size, e)
+                        last_error = e
+                        page_idx += batch_size
+                        continue
+
+                    batch_elapsed = time.time() - batch_start
+                    batcher.record(batch_size, batch_elapsed, success=True)
+
+                    accumulated_data = self._merge_data(accumulated_data, new_data)
+                    page_idx += batch_size
+                    batch_idx += 1
+
+                    print(f"[DEBUG] Батч {batch_idx} | страницы {page_idx - batch_size + 1}-{page_idx}/{total_pages} | time={batch_elapsed:.2f}s | характеристик={len(accumulated_data)}")
+
+                if last_error is not None and batch_idx == 0:
+                    raise ValueError(f"не обработан ни один батч сканов ({str(last_error)})")
+                return accumulated_data
+
+            full_prompt = build_text_prompt(prompt, input_data)
+
+            cache_key = self._cache_key(full_prompt, temperature=self.TEXT_TEMPERATURE.get(self.provider_name))
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+            served, content = await async_call_with_resilience(
+                lambda service: service._served_by(service._analyze_text(full_prompt, prompt, input_data)),
+                self._service_chain()
+            )
+            result = self._parse_json_response(content)
+            served._cache_result(full_prompt, None, served.TEXT_TEMPERATURE, result)
+
+            return result
+
+        except Exception as e:
+            raise ValueError(f"Ошибка: {str(e)}")
+
+    async def _extract_batch_data(self, batch: List[bytes], prompt: str, first_scan: int = 1) -> Dict[str, Any]:
+        cache_key = self._cache_key(prompt, batch, self.IMAGE_TEMPERATURE.get(self.provider_name))
+        data = self._cache_get(cache_key)
+
+        if data is None:
+            try:
+                served, response = await self._analyze_images_batch(batch, prompt)
+            except Exception as e:
+                if len(batch) == 1:
+                    raise
+                print(f"[DEBUG] Батч из {len(batch)} страниц не обработан ({str(e)[:200]}), повтор по одной странице")
+                results = await asyncio.gather(
+                    *(self._extract_batch_data([page], prompt, first_scan + offset) for offset, page in enumerate(batch)),
+                    return_exceptions=True
+                )
+                if all(isinstance(r, BaseException) for r in results):
+                    raise
+                for offset, result in enumerate(results):
+                    if isinstance(result, BaseException):
+                        self._record_failed_scans(first_scan + offset, 1, result)
+                return self._reduce_page_results([r for r in results if not isinstance(r, BaseException)])
+
+            data = self._parse_json_response(response)
+            served._cache_result(prompt, batch, served.IMAGE_TEMPERATURE, data)
+
+        return data
+
+    async def _extract_images_parallel(self, images: List[bytes], prompt: str) -> Dict[str, Any]:
+        start_time = time.time()
+
+        batches = create_page_batcher(self.pages_per_request, self.max_tokens).split(images, prompt)
+        print(f"[DEBUG] Параллельная обработка {len(batches)} батчей (async)")
+
+        first_scans = [1]
+        for batch in batches[:-1]:
+            first_scans.append(first_scans[-1] + len(batch))
+
+        # Одновременность ограничивают семафоры в _limit, gather сохраняет порядок страниц;
+        # несработавший батч пропускается, ошибка — только если не прошёл ни один
+        results = await asyncio.gather(
+            *(self._extract_batch_data(batch, prompt, first) for batch, first in zip(batches, first_scans)),
+            return_exceptions=True
+        )
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for batch, first, result in zip(batches, first_scans, results):
+            if isinstance(result, BaseException):
+                self._record_failed_scans(first, len(batch), result)
+        if batches and len(errors) == len(batches):
+            raise ValueError(f"не обработан ни один батч сканов ({str(errors[0])})")
+
+        merged = self._reduce_page_results([r for r in results if not isinstance(r, BaseException)])
+
+        elapsed = time.time() - start_time
+        print(f"[DEBUG] Параллельная обработка завершена | time={elapsed:.2f}s | характеристик={len(merged)}")
+
+        return merged
+
+    async def extract_chunks_via_llm(
+            self,
+            chunks: List[Any],
+            prompt: str,
+            failed_chunks: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        start_time = time.time()
+        print(f"[DEBUG] Параллельная обработка {len(chunks)} частей документа (async)")
+
+        results = await asyncio.gather(
+            *(self.extract_characteristics_via_llm(chunk, prompt) for chunk in chunks),
+            return_exceptions=True
+        )
+
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for chunk_idx, result in enumerate(results):
+            if isinstance(result, BaseException):
+                if failed_chunks is not None:
+                    failed_chunks.append({"chunk": chunk_idx + 1, "error": str(result)[:200]})
+                print(f"[DEBUG] Часть {chunk_idx + 1}/{len(chunks)} не обработана: {str(result)[:200]}")
+        if len(errors) == len(chunks):
+            raise ValueError(f"Ошибка: не обработана ни одна часть документа ({str(errors[0])})")
+
+        merged = self._reduce_page_results([r for r in results if not isinstance(r, BaseException)])
+
+        elapsed = time.time() - start_time
+        print(f"[DEBUG] Параллельная обработка частей завершена | time={elapsed:.2f}s | ошибок={len(errors)}")
+
+        return merged
+
+    async def _acquire_rate_limit(self, messages: List[Dict[str, Any]]) -> None:
+        # Ждём квоту до захвата семафора, чтобы ожидание не занимало слот параллелизма
+        await get_rate_limiter().acquire_async(self.target.key, estimate_messages_tokens(messages))
+
+    async def _post(self, url: str, data: Dict[str, Any], headers: Dict[str, str]) -> str:
+        await self._acquire_rate_limit(data['messages'])
+
+        if settings.LLM_STREAMING:
+            return await self._post_stream(url, data, headers)
+
+        async with self._limit():
+            response = await self._get_http().post(url, json=data, headers=headers)
+
+        if response.status_code != 200:
+            print(f"[DEBUG] Ошибка {response.status_code}: {response.text[:500]}")
+
+        response.raise_for_status()
+
+        return self._extract_content(response.json())
+
+    async def _post_stream(self, url: str, data: Dict[str, Any], headers: Dict[str, str]) -> str:
+        parser = IncrementalJsonParser()
+        data = dict(data, stream=True)
+
+        async with self._limit():
+            async with self._get_http().stream("POST", url, json=data, headers=headers) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    print(f"[DEBUG] Ошибка {response.status_code}: {body[:500].decode('utf-8', 'replace')}")
+
+                response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    done, delta = self._parse_sse_line(line)
+                    if done or self._consume_stream_delta(parser, delta):
+                        break
+
+        return parser.text
+
+    async def _create_openai_completion(self, kwargs: Dict[str, Any]) -> str:
+        await self._acquire_rate_limit(kwargs['messages'])
+
+        async with self._limit():
+            if not settings.LLM_STREAMING:
+                response = await self._get_openai().chat.completions.create(**kwargs)
+                return response.choices[0].message.content
+
+            parser = IncrementalJsonParser()
+            stream = await self._get_openai().chat.completions.create(**kwargs, stream=True)
+            try:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if self._consume_stream_delta(parser, delta):
+                        break
+            finally:
+                await stream.close()
+
+            return parser.text
+
+    async def _analyze_text(self, full_prompt: str, prompt: str, input_data) -> str:
+        prompt_preview = prompt[:100] + "..." if len(prompt) > 100 else prompt
+        data_preview = str(input_data)[:100] + "..." if len(str(input_data)) > 100 else str(input_data)
+
+        print(f"[DEBUG] LLM запрос (async) | model={self.model} | type=text | prompt='{prompt_preview}' | data='{data_preview}'")
+
+        llm_start = time.time()
+        if self.provider_name == 'local':
+            content = await self._post(*self._build_local_request(full_prompt))
+        elif self.provider_name == 'openrouter':
+            content = await self._post(*self._build_openrouter_request(full_prompt))
+        else:
+            content = await self._create_openai_completion(self._build_openai_request(full_prompt))
+        llm_elapsed = time.time() - llm_start
+
+        result_preview = content[:150] + "..." if len(content) > 150 else content
+        print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(content)} | preview='{result_preview}'")
+
+        return content
+
+    async def _served_by(self, request) -> Tuple['AsyncLLMService', str]:
+        """Ответ вместе с сервисом, который его дал (для ключа кэша)."""
+        return self, await request
+
+    async def _analyze_images_batch(self, images: List[bytes], prompt: str) -> Tuple['AsyncLLMService', str]:
+        try:
+            return await async_call_with_resilience(
+                lambda service: service._served_by(service._dispatch_images(images, prompt)),
+                self._service_chain()
+            )
+        except httpx.HTTPStatusError as e:
+            raise ValueError(f"Ошибка при анализе изображений: {str(e)}\nДетали: {e.response.text}")
+        except Exception as e:
+            raise ValueError(f"Ошибка при анализе изображений: {str(e)}")
+
+    async def _dispatch_images(self, images: List[bytes], prompt: str) -> str:
+        if self.provider_name == 'local':
+            return await self._analyze_local(images, prompt)
+        elif self.provider_name == 'openrouter':
+            return await self._analyze_openrouter(images, prompt)
+        else:
+            return await self._analyze_openai(images, prompt)
+
+    async def _analyze_images(self, images: List[bytes], prompt: str, request_coro) -> str:
+        prompt_preview = prompt[:100] + "..." if len(prompt) > 100 else prompt
+        print(f"[DEBUG] LLM запрос (async) | model={self.model} | images={len(images)} | prompt='{prompt_preview}'")
+
+        llm_start = time.time()
+        content = await request_coro
+        llm_elapsed = time.time() - llm_start
+
+        content_preview = content[:150] + "..." if len(content) > 150 else content
+        print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(content)} | preview='{content_preview}'")
+
+        return content
+
+    async def _analyze_local(self, images: List[bytes], prompt: str) -> str:
+        return await self._analyze_images(images, prompt, self._post(*self._build_local_request(prompt, images)))
+
+    async def _analyze_openrouter(self, images: List[bytes], prompt: str) -> str:
+        return await self._analyze_images(images, prompt, self._post(*self._build_openrouter_request(prompt, images)))
+
+    async def _analyze_openai(self, images: List[bytes], prompt: str) -> str:
+        return await self._analyze_images(
+            images, prompt, self._create_openai_completion(self._build_openai_request(prompt, images))
+        )
+
+
+class BlockingAsyncLLMService(LLMService):
+    """
+    Синхронная обёртка над AsyncLLMService для tz_analyzer и passport_analyzer:
+    извлечение выполняется на собственном event loop, остальные методы — как у LLMService.
+    """
+
+    def extract_characteristics_via_llm(self, input_data, prompt):
+        return run_sync(self._extract(input_data, prompt))
+
+    def extract_chunks_via_llm(self, chunks, prompt, failed_chunks=None):
+        return run_sync(self._extract(chunks, prompt, chunked=True, failed_chunks=failed_chunks))
+
+    async def _extract(self, input_data, prompt, chunked: bool = False, failed_chunks=None):
+        service = AsyncLLMService()
+        service.progress_callback = self.progress_callback
+        service.pages_per_request = self.pages_per_request
+        try:
+            if chunked:
+                return await service.extract_chunks_via_llm(input_data, prompt, failed_chunks)
+            return await service.extract_characteristics_via_llm(input_data, prompt)
+        finally:
+            self.failed_scans.extend(service.failed_scans)
+            await service.aclose()
+
+
+def run_sync(coro):
+    """Выполняет корутину из синхронного кода (задача Celery, скрипт)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    coro.close()
+    raise RuntimeError("run_sync нельзя вызывать внутри работающего event loop — используйте AsyncLLMService напрямую")
+
+
+def create_llm_service() -> LLMService:
+    """LLMService для синхронных вызывающих: блокирующий или поверх asyncio (LLM_ASYNC=true)."""
+    if settings.LLM_ASYNC:
+        return BlockingAsyncLLMService()
+    return LLMService()
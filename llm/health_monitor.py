@@ -0,0 +1,105 @@
+"""
+Фоновый мониторинг доступности провайдеров LLM.
+
+Проверку выполняет периодическая задача Celery beat (tasks.probe_llm_health):
+результат каждого провайдера пишется в Redis с TTL и в память процесса.
+Задачи анализа и /health только читают сохранённый статус, синхронных
+проверок на горячем пути нет.
+"""
+import json
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import settings
+from llm.llm_provider import get_llm_targets
+from utils.redis_client import get_redis_client
+
+
+REDIS_KEY_PREFIX = "llm_health:"
+
+_local_status: Dict[str, Dict[str, Any]] = {}
+# Когда статус попал в память процесса; перечитываем из Redis не реже раза в LLM_HEALTH_INTERVAL
+_local_cached_at: Dict[str, float] = {}
+_local_lock = threading.Lock()
+
+
+def _store_status(key: str, status: Dict[str, Any]) -> None:
+    with _local_lock:
+        _local_status[key] = status
+        _local_cached_at[key] = time.time()
+    try:
+        get_redis_client().set(
+            f"{REDIS_KEY_PREFIX}{key}",
+            json.dumps(status, ensure_ascii=False),
+            ex=settings.LLM_HEALTH_TTL
+        )
+    except Exception as e:
+        print(f"[DEBUG] Не удалось сохранить статус LLM в Redis: {str(e)}")
+
+
+def _is_fresh(status: Optional[Dict[str, Any]]) -> bool:
+    return bool(status) and time.time() - status.get("checked_at", 0) < settings.LLM_HEALTH_TTL
+
+
+def probe_llm_targets() -> Dict[str, Dict[str, Any]]:
+    """Проверяет все настроенные провайдеры (основной и резервные) и сохраняет статусы."""
+    from llm.llm_service import LLMService
+
+    results = {}
+    for target in get_llm_targets():
+        start = time.time()
+        try:
+            LLMService(target)._check_llm_connection()
+            status = {"healthy": True, "error": None}
+        except Exception as e:
+            status = {"healthy": False, "error": str(e)[:500]}
+
+        status.update({
+            "provider": target.provider,
+            "model": target.model,
+            "checked_at": time.time(),
+            "latency": round(time.time() - start, 3),
+        })
+        _store_status(target.key, status)
+        results[target.key] = status
+
+    return results
+
+
+def get_llm_health() -> Dict[str, Dict[str, Any]]:
+    """Статусы провайдеров: из памяти процесса, при устаревании — из Redis. Без проверки на месте."""
+    result = {}
+    for target in get_llm_targets():
+        with _local_lock:
+            status = _local_status.get(target.key)
+            cached_at = _local_cached_at.get(target.key, 0)
+
+        if not _is_fresh(status) or time.time() - cached_at > settings.LLM_HEALTH_INTERVAL:
+            try:
+                raw = get_redis_client().get(f"{REDIS_KEY_PREFIX}{target.key}")
+                if raw:
+                    status = json.loads(raw)
+                    with _local_lock:
+                        _local_status[target.key] = status
+                        _local_cached_at[target.key] = time.time()
+            except Exception as e:
+                print(f"[DEBUG] Не удалось прочитать статус LLM из Redis: {str(e)}")
+
+        result[target.key] = status if _is_fresh(status) else {"healthy": None, "error": "нет свежих данных проверки"}
+
+    return result
+
+
+def ensure_llm_available() -> None:
+    """
+    Замена синхронной _check_llm_connection на горячем пути: падает только если
+    все провайдеры по свежим данным монитора недоступны. Если данных нет
+    (beat не запущен), запрос идёт как есть — сбои обработают повторы и failover.
+    """
+    health = get_llm_health()
+    known = [s for s in health.values() if s.get("healthy") is not None]
+
+    if known and not any(s["healthy"] for s in known):
+        errors = "; ".join(f"{key}: {s.get('error')}" for key, s in health.items())
+        raise ConnectionError(f"Все провайдеры LLM недоступны: {errors}")
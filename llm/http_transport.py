@@ -0,0 +1,134 @@
+"""
+Общий HTTP-транспорт для всех обращений к LLM.
+
+Один пул соединений с keep-alive на процесс: requests.Session для прямых запросов
+(local, openrouter) и httpx.Client для клиентов OpenAI SDK. Клиенты OpenAI
+переиспользуются между задачами воркера, поэтому установка TCP/TLS-соединения
+не попадает в задержку каждой страницы.
+"""
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+import requests
+from openai import OpenAI
+from requests.adapters import HTTPAdapter
+
+from config import settings
+
+
+_lock = threading.Lock()
+_pid: Optional[int] = None
+_session: Optional[requests.Session] = None
+_httpx_client: Optional[httpx.Client] = None
+_openai_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+
+
+def _reset_after_fork() -> None:
+    """Соединения нельзя делить между процессами — после fork (prefork Celery) создаём пул заново."""
+    global _pid, _session, _httpx_client, _openai_clients
+
+    if _pid == os.getpid():
+        return
+
+    _pid = os.getpid()
+    _session = None
+    _httpx_client = None
+    _openai_clients = {}
+
+
+def get_timeout() -> Tuple[float, float]:
+    """Таймауты (connect, read) для requests."""
+    return settings.LLM_HTTP_CONNECT_TIMEOUT, settings.LLM_HTTP_TIMEOUT
+
+
+def get_http_session() -> requests.Session:
+    global _session
+
+    with _lock:
+        _reset_after_fork()
+
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=settings.LLM_HTTP_POOL_CONNECTIONS,
+                pool_maxsize=settings.LLM_HTTP_POOL_SIZE,
+                max_retries=0,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+
+        return _session
+
+
+def _http2_available() -> bool:
+    if not settings.LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("[DEBUG] LLM_HTTP2 включён, но пакет h2 не установлен — используется HTTP/1.1")
+        return False
+
+
+def get_httpx_client() -> httpx.Client:
+    global _httpx_client
+
+    with _lock:
+        _reset_after_fork()
+
+        if _httpx_client is None:
+            _httpx_client = httpx.Client(
+                http2=_http2_available(),
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_HTTP_POOL_SIZE,
+                    max_keepalive_connections=settings.LLM_HTTP_POOL_SIZE,
+                    keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    settings.LLM_HTTP_TIMEOUT,
+                    connect=settings.LLM_HTTP_CONNECT_TIMEOUT,
+                ),
+            )
+
+        return _httpx_client
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """Возвращает общий для процесса клиент OpenAI для пары (api_key, base_url)."""
+    http_client = get_httpx_client()
+
+    with _lock:
+        key = (api_key, base_url)
+        client = _openai_clients.get(key)
+
+        if client is None:
+            kwargs = {"api_key": api_key, "http_client": http_client, "timeout": http_client.timeout}
+            if base_url:
+                kwargs["base_url"] = base_url
+            client = OpenAI(**kwargs)
+            _openai_clients[key] = client
+
+        return client
+
+
+def create_async_http_client() -> httpx.AsyncClient:
+    """
+    Пул соединений для асинхронного клиента. Привязан к event loop,
+    поэтому создаётся на время работы AsyncLLMService и закрывается вместе с ним.
+    """
+    return httpx.AsyncClient(
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=settings.LLM_HTTP_POOL_SIZE,
+            max_keepalive_connections=settings.LLM_HTTP_POOL_SIZE,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            settings.LLM_HTTP_TIMEOUT,
+            connect=settings.LLM_HTTP_CONNECT_TIMEOUT,
+        ),
+    )
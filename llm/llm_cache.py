@@ -0,0 +1,279 @@
+"""
+Кэш ответов LLM, адресуемый по содержимому запроса.
+
+Ключ — sha256 от (провайдер, модель, промпт, входные данные/байты изображений, температура),
+поэтому повторная загрузка того же паспорта или той же пары ТЗ/паспорт не уходит к провайдеру.
+В кэше хранится уже распарсенный результат, так что попадание пропускает и HTTP-запрос,
+и разбор JSON.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional, Iterable
+
+from config import settings
+from utils.redis_client import get_redis_client
+
+
+class DiskCacheBackend:
+    """Хранит записи отдельными JSON-файлами, вытесняет по LRU (mtime) при превышении размера."""
+
+    def __init__(self, cache_dir: str, max_size_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._total_size = sum(p.stat().st_size for p in self.cache_dir.glob("*.json"))
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # Обновляем mtime — это и есть отметка последнего обращения для LRU
+            os.utime(path, None)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, data: bytes, ttl: int) -> None:
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+
+        with self._lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self._total_size += len(data) - old_size
+
+            if self._total_size > self.max_size_bytes:
+                self._evict()
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        with self._lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self._total_size -= size
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> None:
+        entries = []
+        for p in self.cache_dir.glob("*.json"):
+            try:
+                stat = p.stat()
+                entries.append((stat.st_mtime, stat.st_size, p))
+            except FileNotFoundError:
+                continue
+
+        # Размер мог измениться из-за других процессов — пересчитываем по факту
+        self._total_size = sum(size for _, size, _ in entries)
+        # Чистим до 90% лимита, чтобы не вытеснять на каждой записи
+        target = int(self.max_size_bytes * 0.9)
+
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if self._total_size <= target:
+                break
+            try:
+                p.unlink()
+                self._total_size -= size
+            except FileNotFoundError:
+                continue
+
+
+class RedisCacheBackend:
+    """Хранит записи в Redis (тот же, что у Celery), LRU по sorted set с временем обращения."""
+
+    PREFIX = "llm_cache:"
+
+    def __init__(self, max_size_bytes: int):
+        self.client = get_redis_client()
+        self.max_size_bytes = max_size_bytes
+        self._lru_key = f"{self.PREFIX}lru"
+        self._sizes_key = f"{self.PREFIX}sizes"
+
+    def _key(self, key: str) -> str:
+        return f"{self.PREFIX}entry:{key}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.client.get(self._key(key))
+        if data is None:
+            # Запись истекла по TTL — убираем её из учёта размера
+            self._forget([key])
+            return None
+        self.client.zadd(self._lru_key, {key: time.time()})
+        return data
+
+    def set(self, key: str, data: bytes, ttl: int) -> None:
+        pipe = self.client.pipeline()
+        pipe.set(self._key(key), data, ex=ttl if ttl > 0 else None)
+        pipe.zadd(self._lru_key, {key: time.time()})
+        pipe.hset(self._sizes_key, key, len(data))
+        pipe.execute()
+
+        self._evict()
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self._key(key))
+        self._forget([key])
+
+    def _forget(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        if not keys:
+            return
+        pipe = self.client.pipeline()
+        pipe.zrem(self._lru_key, *keys)
+        pipe.hdel(self._sizes_key, *keys)
+        pipe.execute()
+
+    def _evict(self) -> None:
+        sizes = self.client.hgetall(self._sizes_key)
+        total_size = sum(int(v) for v in sizes.values())
+        if total_size <= self.max_size_bytes:
+            return
+
+        target = int(self.max_size_bytes * 0.9)
+        evicted = []
+        for raw_key in self.client.zrange(self._lru_key, 0, -1):
+            if total_size <= target:
+                break
+            key = raw_key.decode() if isinstance(raw_key, bytes) else raw_key
+            total_size -= int(sizes.get(raw_key, 0))
+            evicted.append(key)
+
+        if evicted:
+            self.client.delete(*[self._key(k) for k in evicted])
+            self._forget(evicted)
+
+
+class LLMCache:
+
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        provider: Optional[str],
+        model: Optional[str],
+        prompt: str,
+        payload: Any = None,
+        temperature: Optional[float] = None
+    ) -> str:
+        digest = hashlib.sha256()
+        header = json.dumps(
+            {"provider": provider, "model": model, "temperature": temperature},
+            sort_keys=True
+        )
+        digest.update(header.encode("utf-8"))
+        digest.update(b"\x00prompt\x00")
+        digest.update(prompt.encode("utf-8"))
+
+        if payload is not None:
+            digest.update(b"\x00payload\x00")
+            items = payload if isinstance(payload, (list, tuple)) else [payload]
+            for item in items:
+                if isinstance(item, (bytes, bytearray, memoryview)):
+                    # memoryview (страница из mmap-кэша) хэшируется без копирования
+                    item_bytes = item
+                elif isinstance(item, str):
+                    item_bytes = item.encode("utf-8")
+                else:
+                    item_bytes = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+                # Хэш каждого элемента отдельно, чтобы границы элементов не склеивались
+                digest.update(hashlib.sha256(item_bytes).digest())
+
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self.backend.get(key)
+        except Exception as e:
+            print(f"[DEBUG] Кэш LLM недоступен: {str(e)}")
+            raw = None
+
+        entry = None
+        if raw is not None:
+            try:
+                entry = json.loads(raw)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                entry = None
+
+        if entry is not None and entry.get("expires_at") and entry["expires_at"] < time.time():
+            entry = None
+            try:
+                self.backend.delete(key)
+            except Exception as e:
+                print(f"[DEBUG] Кэш LLM недоступен: {str(e)}")
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if entry is None:
+            return None
+
+        print(f"[DEBUG] Кэш LLM: попадание | key={key[:12]} | hits={self.hits} | misses={self.misses}")
+        return entry["value"]
+
+    def set(self, key: str, value: Any) -> None:
+        entry = {
+            "created_at": time.time(),
+            "expires_at": time.time() + self.ttl if self.ttl > 0 else None,
+            "value": value,
+        }
+        try:
+            data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+            self.backend.set(key, data, self.ttl)
+        except Exception as e:
+            print(f"[DEBUG] Не удалось сохранить ответ LLM в кэш: {str(e)}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_cache: Optional[LLMCache] = None
+_cache_initialized = False
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Возвращает кэш процесса или None, если кэширование выключено (LLM_CACHE_BACKEND=none)."""
+    global _cache, _cache_initialized
+
+    if _cache_initialized:
+        return _cache
+
+    backend_name = (settings.LLM_CACHE_BACKEND or "none").lower()
+    max_size_bytes = settings.LLM_CACHE_MAX_SIZE_MB * 1024 * 1024
+
+    try:
+        if backend_name == "disk":
+            _cache = LLMCache(DiskCacheBackend(settings.LLM_CACHE_DIR, max_size_bytes), settings.LLM_CACHE_TTL)
+        elif backend_name == "redis":
+            _cache = LLMCache(RedisCacheBackend(max_size_bytes), settings.LLM_CACHE_TTL)
+        else:
+            _cache = None
+    except Exception as e:
+        print(f"[DEBUG] Кэш LLM отключён: {str(e)}")
+        _cache = None
+
+    _cache_initialized = True
+    return _cache
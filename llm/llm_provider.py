@@ -1,20 +1,70 @@
-from typing import Optional
+import os
+from typing import Optional, List
 
-from openai import OpenAI
 from config import settings
+from llm.http_transport import get_openai_client
 
 
-class LLMProvider:
-    def __init__(self, provider: Optional[str] = None):
+class LLMTarget:
+    """Провайдер и модель, к которым уходит запрос (основная или резервная из LLM_FALLBACKS)."""
+
+    def __init__(self, provider: Optional[str], model: Optional[str], api_key: Optional[str], api_url: Optional[str]):
         self.provider = provider
+        self.model = model
+        self.api_key = api_key
+        self.api_url = api_url
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+    def __repr__(self) -> str:
+        return f"LLMTarget({self.key})"
+
+
+def get_llm_targets() -> List[LLMTarget]:
+    """
+    Упорядоченный список целей: основная из LLM_PROVIDER/LLM_MODEL, затем резервные
+    из LLM_FALLBACKS ("openrouter:qwen/qwen2.5-vl-32b-instruct,openai:gpt-4o").
+    Ключ и URL резервного провайдера берутся из LLM_API_KEY_<PROVIDER> / LLM_API_URL_<PROVIDER>,
+    по умолчанию — основные LLM_API_KEY / LLM_API_URL.
+    """
+    targets = [LLMTarget(settings.LLM_PROVIDER, settings.LLM_MODEL, settings.LLM_API_KEY, settings.LLM_API_URL)]
+
+    for entry in (settings.LLM_FALLBACKS or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        provider, _, model = entry.partition(":")
+        provider = provider.strip()
+        suffix = provider.upper()
+        targets.append(LLMTarget(
+            provider,
+            model.strip() or settings.LLM_MODEL,
+            os.getenv(f"LLM_API_KEY_{suffix}", settings.LLM_API_KEY),
+            os.getenv(f"LLM_API_URL_{suffix}", settings.LLM_API_URL),
+        ))
+
+    return targets
+
+
+class LLMProvider:
+    def __init__(self, provider: Optional[str] = None, target: Optional[LLMTarget] = None):
+        self.provider = target.provider if target else provider
+        self.target = target
         self._init_provider()
 
 
     def _init_provider(self):
-        self.api_key = settings.LLM_API_KEY
-        self.model = settings.LLM_MODEL
+        if self.target is not None:
+            self.api_key = self.target.api_key
+            self.model = self.target.model
+            self.api_url = self.target.api_url
+        else:
+            self.api_key = settings.LLM_API_KEY
+            self.model = settings.LLM_MODEL
+            self.api_url = settings.LLM_API_URL
         self.max_tokens = settings.LLM_MAX_TOKENS
-        self.api_url = settings.LLM_API_URL
 
         if self.api_key is None:
             print ('Тестовое исключение')
@@ -27,16 +77,10 @@ class LLMProvider:
                 f"Проверьте настройку LLM_API_KEY в .env файле."
             )
 
+        # Клиенты берутся из общего пула процесса и переиспользуются между задачами
         if self.provider == "local":
-            self.client = OpenAI(
-                api_key=self.api_key,
-                base_url=self.api_url
-            )
+            self.client = get_openai_client(self.api_key, self.api_url)
         elif self.provider == "openrouter":
-            self.client = OpenAI(
-                api_key=self.api_key,
-                base_url="https://openrouter.ai/api/v1"
-            )
+            self.client = get_openai_client(self.api_key, "https://openrouter.ai/api/v1")
         else:
-            self.client = OpenAI(api_key=self.api_key)
-
+            self.client = get_openai_client(self.api_key)
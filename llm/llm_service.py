@@ -1,143 +1,525 @@
 import base64
 import json
 import time
-from typing import List, Dict, Any
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Tuple, Callable
 
 import requests
 
 from config import settings
-from llm.llm_provider import LLMProvider
+from handlers.render_presets import get_image_mime_type, is_image_data
+from llm.llm_cache import LLMCache, get_llm_cache
+from llm.http_transport import get_http_session, get_timeout
+from llm.llm_provider import LLMProvider, LLMTarget, get_llm_targets
+from llm.page_batcher import create_page_batcher
+from llm.rate_limiter import estimate_messages_tokens, get_rate_limiter
+from llm.resilience import call_with_resilience
 from services import prompts_service
+from utils.json_stream import IncrementalJsonParser
+from utils.prompt_serializer import build_text_prompt
+from utils.page_tiler import TILES_PROMPT_NOTE, split_page
+
+# Конец потока страниц в _read_pages
+_END_OF_PAGES = object()
 
 
 class LLMService:
-    def __init__(self):
-        self.provider = LLMProvider()
+    # Температура генерации по провайдерам; входит в ключ кэша ответов
+    TEXT_TEMPERATURE = {'openrouter': 0.01}
+    IMAGE_TEMPERATURE = {'local': 0.1, 'openrouter': 0.01}
+
+    def __init__(self, target: Optional[LLMTarget] = None):
+        targets = get_llm_targets()
+        self.target = target or targets[0]
+        self.provider_name = self.target.provider
+        self.provider = LLMProvider(target=self.target)
         self.client = self.provider.client
         self.model = self.provider.model
         self.max_tokens = self.provider.max_tokens
+        self.cache = get_llm_cache()
+        # Верхняя граница страниц в одном vision-запросе (фактически — по бюджету токенов)
+        self.pages_per_request = settings.LLM_PAGES_PER_REQUEST
+        # Вызывается с новыми характеристиками по мере их появления в потоковом ответе
+        self.progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+        # Резервные провайдеры/модели (LLM_FALLBACKS); сервисы для них создаются при первом отказе
+        self._fallback_targets = targets[1:] if target is None else []
+        self._fallback_services: Optional[List['LLMService']] = None
+        # Сканы, не извлечённые даже после повторов и резервных провайдеров:
+        # [{"scans": "5-8", "error": ...}] — результат без них неполный
+        self.failed_scans: List[Dict[str, Any]] = []
+
+    @property
+    def key(self) -> str:
+        return self.target.key
+
+    def _create_fallback_service(self, target: LLMTarget) -> 'LLMService':
+        service = type(self)(target)
+        service.progress_callback = self.progress_callback
+        return service
+
+    def _service_chain(self) -> List['LLMService']:
+        """Основной сервис и резервные в порядке перехода при отказах."""
+        if self._fallback_services is None:
+            self._fallback_services = []
+            for target in self._fallback_targets:
+                try:
+                    self._fallback_services.append(self._create_fallback_service(target))
+                except Exception as e:
+                    print(f"[DEBUG] Резервный провайдер {target.key} пропущен: {str(e)}")
+        return [self] + self._fallback_services
 
     def extract_characteristics_via_llm(self, input_data, prompt):
+        if isinstance(input_data, Iterator):
+            return self._extract_page_stream(input_data, prompt)
+
+        mixed = self._split_mixed_pages(input_data)
+        if mixed is not None:
+            text_pages, images = mixed
+            print(f"[DEBUG] Смешанный документ | текстовых страниц={len(text_pages)} | сканов={len(images)}")
+            return self._reduce_page_results([
+                self.extract_characteristics_via_llm(text_pages, prompt),
+                self.extract_characteristics_via_llm(images, prompt),
+            ])
+
         try:
             if self._is_image_batch(input_data):
-                accumulated_data = {}
+                return self._extract_images(iter(()), list(input_data), [], prompt)
+
+            full_prompt = build_text_prompt(prompt, input_data)
+
+            cache_key = self._cache_key(full_prompt, temperature=self.TEXT_TEMPERATURE.get(self.provider_name))
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+            served, content = call_with_resilience(
+                lambda service: (service, service._analyze_text(full_prompt, prompt, input_data)),
+                self._service_chain()
+            )
+            result = self._parse_json_response(content)
+            served._cache_result(full_prompt, None, served.TEXT_TEMPERATURE, result)
+
+            return result
+
+        except Exception as e:
+            raise ValueError(f"Ошибка: {str(e)}")
+
+    def _record_failed_scans(self, first_scan: int, count: int, error: Exception) -> None:
+        scans = str(first_scan) if count == 1 else f"{first_scan}-{first_scan + count - 1}"
+        self.failed_scans.append({"scans": scans, "error": str(error)[:200]})
+        print(f"[DEBUG] Сканы {scans} не обработаны, документ извлекается без них: {str(error)[:200]}")
+
+    def _extract_batch_data(self, batch: List[bytes], prompt: str, first_scan: int = 1) -> Dict[str, Any]:
+        """
+        Батч сканов (first_scan — номер первого из них, для журнала). Если батч не прошёл,
+        страницы повторяются по одной; ошибка поднимается, только если не удалась ни одна.
+        """
+        cache_key = self._cache_key(prompt, batch, self.IMAGE_TEMPERATURE.get(self.provider_name))
+        data = self._cache_get(cache_key)
+
+        if data is None:
+            try:
+                served, response = self._analyze_images_batch(batch, prompt)
+            except Exception as e:
+                if len(batch) == 1:
+                    raise
+                # Батч не прошёл даже после повторов — повторяем страницы по одной,
+                # чтобы сбой одной страницы не стоил всего батча
+                print(f"[DEBUG] Батч из {len(batch)} страниц не обработан ({str(e)[:200]}), повтор по одной странице")
+                results = []
+                errors = []
+                for offset, page in enumerate(batch):
+                    try:
+                        results.append(self._extract_batch_data([page], prompt, first_scan + offset))
+                    except Exception as page_error:
+                        errors.append((first_scan + offset, page_error))
+                if not results:
+                    raise
+                for scan, page_error in errors:
+                    self._record_failed_scans(scan, 1, page_error)
+                return self._reduce_page_results(results)
+
+            data = self._parse_json_response(response)
+            served._cache_result(prompt, batch, served.IMAGE_TEMPERATURE, data)
+
+        return data
+
+    def _extract_page_stream(self, pages: Iterator[Any], prompt: str) -> Dict[str, Any]:
+        """
+        Страницы из FileHandler.iter_data_from_file: сканы уходят в LLM батчами по мере
+        растеризации, не дожидаясь конца документа; текстовые страницы откладываются
+        и извлекаются одним текстовым запросом в конце.
+        """
+        images: List[Any] = []
+        text_pages: List[Any] = []
+        self._read_pages(pages, images, text_pages, 1)
+
+        if not images:
+            return self.extract_characteristics_via_llm(text_pages, prompt)
+
+        try:
+            image_result = self._extract_images(pages, images, text_pages, prompt)
+        except Exception as e:
+            raise ValueError(f"Ошибка: {str(e)}")
+
+        if not text_pages:
+            return image_result
+
+        print(f"[DEBUG] Смешанный документ (поток) | текстовых страниц={len(text_pages)}")
+        return self._reduce_page_results([
+            self.extract_characteristics_via_llm(text_pages, prompt),
+            image_result,
+        ])
+
+    @staticmethod
+    def _read_pages(pages: Iterator[Any], images: List[Any], text_pages: List[Any], upto: int) -> None:
+        """Дочитывает поток, пока сканов в images не станет upto; текстовые страницы — в text_pages."""
+        while len(images) < upto:
+            page = next(pages, _END_OF_PAGES)
+            if page is _END_OF_PAGES:
+                return
+            if is_image_data(page):
+                images.append(page)
+            else:
+                text_pages.append(page)
+
+    @staticmethod
+    def _take_batch(images: List[Any], page_idx: int, batch_size: int) -> List[Any]:
+        # Отправленные страницы больше не нужны — индексы остальных не меняются (кэш токенов батчера)
+        batch = images[page_idx:page_idx + batch_size]
+        images[page_idx:page_idx + batch_size] = [None] * batch_size
+        return batch
+
+    def _extract_images(self, pages: Iterator[Any], images: List[Any], text_pages: List[Any], prompt: str) -> Dict[str, Any]:
+        """
+        Сканы: images — уже прочитанные страницы, pages — остаток потока (для списка пустой).
+        Следующий батч формируется, как только прочитано достаточно страниц.
+        Несработавший батч пропускается (см. failed_scans); ошибка — только если не прошёл ни один.
+        """
+        if settings.PASSPORT_EXTRACTION_MODE == 'parallel':
+            return self._extract_images_parallel(pages, images, text_pages, prompt)
+
+        accumulated_data = {}
+
+        batcher = create_page_batcher(self.pages_per_request, self.max_tokens)
+        page_idx = 0
+        batch_idx = 0
+        last_error: Optional[Exception] = None
+
+        print(f"[DEBUG] Обработка сканов | до {batcher.max_pages} страниц на запрос")
+
+        while True:
+            self._read_pages(pages, images, text_pages, page_idx + batcher.max_pages)
+            if page_idx >= len(images):
+                break
+
+            batch_start = time.time()
+
+            if batch_idx == 0:
+                current_prompt = prompt
+            else:
+                current_prompt = prompts_service._create_passport_iterative_prompt(accumulated_data, prompt)
+
+            batch_size = batcher.take(images, page_idx, current_prompt)
+            batch = self._take_batch(images, page_idx, batch_size)
 
-                batches = self._split_into_batches(input_data, 1)
+            try:
+                new_data = self._extract_batch_data(batch, current_prompt, page_idx + 1)
+            except Exception as e:
+                batcher.record(batch_size, time.time() - batch_start, success=False)
+                self._record_failed_scans(page_idx + 1, batch_size, e)
+                last_error = e
+                page_idx += batch_size
+                continue
 
-                print(f"[DEBUG] Обработка {len(batches)} батчей")
+            batch_elapsed = time.time() - batch_start
+            batcher.record(batch_size, batch_elapsed, success=True)
 
-                for batch_idx, batch in enumerate(batches):
-                    batch_start = time.time()
+            accumulated_data = self._merge_data(accumulated_data, new_data)
+            page_idx += batch_size
+            batch_idx += 1
 
-                    is_first_batch = (batch_idx == 0)
+            print(f"[DEBUG] Батч {batch_idx} | сканы {page_idx - batch_size + 1}-{page_idx} | time={batch_elapsed:.2f}s | характеристик={len(accumulated_data)}")
 
-                    if is_first_batch:
-                        current_prompt = prompt
-                    else:
-                        current_prompt = prompts_service._create_passport_iterative_prompt(accumulated_data, prompt)
+        if last_error is not None and batch_idx == 0:
+            raise ValueError(f"не обработан ни один батч сканов ({str(last_error)})")
 
-                    response = self._analyze_images_batch(batch, current_prompt)
+        print(f"[DEBUG] Обработано сканов: {page_idx} | батчей={batch_idx} | не обработано={len(self.failed_scans)}")
+        return accumulated_data
 
-                    new_data = self._parse_json_response(response)
-                    accumulated_data = self._merge_data(accumulated_data, new_data)
+    def _extract_images_parallel(self, pages: Iterator[Any], images: List[Any], text_pages: List[Any], prompt: str) -> Dict[str, Any]:
+        """
+        Map-reduce режим: каждая страница извлекается независимо с базовым промптом,
+        запросы идут параллельно (не более LLM_MAX_CONCURRENCY одновременно),
+        результаты сливаются в порядке страниц через _reduce_page_results.
+        Батч отправляется сразу, как только его страницы прочитаны из потока.
+        Несработавший батч пропускается (см. failed_scans); ошибка — только если не прошёл ни один.
+        """
+        start_time = time.time()
 
-                    batch_elapsed = time.time() - batch_start
-                    print(f"[DEBUG] Батч {batch_idx + 1}/{len(batches)} | time={batch_elapsed:.2f}s | характеристик={len(accumulated_data)}")
-                return accumulated_data
+        batcher = create_page_batcher(self.pages_per_request, self.max_tokens)
+        max_workers = max(1, settings.LLM_MAX_CONCURRENCY)
+        futures = {}
+        page_idx = 0
 
-            full_prompt = f"{prompt}\n\nДанные:\n{input_data}"
-            prompt_preview = prompt[:100] + "..." if len(prompt) > 100 else prompt
-            data_preview = str(input_data)[:100] + "..." if len(str(input_data)) > 100 else str(input_data)
+        print(f"[DEBUG] Параллельная обработка сканов | concurrency={max_workers}")
 
-            if settings.LLM_PROVIDER == 'local':
-                url = str(settings.LLM_API_URL).rstrip('/') + '/chat/completions'
-                data = {
-                    'model': self.provider.model,
-                    'messages': [{
-                        "role": "user",
-                        "content": full_prompt,
-                    }]
-                }
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                self._read_pages(pages, images, text_pages, page_idx + batcher.max_pages)
+                if page_idx >= len(images):
+                    break
+                batch_size = batcher.take(images, page_idx, prompt)
+                batch = self._take_batch(images, page_idx, batch_size)
+                future = executor.submit(self._extract_batch_data, batch, prompt, page_idx + 1)
+                futures[future] = (len(futures), page_idx + 1, batch_size)
+                page_idx += batch_size
+
+            results: List[Dict[str, Any]] = [{} for _ in futures]
+            errors: List[Exception] = []
+            for future in as_completed(futures):
+                batch_idx, first_scan, batch_size = futures[future]
+                try:
+                    results[batch_idx] = future.result()
+                except Exception as e:
+                    self._record_failed_scans(first_scan, batch_size, e)
+                    errors.append(e)
+                    continue
+                print(f"[DEBUG] Батч {batch_idx + 1}/{len(futures)} готов | характеристик={len(results[batch_idx])}")
+
+        if futures and len(errors) == len(futures):
+            raise ValueError(f"не обработан ни один батч сканов ({str(errors[0])})")
+
+        merged = self._reduce_page_results(results)
+
+        elapsed = time.time() - start_time
+        print(f"[DEBUG] Параллельная обработка завершена | батчей={len(futures)} | time={elapsed:.2f}s | характеристик={len(merged)}")
+
+        return merged
+
+    def extract_chunks_via_llm(
+            self,
+            chunks: List[Any],
+            prompt: str,
+            failed_chunks: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Части одного документа (см. utils.tz_chunker) извлекаются параллельно с одним
+        промптом, результаты сливаются в порядке частей. Сбой одной части не теряет
+        остальные: ошибка поднимается, только если не удалась ни одна часть. Несработавшие
+        части ({"chunk": номер с 1, "error": ...}) добавляются в failed_chunks — результат
+        без них неполный, вызывающий должен это показать.
+        """
+        start_time = time.time()
+        max_workers = max(1, min(settings.LLM_MAX_CONCURRENCY, len(chunks)))
+        print(f"[DEBUG] Параллельная обработка {len(chunks)} частей документа | concurrency={max_workers}")
+
+        results: List[Dict[str, Any]] = [{} for _ in chunks]
+        errors: List[str] = []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.extract_characteristics_via_llm, chunk, prompt): chunk_idx
+                for chunk_idx, chunk in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                chunk_idx = futures[future]
+                try:
+                    results[chunk_idx] = future.result()
+                except Exception as e:
+                    errors.append(str(e))
+                    if failed_chunks is not None:
+                        failed_chunks.append({"chunk": chunk_idx + 1, "error": str(e)[:200]})
+                    print(f"[DEBUG] Часть {chunk_idx + 1}/{len(chunks)} не обработана: {str(e)[:200]}")
+                    continue
+                print(f"[DEBUG] Часть {chunk_idx + 1}/{len(chunks)} готова | позиций={len(results[chunk_idx].get('items', []))}")
 
-                print(f"[DEBUG] LLM запрос | model={self.provider.model} | type=text | prompt='{prompt_preview}' | data='{data_preview}'")
+        if len(errors) == len(chunks):
+            raise ValueError(f"Ошибка: не обработана ни одна часть документа ({errors[0]})")
 
-                llm_start = time.time()
-                response = requests.post(url, json=data)
-                llm_elapsed = time.time() - llm_start
+        merged = self._reduce_page_results(results)
 
-                result = response.json()
+        elapsed = time.time() - start_time
+        print(f"[DEBUG] Параллельная обработка частей завершена | time={elapsed:.2f}s | ошибок={len(errors)}")
 
-                content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                result_preview = content[:150] + "..." if len(content) > 150 else content
-                print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(content)} | preview='{result_preview}'")
+        return merged
 
-                return self._parse_json_response(content)
+    def _reduce_page_results(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Детерминированно сливает независимые результаты страниц (в порядке страниц).
+        Если хоть одна страница распознала серию изделий, характеристики страниц
+        без серии считаются общими характеристиками серии.
+        """
+        is_series = any(isinstance(r, dict) and r.get("is_series") is True for r in results)
 
-            elif settings.LLM_PROVIDER == 'openrouter':
+        merged: Dict[str, Any] = {}
+        models: List[str] = []
+        # Позиции ТЗ ("items") с разных страниц складываются, дубли уберёт deduplicate_tz_items
+        items: List[Any] = []
+        has_items = False
 
-                data = {
-                    "model": self.model,
-                    "messages": [{
-                        "role": "user",
-                        "content": full_prompt
-                    }],
-                    "temperature": 0.01
-                }
+        for page_data in results:
+            if not isinstance(page_data, dict) or not page_data:
+                continue
 
-                headers = {
-                    "Authorization": f"Bearer {self.provider.api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "productAnalyze",
-                    "X-Title": "ProductAnalyze"
-                }
+            page_data = dict(page_data)
 
-                print(f"[DEBUG] LLM запрос | model={self.model} | type=text | prompt='{prompt_preview}' | data='{data_preview}'")
+            if isinstance(page_data.get("items"), list):
+                items.extend(page_data.pop("items"))
+                has_items = True
 
-                llm_start = time.time()
-                response = requests.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers=headers,
-                    data=json.dumps(data),
-                    timeout=300
-                )
-                llm_elapsed = time.time() - llm_start
+            if is_series:
+                page_models = page_data.pop("models", None) or []
+                for model in page_models:
+                    if model not in models:
+                        models.append(model)
 
-                if response.status_code != 200:
-                    print(f"[DEBUG] Ошибка {response.status_code}: {response.text[:500]}")
+                if page_data.pop("is_series", None) is not True:
+                    # Страница без признака серии — её характеристики общие для серии
+                    page_data = {"common_characteristics": page_data}
 
-                response.raise_for_status()
+            merged = self._merge_data(merged, page_data)
 
-                result = response.json()
-                content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                result_preview = content[:150] + "..." if len(content) > 150 else content
-                print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(content)} | preview='{result_preview}'")
+        if is_series:
+            merged["is_series"] = True
+            merged["models"] = models
 
-                return self._parse_json_response(content)
+        if has_items:
+            merged["items"] = items
 
+        return merged
 
-            messages = [{
-                "role": "user",
-                "content": full_prompt
-            }]
+    def _analyze_text(self, full_prompt: str, prompt: str, input_data) -> str:
+        prompt_preview = prompt[:100] + "..." if len(prompt) > 100 else prompt
+        data_preview = str(input_data)[:100] + "..." if len(str(input_data)) > 100 else str(input_data)
 
-            print(f"[DEBUG] LLM запрос | model={self.model} | type=text | prompt='{prompt_preview}' | data='{data_preview}'")
+        print(f"[DEBUG] LLM запрос | model={self.model} | type=text | prompt='{prompt_preview}' | data='{data_preview}'")
 
-            llm_start = time.time()
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages
-            )
-            llm_elapsed = time.time() - llm_start
+        llm_start = time.time()
+        if self.provider_name == 'local':
+            content = self._post(*self._build_local_request(full_prompt))
+        elif self.provider_name == 'openrouter':
+            content = self._post(*self._build_openrouter_request(full_prompt))
+        else:
+            content = self._create_openai_completion(self._build_openai_request(full_prompt))
+        llm_elapsed = time.time() - llm_start
 
-            result = response.choices[0].message.content
-            result_preview = result[:150] + "..." if len(result) > 150 else result
-            print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(result)} | preview='{result_preview}'")
+        result_preview = content[:150] + "..." if len(content) > 150 else content
+        print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(content)} | preview='{result_preview}'")
 
-            return self._parse_json_response(result)
+        return content
 
-        except Exception as e:
-            raise ValueError(f"Ошибка: {str(e)}")
+    def _acquire_rate_limit(self, messages: List[Dict[str, Any]]) -> None:
+        get_rate_limiter().acquire(self.target.key, estimate_messages_tokens(messages))
 
+    def _post(self, url: str, data: Dict[str, Any], headers: Dict[str, str]) -> str:
+        self._acquire_rate_limit(data['messages'])
+
+        if settings.LLM_STREAMING:
+            return self._post_stream(url, data, headers)
+
+        response = get_http_session().post(url, json=data, headers=headers, timeout=get_timeout())
+
+        if response.status_code != 200:
+            print(f"[DEBUG] Ошибка {response.status_code}: {response.text[:500]}")
+
+        response.raise_for_status()
+
+        return self._extract_content(response.json())
+
+    def _post_stream(self, url: str, data: Dict[str, Any], headers: Dict[str, str]) -> str:
+        parser = IncrementalJsonParser()
+        data = dict(data, stream=True)
+
+        with get_http_session().post(url, json=data, headers=headers, timeout=get_timeout(), stream=True) as response:
+            if response.status_code != 200:
+                print(f"[DEBUG] Ошибка {response.status_code}: {response.text[:500]}")
+
+            response.raise_for_status()
+
+            for raw_line in response.iter_lines():
+                done, delta = self._parse_sse_line(raw_line.decode('utf-8'))
+                if done or self._consume_stream_delta(parser, delta):
+                    break
+
+        return parser.text
+
+    def _create_openai_completion(self, kwargs: Dict[str, Any]) -> str:
+        self._acquire_rate_limit(kwargs['messages'])
+
+        if not settings.LLM_STREAMING:
+            response = self.client.chat.completions.create(**kwargs)
+            return response.choices[0].message.content
+
+        parser = IncrementalJsonParser()
+        stream = self.client.chat.completions.create(**kwargs, stream=True)
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if self._consume_stream_delta(parser, delta):
+                    break
+        finally:
+            stream.close()
+
+        return parser.text
+
+    @staticmethod
+    def _parse_sse_line(line: str) -> Tuple[bool, Optional[str]]:
+        """Разбирает строку server-sent events. Возвращает (поток завершён, фрагмент текста)."""
+        if not line.startswith('data:'):
+            return False, None
+
+        payload = line[len('data:'):].strip()
+        if payload == '[DONE]':
+            return True, None
+
+        try:
+            chunk = json.loads(payload)
+        except json.JSONDecodeError:
+            return False, None
+
+        choices = chunk.get('choices') or [{}]
+        return False, (choices[0].get('delta') or {}).get('content')
+
+    def _consume_stream_delta(self, parser: IncrementalJsonParser, delta: Optional[str]) -> bool:
+        """Скармливает фрагмент парсеру, отдаёт готовые характеристики в progress_callback.
+        Возвращает True, когда корневой JSON-объект закрылся и поток можно оборвать."""
+        if not delta:
+            return False
+
+        pairs = parser.feed(delta)
+        if pairs and self.progress_callback is not None:
+            try:
+                self.progress_callback(dict(pairs))
+            except Exception as e:
+                print(f"[DEBUG] Ошибка progress_callback: {str(e)}")
+
+        if parser.complete:
+            print("[DEBUG] JSON получен полностью, поток LLM прерван")
+        return parser.complete
+
+    def _cache_key(self, prompt: str, payload=None, temperature=None) -> str:
+        return LLMCache.make_key(self.provider_name, self.model, prompt, payload, temperature)
+
+    def _cache_get(self, key: str):
+        if self.cache is None:
+            return None
+        return self.cache.get(key)
+
+    def _cache_set(self, key: str, value) -> None:
+        if self.cache is not None:
+            self.cache.set(key, value)
+
+    def _cache_result(self, prompt: str, payload, temperatures: Dict[str, float], result) -> None:
+        """
+        Сохраняет разобранный ответ под ключом сервиса, который его дал (резервный
+        провайдер — со своей моделью). Пустой результат, в том числе неразобранный
+        ответ, не кэшируется: иначе сбой повторялся бы весь LLM_CACHE_TTL.
+        """
+        if not result:
+            return
+        self._cache_set(self._cache_key(prompt, payload, temperatures.get(self.provider_name)), result)
 
     def _split_into_batches(self, items: List, batch_size: int) -> List[List]:
         return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
@@ -146,9 +528,9 @@ class LLMService:
         print("[DEBUG] Проверка соединения с LLM...")
 
         try:
-            if settings.LLM_PROVIDER == 'local':
+            if self.provider_name == 'local':
                 self._check_local_connection()
-            elif settings.LLM_PROVIDER == 'openrouter':
+            elif self.provider_name == 'openrouter':
                 self._check_openrouter_connection()
             else:
                 self._check_openai_connection()
@@ -159,7 +541,7 @@ class LLMService:
 
     def _check_local_connection(self) -> None:
 
-        base_url = str(settings.LLM_API_URL).rstrip('/')
+        base_url = str(self.provider.api_url).rstrip('/')
         models_url = base_url.replace('/chat/completions', '').rstrip('/') + '/models'
 
         urls_to_try = [
@@ -172,7 +554,7 @@ class LLMService:
 
         for url in urls_to_try:
             try:
-                response = requests.get(url, timeout=10)
+                response = get_http_session().get(url, timeout=10)
                 if response.status_code == 200:
                     data = response.json()
                     models = data.get('data', [])
@@ -194,37 +576,46 @@ class LLMService:
         raise ConnectionError(f"Не удалось подключиться к локальному LLM: {base_url}")
 
     def _check_openrouter_connection(self) -> None:
+        """
+        Бесплатные эндпоинты вместо тестового запроса к модели: /auth/key проверяет ключ,
+        /models — что модель есть в каталоге. Лимит запросов к модели не расходуется.
+        """
 
         print(f"[DEBUG] Проверка OpenRouter API...")
         print(f"[DEBUG] Модель: {self.model}")
 
         try:
 
-            data = {
-                "model": self.model,
-                "messages": [{"role": "user", "content": "test"}],
-                "max_tokens": 1
-            }
-
             headers = {
                 "Authorization": f"Bearer {self.provider.api_key}",
             }
 
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
+            response = get_http_session().get(
+                url="https://openrouter.ai/api/v1/auth/key",
                 headers=headers,
-                data=json.dumps(data),
                 timeout=30
             )
+            if response.status_code != 200:
+                raise ConnectionError(f"Ошибка {response.status_code}: {response.text[:500]}")
+            print(f"[DEBUG] OpenRouter API доступен, ключ действителен")
 
-            if response.status_code == 200:
-                print(f"[DEBUG] OpenRouter API доступен")
-                print(f"[DEBUG]  Модель '{self.model}' работает корректно")
-            else:
+            response = get_http_session().get(
+                url="https://openrouter.ai/api/v1/models",
+                headers=headers,
+                timeout=30
+            )
+            if response.status_code != 200:
                 raise ConnectionError(f"Ошибка {response.status_code}: {response.text[:500]}")
 
+            model_ids = [m.get('id', '') for m in response.json().get('data', [])]
+            if self.model and self.model not in model_ids:
+                raise ConnectionError(f"Модель '{self.model}' не найдена в каталоге OpenRouter")
+            print(f"[DEBUG]  Модель '{self.model}' доступна")
+
         except requests.exceptions.RequestException as e:
             raise ConnectionError(f"Не удалось подключиться к OpenRouter API: {str(e)}")
+        except ConnectionError:
+            raise
         except Exception as e:
             raise ConnectionError(f"Не удалось подключиться к OpenRouter API: {str(e)}")
 
@@ -249,10 +640,36 @@ class LLMService:
             raise ConnectionError(f"Не удалось подключиться к OpenAI API: {str(e)}")
 
 
+    @staticmethod
+    def _collect_pages(data):
+        """
+        Ленивый поток страниц (FileHandler.iter_data_from_file) в список — для асинхронного
+        сервиса: растеризация синхронная, и чтение потока между await блокировало бы
+        event loop с запросами других страниц. Синхронный сервис читает поток по ходу
+        отправки батчей (_extract_page_stream).
+        """
+        if isinstance(data, Iterator):
+            return list(data)
+        return data
+
+    def _split_mixed_pages(self, data) -> Optional[Tuple[List[Any], List[bytes]]]:
+        """
+        Страницы гибридного PDF (текст + сканы) -> (текстовые страницы, изображения).
+        Для однородных данных возвращает None.
+        """
+        if not isinstance(data, list) or self._is_image_batch(data):
+            return None
+
+        images = [x for x in data if is_image_data(x)]
+        if not images:
+            return None
+
+        return [x for x in data if not is_image_data(x)], images
+
     def _is_image_batch(self, data):
 
         if isinstance(data, list):
-            if all(isinstance(x, (bytes, bytearray)) for x in data):
+            if all(is_image_data(x) for x in data):
                 return True
 
             if all(isinstance(x, str) and x.startswith("data:image") for x in data):
@@ -263,15 +680,13 @@ class LLMService:
 
         return False
 
-    def _analyze_images_batch(self, images: List[bytes], prompt: str) -> str:
-
+    def _analyze_images_batch(self, images: List[bytes], prompt: str) -> Tuple['LLMService', str]:
+        """(сервис, который ответил — основной или резервный, ответ модели)."""
         try:
-            if settings.LLM_PROVIDER == 'local':
-                return self._analyze_local(images, prompt)
-            elif settings.LLM_PROVIDER == 'openrouter':
-                return self._analyze_openrouter(images, prompt)
-            else:
-                return self._analyze_openai(images, prompt)
+            return call_with_resilience(
+                lambda service: (service, service._dispatch_images(images, prompt)),
+                self._service_chain()
+            )
         except requests.exceptions.HTTPError as e:
             error_detail = ""
             if e.response is not None:
@@ -283,101 +698,82 @@ class LLMService:
         except Exception as e:
             raise ValueError(f"Ошибка при анализе изображений: {str(e)}")
 
-    def _analyze_local(self, images: List[bytes], prompt: str) -> str:
-        url = str(settings.LLM_API_URL).rstrip('/') + '/chat/completions'
+    def _dispatch_images(self, images: List[bytes], prompt: str) -> str:
+        if self.provider_name == 'local':
+            return self._analyze_local(images, prompt)
+        elif self.provider_name == 'openrouter':
+            return self._analyze_openrouter(images, prompt)
+        else:
+            return self._analyze_openai(images, prompt)
+
+    def _image_part(self, img_bytes: bytes, detail: Optional[str] = None) -> Dict[str, Any]:
+        base64_image = base64.b64encode(img_bytes).decode('utf-8')
+        # Определяем формат изображения по сигнатуре
+        image_format = get_image_mime_type(img_bytes)
+        image_url = {"url": f"data:{image_format};base64,{base64_image}"}
+        if detail:
+            image_url["detail"] = detail
+        return {"type": "image_url", "image_url": image_url}
+
+    def _image_parts(self, prompt: str, images: List[bytes], detail: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
+        """Части сообщения с изображениями: крупные страницы уходят фрагментами с содержимым."""
+        parts = []
+        for img_bytes in images:
+            parts.extend(self._image_part(tile, detail) for tile in split_page(img_bytes))
 
-        content = []
+        if len(parts) > len(images):
+            print(f"[DEBUG] Нарезка страниц: {len(images)} страниц -> {len(parts)} фрагментов")
+            prompt = f"{prompt}\n\n{TILES_PROMPT_NOTE}"
+        return prompt, parts
 
-        for img_bytes in images:
-            base64_image = base64.b64encode(img_bytes).decode('utf-8')
-            # Определяем формат изображения по сигнатуре
-            image_format = "image/png" if img_bytes.startswith(b'\x89PNG') else "image/jpeg"
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:{image_format};base64,{base64_image}"
-                }
-            })
+    def _build_local_request(self, prompt: str, images: Optional[List[bytes]] = None) -> Tuple[str, Dict[str, Any], Dict[str, str]]:
+        url = str(self.provider.api_url).rstrip('/') + '/chat/completions'
+        headers = {"Content-Type": "application/json"}
 
+        if images is None:
+            data = {
+                'model': self.provider.model,
+                'messages': [{
+                    "role": "user",
+                    "content": prompt,
+                }]
+            }
+            return url, data, headers
+
+        prompt, content = self._image_parts(prompt, images)
         content.append({"type": "text", "text": prompt})
 
         data = {
             "model": self.provider.model,
             "messages": [{"role": "user", "content": content}],
             "max_tokens": 4096,
-            "temperature": 0.1,
+            "temperature": self.IMAGE_TEMPERATURE['local'],
             "stream": False
         }
+        return url, data, headers
 
-        headers = {"Content-Type": "application/json"}
-
-        prompt_preview = prompt[:100] + "..." if len(prompt) > 100 else prompt
-        print(f"[DEBUG] LLM запрос | model={self.provider.model} | images={len(images)} | prompt='{prompt_preview}'")
-
-        llm_start = time.time()
-        response = requests.post(url, json=data, headers=headers, timeout=300)
-        llm_elapsed = time.time() - llm_start
-
-        if response.status_code != 200:
-            print(f"[DEBUG] Ошибка {response.status_code}: {response.text[:500]}")
-
-        response.raise_for_status()
-
-        result = response.json()
-        content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-
-        content_preview = content[:150] + "..." if len(content) > 150 else content
-        print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(content)} | preview='{content_preview}'")
-
-        return content
-
-    def _analyze_openai(self, images: List[bytes], prompt: str) -> str:
-        content = [{"type": "text", "text": prompt}]
-
-        for img_bytes in images:
-            base64_image = base64.b64encode(img_bytes).decode('utf-8')
-
-            image_format = "image/png" if img_bytes.startswith(b'\x89PNG') else "image/jpeg"
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:{image_format};base64,{base64_image}",
-                    "detail": "high"  # high detail для лучшего распознавания текста
-                }
-            })
-
-        kwargs = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": content}]
+    def _build_openrouter_request(self, prompt: str, images: Optional[List[bytes]] = None) -> Tuple[str, Dict[str, Any], Dict[str, str]]:
+        url = "https://openrouter.ai/api/v1/chat/completions"
+        headers = {
+            "Authorization": f"Bearer {self.provider.api_key}",
+            "Content-Type": "application/json",
         }
 
-        prompt_preview = prompt[:100] + "..." if len(prompt) > 100 else prompt
-        print(f"[DEBUG] LLM запрос | model={self.model} | images={len(images)} | prompt='{prompt_preview}'")
-
-        llm_start = time.time()
-        response = self.client.chat.completions.create(**kwargs)
-        llm_elapsed = time.time() - llm_start
-
-        result = response.choices[0].message.content
-
-        result_preview = result[:150] + "..." if len(result) > 150 else result
-        print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(result)} | preview='{result_preview}'")
-
-        return result
-
-    def _analyze_openrouter(self, images: List[bytes], prompt: str) -> str:
-
-        content = [{"type": "text", "text": prompt}]
+        if images is None:
+            headers["HTTP-Referer"] = "productAnalyze"
+            headers["X-Title"] = "ProductAnalyze"
+            data = {
+                "model": self.model,
+                "messages": [{
+                    "role": "user",
+                    "content": prompt
+                }],
+                "temperature": self.TEXT_TEMPERATURE['openrouter']
+            }
+            return url, data, headers
 
-        for img_bytes in images:
-            base64_image = base64.b64encode(img_bytes).decode('utf-8')
-            image_format = "image/png" if img_bytes.startswith(b'\x89PNG') else "image/jpeg"
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:{image_format};base64,{base64_image}"
-                }
-            })
+        prompt, image_parts = self._image_parts(prompt, images)
+        content = [{"type": "text", "text": prompt}] + image_parts
 
         data = {
             "model": self.model,
@@ -385,39 +781,54 @@ class LLMService:
                 "role": "user",
                 "content": content
             }],
-            "temperature": 0.01
+            "temperature": self.IMAGE_TEMPERATURE['openrouter']
         }
+        return url, data, headers
 
-        headers = {
-            "Authorization": f"Bearer {self.provider.api_key}",
-            "Content-Type": "application/json",
+    def _build_openai_request(self, prompt: str, images: Optional[List[bytes]] = None) -> Dict[str, Any]:
+        if images is None:
+            return {
+                "model": self.model,
+                "messages": [{"role": "user", "content": prompt}]
+            }
+
+        # high detail для лучшего распознавания текста
+        prompt, image_parts = self._image_parts(prompt, images, detail="high")
+        content = [{"type": "text", "text": prompt}] + image_parts
+
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": content}]
         }
 
+    @staticmethod
+    def _extract_content(result: Dict[str, Any]) -> str:
+        return result.get('choices', [{}])[0].get('message', {}).get('content', '') or ''
+
+    def _analyze_images(self, images: List[bytes], prompt: str, request) -> str:
         prompt_preview = prompt[:100] + "..." if len(prompt) > 100 else prompt
         print(f"[DEBUG] LLM запрос | model={self.model} | images={len(images)} | prompt='{prompt_preview}'")
 
         llm_start = time.time()
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(data),
-            timeout=300
-        )
+        content = request()
         llm_elapsed = time.time() - llm_start
 
-        if response.status_code != 200:
-            print(f"[DEBUG] Ошибка {response.status_code}: {response.text[:500]}")
-
-        response.raise_for_status()
-
-        result = response.json()
-        content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-
         content_preview = content[:150] + "..." if len(content) > 150 else content
         print(f"[DEBUG] LLM ответ | time={llm_elapsed:.2f}s | length={len(content)} | preview='{content_preview}'")
 
         return content
 
+    def _analyze_local(self, images: List[bytes], prompt: str) -> str:
+        return self._analyze_images(images, prompt, lambda: self._post(*self._build_local_request(prompt, images)))
+
+    def _analyze_openai(self, images: List[bytes], prompt: str) -> str:
+        return self._analyze_images(
+            images, prompt, lambda: self._create_openai_completion(self._build_openai_request(prompt, images))
+        )
+
+    def _analyze_openrouter(self, images: List[bytes], prompt: str) -> str:
+        return self._analyze_images(images, prompt, lambda: self._post(*self._build_openrouter_request(prompt, images)))
+
     def _parse_json_response(self, response: str) -> Dict[str, Any]:
 
         if not response:
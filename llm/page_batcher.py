@@ -0,0 +1,110 @@
+"""
+Упаковка страниц паспорта в vision-запросы по бюджету токенов.
+
+Стоимость страницы оценивается по размеру изображения (формула тайлов 512x512,
+как у OpenAI high detail), стоимость промпта — по длине текста. В один запрос
+попадает столько страниц, сколько помещается в бюджет, но не больше текущего
+лимита, который подстраивается под наблюдаемые задержки и ошибки.
+"""
+import io
+import math
+from typing import Dict, List
+
+from PIL import Image
+
+from config import settings
+
+
+# Ориентировочно символов на токен для русскоязычного текста
+CHARS_PER_TOKEN = 3
+# Резерв под ответ модели (совпадает с max_tokens vision-запроса)
+RESPONSE_TOKENS_RESERVE = 4096
+
+
+def estimate_text_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_image_tokens(img_bytes: bytes) -> int:
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            width, height = img.size
+    except Exception:
+        # Не удалось прочитать заголовок — считаем как страницу 2048x2048
+        width, height = 2048, 2048
+    return estimate_image_tokens_for_size(width, height)
+
+
+def estimate_image_tokens_for_size(width: float, height: float) -> int:
+    # Вписываем в 2048x2048, затем короткую сторону приводим к 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+class AdaptivePageBatcher:
+
+    def __init__(self, max_pages: int, token_budget: int, target_latency: float):
+        self.max_pages = max(1, max_pages)
+        self.token_budget = token_budget
+        self.target_latency = target_latency
+        # Текущий лимит страниц на запрос: растёт при быстрых ответах, падает при медленных и ошибках
+        self.current_limit = self.max_pages
+        self._image_tokens: Dict[int, int] = {}
+
+    def _page_tokens(self, images: List[bytes], index: int) -> int:
+        if index not in self._image_tokens:
+            # Страница может уйти несколькими фрагментами — считаем их суммарную стоимость
+            from utils.page_tiler import estimate_page_tokens
+            self._image_tokens[index] = estimate_page_tokens(images[index])
+        return self._image_tokens[index]
+
+    def take(self, images: List[bytes], start: int, prompt: str) -> int:
+        """Сколько страниц начиная со start отправить следующим запросом (минимум одна)."""
+        used = estimate_text_tokens(prompt) + RESPONSE_TOKENS_RESERVE
+        count = 0
+
+        while start + count < len(images) and count < self.current_limit:
+            page_tokens = self._page_tokens(images, start + count)
+            if count > 0 and used + page_tokens > self.token_budget:
+                break
+            used += page_tokens
+            count += 1
+
+        return max(1, count)
+
+    def split(self, images: List[bytes], prompt: str) -> List[List[bytes]]:
+        """Разбивает все страницы на батчи с одним и тем же промптом (параллельный режим)."""
+        batches = []
+        start = 0
+        while start < len(images):
+            size = self.take(images, start, prompt)
+            batches.append(images[start:start + size])
+            start += size
+        return batches
+
+    def record(self, pages: int, elapsed: float, success: bool) -> None:
+        previous = self.current_limit
+
+        if not success:
+            self.current_limit = max(1, pages // 2)
+        elif elapsed > self.target_latency:
+            self.current_limit = max(1, min(self.current_limit, pages) - 1)
+        elif elapsed < self.target_latency / 2 and pages >= self.current_limit:
+            self.current_limit = min(self.max_pages, self.current_limit + 1)
+
+        if self.current_limit != previous:
+            print(f"[DEBUG] Лимит страниц на запрос: {previous} -> {self.current_limit} | time={elapsed:.2f}s | success={success}")
+
+
+def create_page_batcher(max_pages: int, max_tokens: int) -> AdaptivePageBatcher:
+    token_budget = settings.LLM_BATCH_TOKEN_BUDGET or max_tokens
+    return AdaptivePageBatcher(
+        max_pages=max_pages,
+        token_budget=token_budget,
+        target_latency=settings.LLM_BATCH_TARGET_LATENCY,
+    )
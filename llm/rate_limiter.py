@@ -0,0 +1,218 @@
+"""
+Распределённый ограничитель запросов к LLM для всех воркеров Celery.
+
+Token bucket в Redis (атомарно, Lua-скриптом) одновременно по запросам в минуту (RPM)
+и токенам в минуту (TPM) на пару провайдер:модель. Для справедливости между
+пользователями у каждого активного пользователя есть свой bucket с долей общего
+лимита, пропорциональной его весу (LLM_RATE_USER_WEIGHTS).
+"""
+import asyncio
+import base64
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+from llm.page_batcher import estimate_image_tokens, estimate_text_tokens
+from utils.redis_client import get_redis_client
+
+
+KEY_PREFIX = "llm_rate:"
+# Ожидаемый размер ответа модели, учитываемый в TPM заранее
+EXPECTED_RESPONSE_TOKENS = 1000
+# Пользователь считается активным, если обращался к LLM за последние N секунд
+ACTIVE_USER_WINDOW = 60
+
+# KEYS — bucket'ы; ARGV — тройки (ёмкость, пополнение в секунду, стоимость).
+# Списывает стоимость со всех bucket'ов сразу или ни с одного; возвращает время ожидания в секундах.
+_TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local wait = 0
+local levels = {}
+
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = math.min(tonumber(ARGV[(i - 1) * 3 + 3]), capacity)
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+    levels[i] = tokens
+end
+
+if wait > 0 then
+    return tostring(wait)
+end
+
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = math.min(tonumber(ARGV[(i - 1) * 3 + 3]), capacity)
+    redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - cost), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 60)
+end
+
+return '0'
+"""
+
+# Пользователь, от имени которого идут запросы. Prefork-воркер выполняет одну задачу
+# за раз, поэтому достаточно значения на процесс (его выставляет process_analysis_task).
+_current_user_id: Optional[int] = None
+
+
+def set_rate_limit_user(user_id: Optional[int]) -> None:
+    global _current_user_id
+    _current_user_id = user_id
+
+
+def _parse_limits(value: str) -> Dict[str, Tuple[int, int]]:
+    """"openrouter:model=60/200000,local:m=0/0" -> {"openrouter:model": (60, 200000), ...}"""
+    limits = {}
+    for part in (value or "").split(","):
+        key, _, limit = part.strip().rpartition("=")
+        rpm, _, tpm = limit.partition("/")
+        try:
+            limits[key.strip()] = (int(rpm or 0), int(tpm or 0))
+        except ValueError:
+            continue
+    return limits
+
+
+def _parse_weights(value: str) -> Dict[str, float]:
+    weights = {}
+    for part in (value or "").split(","):
+        user_id, _, weight = part.strip().partition(":")
+        try:
+            weights[user_id.strip()] = float(weight)
+        except ValueError:
+            continue
+    return weights
+
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Оценка входных токенов запроса chat/completions (текст + изображения) плюс ожидаемый ответ."""
+    tokens = EXPECTED_RESPONSE_TOKENS
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += estimate_text_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += estimate_text_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                url = part.get("image_url", {}).get("url", "")
+                try:
+                    tokens += estimate_image_tokens(base64.b64decode(url.split(",", 1)[1]))
+                except (IndexError, ValueError):
+                    tokens += estimate_image_tokens(b"")
+    return tokens
+
+
+class RateLimiter:
+
+    def __init__(self):
+        self._script = None
+        self._limits = _parse_limits(settings.LLM_RATE_LIMITS)
+        self._weights = _parse_weights(settings.LLM_RATE_USER_WEIGHTS)
+
+    def get_limits(self, target_key: str) -> Tuple[int, int]:
+        return self._limits.get(target_key, (settings.LLM_RATE_RPM, settings.LLM_RATE_TPM))
+
+    def _user_share(self, client, target_key: str, user_id: Optional[int]) -> float:
+        """Доля лимита пользователя: его вес / сумма весов активных пользователей."""
+        active_key = f"{KEY_PREFIX}{target_key}:active"
+        now = time.time()
+
+        pipe = client.pipeline()
+        pipe.zadd(active_key, {str(user_id): now})
+        pipe.zremrangebyscore(active_key, 0, now - ACTIVE_USER_WINDOW)
+        pipe.zrange(active_key, 0, -1)
+        pipe.expire(active_key, ACTIVE_USER_WINDOW * 2)
+        active = pipe.execute()[2]
+
+        total_weight = sum(self._weights.get(u.decode(), 1.0) for u in active) or 1.0
+        return self._weights.get(str(user_id), 1.0) / total_weight
+
+    def _try_acquire(self, target_key: str, tokens: int, user_id: Optional[int]) -> float:
+        rpm, tpm = self.get_limits(target_key)
+        if not rpm and not tpm:
+            return 0.0
+
+        client = get_redis_client()
+        if self._script is None:
+            self._script = client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+        burst = settings.LLM_RATE_BURST_SECONDS / 60
+        buckets = []
+        if rpm:
+            buckets.append(("rpm", rpm, 1))
+        if tpm:
+            buckets.append(("tpm", tpm, tokens))
+
+        keys, args = [], []
+        for name, limit, cost in buckets:
+            keys.append(f"{KEY_PREFIX}{target_key}:{name}")
+            args += [max(1.0, limit * burst), limit / 60, cost]
+
+        if user_id is not None:
+            share = self._user_share(client, target_key, user_id)
+            for name, limit, cost in buckets:
+                keys.append(f"{KEY_PREFIX}{target_key}:{name}:user:{user_id}")
+                args += [max(1.0, limit * share * burst), limit * share / 60, cost]
+
+        return float(self._script(keys=keys, args=args))
+
+    def _wait_time(self, target_key: str, tokens: int) -> float:
+        try:
+            return self._try_acquire(target_key, tokens, _current_user_id)
+        except Exception as e:
+            # Redis недоступен — не блокируем запросы, лимиты провайдера подстрахуют повторы
+            print(f"[DEBUG] Ограничитель LLM недоступен: {str(e)}")
+            return 0.0
+
+    def acquire(self, target_key: str, tokens: int) -> None:
+        waited = 0.0
+        while True:
+            wait = self._wait_time(target_key, tokens)
+            if wait <= 0:
+                break
+            wait = min(wait, settings.LLM_RATE_MAX_WAIT - waited) if settings.LLM_RATE_MAX_WAIT else wait
+            if wait <= 0:
+                print(f"[DEBUG] Ограничитель LLM {target_key}: ожидание превысило {settings.LLM_RATE_MAX_WAIT}s, запрос отправлен")
+                break
+            time.sleep(wait)
+            waited += wait
+
+        if waited:
+            print(f"[DEBUG] Ограничитель LLM {target_key}: ожидание {waited:.2f}s | tokens={tokens}")
+
+    async def acquire_async(self, target_key: str, tokens: int) -> None:
+        waited = 0.0
+        while True:
+            wait = self._wait_time(target_key, tokens)
+            if wait <= 0:
+                break
+            wait = min(wait, settings.LLM_RATE_MAX_WAIT - waited) if settings.LLM_RATE_MAX_WAIT else wait
+            if wait <= 0:
+                print(f"[DEBUG] Ограничитель LLM {target_key}: ожидание превысило {settings.LLM_RATE_MAX_WAIT}s, запрос отправлен")
+                break
+            await asyncio.sleep(wait)
+            waited += wait
+
+        if waited:
+            print(f"[DEBUG] Ограничитель LLM {target_key}: ожидание {waited:.2f}s | tokens={tokens}")
+
+
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+    return _rate_limiter
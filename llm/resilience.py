@@ -0,0 +1,268 @@
+"""
+Устойчивость вызовов LLM: повторы с экспоненциальной задержкой и джиттером
+(с учётом Retry-After), circuit breaker на провайдера и переход на резервные
+провайдеры/модели из LLM_FALLBACKS.
+"""
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, TypeVar, Awaitable
+
+import httpx
+import openai
+import requests
+
+from config import settings
+
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+# Ошибка в самом запросе: у резервного провайдера тот же запрос получит тот же ответ
+REQUEST_ERROR_STATUS_CODES = {400, 422}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold ошибок подряд) -> open -> (reset_timeout) -> half-open:
+    пропускается один пробный запрос, успех закрывает цепь, ошибка снова открывает.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._half_open_probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._half_open_probe:
+                self._half_open_probe = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                print(f"[DEBUG] Circuit breaker {self.name}: закрыт")
+            self.failures = 0
+            self.opened_at = None
+            self._half_open_probe = False
+
+    def release_probe(self) -> None:
+        """Пробный запрос завершился не по вине провайдера — состояние цепи не меняется."""
+        with self._lock:
+            self._half_open_probe = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._half_open_probe or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._half_open_probe:
+                    print(f"[DEBUG] Circuit breaker {self.name}: открыт на {self.reset_timeout:.0f}s после {self.failures} ошибок")
+                self.opened_at = time.time()
+                self._half_open_probe = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=settings.LLM_CIRCUIT_RESET_TIMEOUT,
+            )
+            _breakers[name] = breaker
+        return breaker
+
+
+def _status_and_headers(exc: Exception):
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None, {}
+    status = getattr(response, "status_code", None)
+    headers = getattr(response, "headers", None) or {}
+    return status, headers
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, (httpx.TransportError, openai.APIConnectionError)):
+        return True
+    if isinstance(exc, (requests.exceptions.HTTPError, httpx.HTTPStatusError, openai.APIStatusError)):
+        status, _ = _status_and_headers(exc)
+        return status in RETRYABLE_STATUS_CODES
+    return False
+
+
+def is_provider_response(exc: Exception) -> bool:
+    """Ошибка — ответ провайдера со статусом (400, 401, ...), а не сбой нашего кода."""
+    if isinstance(exc, (requests.exceptions.HTTPError, httpx.HTTPStatusError, openai.APIStatusError)):
+        status, _ = _status_and_headers(exc)
+        return status is not None
+    return False
+
+
+def is_request_error(exc: Exception) -> bool:
+    """Провайдер отклонил сам запрос (400, 422) — переход к резервному не поможет."""
+    status, _ = _status_and_headers(exc)
+    return is_provider_response(exc) and status in REQUEST_ERROR_STATUS_CODES
+
+
+def get_retry_after(exc: Exception) -> Optional[float]:
+    _, headers = _status_and_headers(exc)
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Экспоненциальная задержка с полным джиттером; Retry-After задаёт нижнюю границу."""
+    cap = min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * (2 ** attempt))
+    delay = random.uniform(0, cap)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, settings.LLM_RETRY_MAX_DELAY))
+    return delay
+
+
+def _target_name(target) -> str:
+    return getattr(target, "key", None) or str(target)
+
+
+def call_with_resilience(call: Callable[[object], T], targets: List[object], return_target: bool = False):
+    """
+    Вызывает call(target) для целей по порядку. Для каждой цели — повторы временных
+    ошибок с задержкой; после исчерпания попыток, при открытом circuit breaker или
+    отказе провайдера (401, 403, 404 — ключ или модель не подходят) — переход к следующей
+    цели. Ошибка запроса (400, 422) и сбой нашего кода поднимаются сразу.
+    return_target=True — результат (цель, ответившая на запрос, результат call), например
+    для ключа кэша под фактическим провайдером/моделью.
+    """
+    last_error: Optional[Exception] = None
+
+    for target in targets:
+        name = _target_name(target)
+        breaker = get_circuit_breaker(name)
+
+        for attempt in range(settings.LLM_RETRY_MAX_ATTEMPTS):
+            if not breaker.allow_request():
+                last_error = last_error or CircuitOpenError(f"Провайдер {name} временно отключён (circuit breaker)")
+                break
+
+            try:
+                result = call(target)
+                breaker.record_success()
+                return (target, result) if return_target else result
+            except Exception as e:
+                if not is_retryable(e):
+                    if not is_provider_response(e):
+                        # Ошибка не от провайдера (разбор ответа, ошибка в коде) — цепь не трогаем
+                        breaker.release_probe()
+                        raise
+                    # Провайдер ответил (например, 400) — это не повод открывать цепь
+                    breaker.record_success()
+                    if is_request_error(e):
+                        raise
+                    # Ключ или модель не подходят этому провайдеру — пробуем следующий
+                    print(f"[DEBUG] {name}: отказ провайдера ({str(e)[:200]})")
+                    last_error = e
+                    break
+                breaker.record_failure()
+                last_error = e
+
+                if attempt + 1 >= settings.LLM_RETRY_MAX_ATTEMPTS:
+                    break
+
+                delay = backoff_delay(attempt, get_retry_after(e))
+                print(f"[DEBUG] {name}: временная ошибка ({str(e)[:200]}), попытка {attempt + 2}/{settings.LLM_RETRY_MAX_ATTEMPTS} через {delay:.1f}s")
+                time.sleep(delay)
+
+        if len(targets) > 1:
+            print(f"[DEBUG] {name}: недоступен, переход к следующему провайдеру")
+
+    raise last_error or CircuitOpenError("Нет доступных провайдеров LLM")
+
+
+async def async_call_with_resilience(
+        call: Callable[[object], Awaitable[T]],
+        targets: List[object],
+        return_target: bool = False
+):
+    """Асинхронный вариант call_with_resilience (ожидание через asyncio.sleep)."""
+    last_error: Optional[Exception] = None
+
+    for target in targets:
+        name = _target_name(target)
+        breaker = get_circuit_breaker(name)
+
+        for attempt in range(settings.LLM_RETRY_MAX_ATTEMPTS):
+            if not breaker.allow_request():
+                last_error = last_error or CircuitOpenError(f"Провайдер {name} временно отключён (circuit breaker)")
+                break
+
+            try:
+                result = await call(target)
+                breaker.record_success()
+                return (target, result) if return_target else result
+            except Exception as e:
+                if not is_retryable(e):
+                    if not is_provider_response(e):
+                        # Ошибка не от провайдера (разбор ответа, ошибка в коде) — цепь не трогаем
+                        breaker.release_probe()
+                        raise
+                    # Провайдер ответил (например, 400) — это не повод открывать цепь
+                    breaker.record_success()
+                    if is_request_error(e):
+                        raise
+                    # Ключ или модель не подходят этому провайдеру — пробуем следующий
+                    print(f"[DEBUG] {name}: отказ провайдера ({str(e)[:200]})")
+                    last_error = e
+                    break
+                breaker.record_failure()
+                last_error = e
+
+                if attempt + 1 >= settings.LLM_RETRY_MAX_ATTEMPTS:
+                    break
+
+                delay = backoff_delay(attempt, get_retry_after(e))
+                print(f"[DEBUG] {name}: временная ошибка ({str(e)[:200]}), попытка {attempt + 2}/{settings.LLM_RETRY_MAX_ATTEMPTS} через {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        if len(targets) > 1:
+            print(f"[DEBUG] {name}: недоступен, переход к следующему провайдеру")
+
+    raise last_error or CircuitOpenError("Нет доступных провайдеров LLM")
@@ -20,6 +20,7 @@ from pydantic import BaseModel
 
 from celery_app import celery_app
 from tasks.analysis_task import process_analysis_task
+from llm.health_monitor import get_llm_health
 
 app = FastAPI(
     title="Product Analyze",
@@ -347,6 +348,7 @@ async def get_analysis(
             "passport_filename": analysis.passport_filename,
             "status": analysis.status.value,
             "comparison_mode": analysis.comparison_mode,
+            "extraction_details": json.loads(analysis.extraction_details) if analysis.extraction_details else None,
         },
         "fields": field_items,
     }
@@ -639,10 +641,16 @@ async def health_check():
     except Exception:
         redis_available = False
 
+    try:
+        llm_status = get_llm_health()
+    except Exception:
+        llm_status = {}
+
     return {
         "status": "ok",
         "timestamp": time.time(),
-        "redis_connected": redis_available
+        "redis_connected": redis_available,
+        "llm": llm_status
     }
 
 
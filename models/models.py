@@ -36,6 +36,10 @@ class Analysis(Base):
     # Статус
     status = Column(Enum(AnalysisStatus), default=AnalysisStatus.PENDING)
 
+    # Сведения об извлечении (JSON): пропущенные страницы, не обработанные сканы,
+    # выбор страниц паспорта, части и способ извлечения ТЗ
+    extraction_details = Column(Text, nullable=True)
+
     # Связь с пользователем
     user = relationship("User", backref="analyses")
 
@@ -3,7 +3,11 @@ from typing import Dict, Any
 import requests
 
 from config import settings
-from llm.llm_provider import LLMProvider
+from llm.llm_cache import LLMCache, get_llm_cache
+from llm.http_transport import get_http_session, get_timeout
+from llm.llm_provider import LLMProvider, LLMTarget, get_llm_targets
+from llm.rate_limiter import estimate_messages_tokens, get_rate_limiter
+from llm.resilience import call_with_resilience
 from utils.json_flattener import flatten_json, format_flattened_value
 from utils.product_matcher import find_matching_model, merge_series_characteristics
 
@@ -15,6 +19,10 @@ class SpecificationComparator:
         self.client = provider.client
         self.model = provider.model
         self.max_tokens = provider.max_tokens
+        self.cache = get_llm_cache()
+        # Основной провайдер и резервные (LLM_FALLBACKS); резервные создаются при первом обращении
+        self._targets = get_llm_targets()
+        self._providers: Dict[str, LLMProvider] = {self._targets[0].key: provider}
 
 
     def compare_specifications(
@@ -37,16 +45,37 @@ class SpecificationComparator:
         prompt = self.create_analysis_prompt(mode)
         full_prompt = f"{prompt}\n\nТЗ:\n{tz_flat}\n\nПаспорт:\n{passport_flat}"
 
-        if settings.LLM_PROVIDER == 'local':  # костыль из за lm studio (или глупого меня)
-            url = str(settings.LLM_API_URL).rstrip('/') + '/chat/completions'
+        if self.cache is not None:
+            cached = self.cache.get(self._cache_key(self._targets[0], full_prompt))
+            if cached is not None:
+                return cached
+
+        served, data_response = call_with_resilience(
+            lambda target: self._request_comparison(target, full_prompt, tz_flat, passport_flat),
+            self._targets,
+            return_target=True
+        )
+
+        # Ответ резервного провайдера кэшируется под его моделью; пустой ответ не кэшируется,
+        # иначе сбой повторялся бы весь LLM_CACHE_TTL
+        if self._response_content(data_response).strip():
+            self._cache_set(self._cache_key(served, full_prompt), data_response)
+
+        return data_response
+
+    def _request_comparison(self, target: LLMTarget, full_prompt: str, tz_flat, passport_flat) -> Dict[str, Any]:
+        if target.provider == 'local':  # костыль из за lm studio (или глупого меня)
+            url = str(target.api_url).rstrip('/') + '/chat/completions'
             data = {
-                'model': self.provider.model,
+                'model': target.model,
                 'messages': [{
                     "role": "user",
                     "content": full_prompt,
                 }]
             }
-            response = requests.post(url, json=data)
+            get_rate_limiter().acquire(target.key, estimate_messages_tokens(data['messages']))
+            response = get_http_session().post(url, json=data, timeout=get_timeout())
+            response.raise_for_status()
             return response.json()
 
         messages = [{
@@ -54,21 +83,44 @@ class SpecificationComparator:
             "content": full_prompt
         }]
 
-        response = self.client.chat.completions.create(
-            model=self.model,
+        get_rate_limiter().acquire(target.key, estimate_messages_tokens(messages))
+        response = self._provider(target).client.chat.completions.create(
+            model=target.model,
             messages=messages
         )
 
         # Конвертируем в dict
         response_dict = response.to_dict()
 
-        data_response = {
+        return {
             'response': response_dict,
             'tz_data': tz_flat,
             'passport_data': passport_flat
         }
 
-        return data_response
+    def _provider(self, target: LLMTarget) -> LLMProvider:
+        provider = self._providers.get(target.key)
+        if provider is None:
+            provider = LLMProvider(target=target)
+            self._providers[target.key] = provider
+        return provider
+
+    @staticmethod
+    def _cache_key(target: LLMTarget, full_prompt: str) -> str:
+        return LLMCache.make_key(target.provider, target.model, full_prompt)
+
+    @staticmethod
+    def _response_content(data_response: Dict[str, Any]) -> str:
+        """Текст ответа модели; пустая строка — ответ пустой или это ошибка без choices."""
+        response = data_response.get('response', data_response) if isinstance(data_response, dict) else None
+        try:
+            return response['choices'][0]['message']['content'] or ""
+        except (KeyError, IndexError, TypeError):
+            return ""
+
+    def _cache_set(self, key: str, value: Dict[str, Any]) -> None:
+        if self.cache is not None:
+            self.cache.set(key, value)
 
     def create_analysis_prompt(self, mode: str = "flexible"):
         if mode == "strict":
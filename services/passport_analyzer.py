@@ -4,41 +4,105 @@ import io
 import time
 import fitz
 from pathlib import Path
-from typing import Dict, Any, Union, List
+from typing import Dict, Any, Union, List, Optional, Callable
 
 import requests
 from PIL import Image
 
 from config import settings
 from handlers.file_handler import FileHandler
-from llm.llm_service import LLMService
+from llm.async_llm_service import create_llm_service
+from llm.health_monitor import ensure_llm_available
 from services import prompts_service
 from services.base_analyzer import BaseAnalyzer
 from llm.llm_provider import LLMProvider
+from utils.json_flattener import flatten_json
+from utils.page_filter import iter_filtered_pages
+from utils.page_ranker import rank_pages
 
 
 class PassportAnalyzer(BaseAnalyzer):
 
-    def __init__(self, provider, pages_per_request: int = 1):
+    def __init__(self, provider, pages_per_request: Optional[int] = None):
         super().__init__(provider)
-        self.pages_per_request = pages_per_request
+        self.pages_per_request = pages_per_request or settings.LLM_PAGES_PER_REQUEST
 
-    def analyze_passport_file(self, file_path: Union[str, Path]) -> Dict[str, Any]:
+    def analyze_passport_file(
+            self,
+            file_path: Union[str, Path],
+            on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+            metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
 
         file_path = Path(file_path)
         file_handler = FileHandler()
-        llm_service = LLMService()
-        passport_data = file_handler.get_data_from_file(file_path)
+        llm_service = create_llm_service()
+        llm_service.progress_callback = on_progress
+        llm_service.pages_per_request = self.pages_per_request
+        metadata = metadata if metadata is not None else {}
         prompt = prompts_service.get_passport_initial_analyze_prompt()
-        llm_service._check_llm_connection()
-        return llm_service.extract_characteristics_via_llm(passport_data, prompt)
 
+        # Страницы читаются потоком: пустые и повторы отсеиваются сразу после растеризации
+        fingerprints = {}
+        skipped_pages = []
+        metadata['skipped_pages'] = skipped_pages
+        # Сканы, не извлечённые из-за сбоев LLM (заполняется по ходу извлечения)
+        metadata['failed_scans'] = llm_service.failed_scans
+        passport_pages = iter_filtered_pages(file_handler.iter_data_from_file(file_path), skipped_pages, fingerprints)
+
+        ensure_llm_available()
+
+        total_pages = self._count_pages(file_path)
+        if (
+            not settings.PAGE_RANK_ENABLED
+            or file_path.suffix.lower() != '.pdf'
+            or total_pages < settings.PAGE_RANK_MIN_DOCUMENT_PAGES
+        ):
+            # Без ранжирования батчи уходят в LLM по мере растеризации страниц
+            return llm_service.extract_characteristics_via_llm(passport_pages, prompt)
+
+        # Ранжированию нужны все страницы сразу
+        passport_data = list(passport_pages)
+        skipped_numbers = {page['page'] for page in skipped_pages}
+        page_numbers = [num for num in range(1, total_pages + 1) if num not in skipped_numbers]
+        selected, reserve, scores = rank_pages(passport_data, page_numbers, fingerprints)
+
+        print(f"[DEBUG] Ранжирование страниц: в LLM {len(selected)} из {len(passport_data)} | страницы {[page_numbers[i] for i in selected]}")
+        result = llm_service.extract_characteristics_via_llm([passport_data[i] for i in selected], prompt)
+
+        fallback_used = False
+        found = len(flatten_json(result)) if isinstance(result, dict) else 0
+        if reserve and found < settings.PAGE_RANK_MIN_CHARACTERISTICS:
+            # Лучшие страницы дали слишком мало характеристик — досылаем остальные
+            print(f"[DEBUG] Ранжирование страниц: найдено {found} характеристик, обработка остальных {len(reserve)} страниц")
+            reserve_result = llm_service.extract_characteristics_via_llm([passport_data[i] for i in reserve], prompt)
+            result = llm_service._reduce_page_results([result, reserve_result])
+            fallback_used = True
+
+        metadata['ranked_pages'] = {
+            'selected': [page_numbers[i] for i in selected],
+            'reserve': [page_numbers[i] for i in reserve],
+            'fallback_used': fallback_used,
+            'scores': scores,
+        }
+
+        return result
+
+    @staticmethod
+    def _count_pages(file_path: Path) -> int:
+        """Число страниц PDF без чтения содержимого (для решения о ранжировании)."""
+        if file_path.suffix.lower() != '.pdf':
+            return 0
+        with fitz.open(file_path) as doc:
+            return len(doc)
 
 
 def analyze_passport_file(
         file_path: Union[str, Path],
-        pages_per_request: int = 1
+        pages_per_request: Optional[int] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        metadata: Optional[Dict[str, Any]] = None
 ) -> Dict[str, Any]:
     llm_provider = LLMProvider(settings.LLM_PROVIDER)
     analyzer = PassportAnalyzer(llm_provider, pages_per_request=pages_per_request)
-    return analyzer.analyze_passport_file(file_path)
\ No newline at end of file
+    return analyzer.analyze_passport_file(file_path, on_progress=on_progress, metadata=metadata)
\ No newline at end of file
@@ -1,38 +1,82 @@
 import requests
-from typing import Dict, Any, Union
+from typing import Dict, Any, Union, Optional, Callable
 from pathlib import Path
 from docx import Document
 
 from config import settings
 from llm import llm_service
-from llm.llm_service import LLMService
+from llm.async_llm_service import create_llm_service
+from llm.health_monitor import ensure_llm_available
 from services import prompts_service
 from handlers.file_handler import FileHandler
 from services.base_analyzer import BaseAnalyzer
 from llm.llm_provider import LLMProvider
 from utils.deduplicator import deduplicate_tz_items
+from utils.page_filter import filter_pages
+from utils.tz_chunker import describe_chunks, split_tz_data
+from utils.tz_rule_extractor import extract_tz_items
 
 
 class TzAnalyzer(BaseAnalyzer):
 
-    def analize_tz_file(self, file_path):
+    def analize_tz_file(
+            self,
+            file_path,
+            on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+            metadata: Optional[Dict[str, Any]] = None
+    ):
         file_handler = FileHandler()
-        llm_service = LLMService()
-        tz_data = file_handler.get_data_from_file(file_path)
+        llm_service = create_llm_service()
+        llm_service.progress_callback = on_progress
+        # Разбору по правилам и делению на части нужен весь документ; пустые и повторяющиеся
+        # сканы отсеиваются по ходу чтения и в памяти не копятся
+        tz_data, skipped_pages = filter_pages(file_handler.iter_data_from_file(Path(file_path)))
+        if metadata is not None:
+            metadata['skipped_pages'] = skipped_pages
+            # Сканы ТЗ, не извлечённые из-за сбоев LLM
+            metadata['failed_scans'] = llm_service.failed_scans
+
+        # ТЗ стандартного вида разбирается по правилам, LLM — только при низкой уверенности
+        if settings.TZ_RULES_ENABLED:
+            rules_result, confidence = extract_tz_items(tz_data)
+            print(f"[DEBUG] Разбор ТЗ по правилам | confidence={confidence:.2f} | "
+                  f"items={len(rules_result['items']) if rules_result else 0}")
+            if metadata is not None:
+                metadata['extraction'] = {'method': 'llm', 'confidence': round(confidence, 3)}
+            if rules_result and confidence >= settings.TZ_RULES_MIN_CONFIDENCE:
+                if metadata is not None:
+                    metadata['extraction']['method'] = 'rules'
+                return deduplicate_tz_items(rules_result)
+
         prompt = prompts_service.get_tz_analyze_prompt()
-        llm_service._check_llm_connection()
-        result = llm_service.extract_characteristics_via_llm(tz_data, prompt)
+        ensure_llm_available()
+
+        # Большое ТЗ — частями по позициям, параллельно
+        chunks = split_tz_data(tz_data, settings.TZ_CHUNK_TOKENS)
+        if len(chunks) > 1:
+            failed_chunks = []
+            result = llm_service.extract_chunks_via_llm(chunks, prompt, failed_chunks)
+            if failed_chunks:
+                print(f"[DEBUG] ТЗ извлечено не полностью | не обработаны части {[f['chunk'] for f in failed_chunks]}")
+            if metadata is not None:
+                metadata['chunks'] = describe_chunks(chunks, failed_chunks)
+        else:
+            result = llm_service.extract_characteristics_via_llm(tz_data, prompt)
 
-        # Пост-обработка: удаление дублирующихся позиций
+        # Пост-обработка: удаление дублирующихся позиций (в том числе на стыках частей)
         result = deduplicate_tz_items(result)
 
         return result
 
 
-def analyze_tz_file(file_path: Union[str, Path]) -> Dict[str, Any]:
+def analyze_tz_file(
+        file_path: Union[str, Path],
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        metadata: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
     llm_provider = LLMProvider(settings.LLM_PROVIDER)
     analyzer = TzAnalyzer(llm_provider)
-    return analyzer.analize_tz_file(file_path)
+    return analyzer.analize_tz_file(file_path, on_progress=on_progress, metadata=metadata)
 
 
 
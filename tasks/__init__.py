@@ -1,4 +1,5 @@
 from .analysis_task import process_analysis_task
+from .health_task import probe_llm_health_task
 
 # Экспортируем все задачи из папки
-__all__ = ['process_analysis_task']
\ No newline at end of file
+__all__ = ['process_analysis_task', 'probe_llm_health_task']
\ No newline at end of file
@@ -1,12 +1,14 @@
 import time
 import json
 import os
+import threading
 from pathlib import Path
 from datetime import datetime
 from celery import Task
 
 from celery_app import celery_app
 from db.database import SessionLocal
+from llm.rate_limiter import set_rate_limit_user
 from models.models import Analysis, AnalysisStatus, FieldVerification
 from services.tz_analyzer import analyze_tz_file
 from services.passport_analyzer import analyze_passport_file
@@ -43,17 +45,49 @@ def process_analysis_task(self, analysis_id: int, tz_path: str, passport_path: s
         if not analysis:
             raise ValueError(f"Анализ с ID {analysis_id} не найден")
 
+        set_rate_limit_user(analysis.user_id)
+
         self.update_state(
             state='PROGRESS',
             meta={'status': 'Анализ файла ТЗ...', 'progress': 20}
         )
-        tz_data = analyze_tz_file(Path(tz_path))
+        tz_metadata = {}
+        tz_progress, flush_tz_progress = make_partial_progress_callback(self, 'Анализ файла ТЗ...', 20)
+        tz_data = analyze_tz_file(
+            Path(tz_path),
+            on_progress=tz_progress,
+            metadata=tz_metadata
+        )
+        flush_tz_progress()
 
         self.update_state(
             state='PROGRESS',
             meta={'status': 'Анализ файла паспорта...', 'progress': 40}
         )
-        passport_data = analyze_passport_file(Path(passport_path))
+        passport_metadata = {}
+        passport_progress, flush_passport_progress = make_partial_progress_callback(self, 'Анализ файла паспорта...', 40)
+        passport_data = analyze_passport_file(
+            Path(passport_path),
+            on_progress=passport_progress,
+            metadata=passport_metadata
+        )
+        flush_passport_progress()
+
+        # Пустые и повторяющиеся страницы, не отправленные в LLM, и выбор страниц паспорта
+        skipped_pages = {
+            'tz': tz_metadata.get('skipped_pages', []),
+            'passport': passport_metadata.get('skipped_pages', []),
+        }
+        ranked_pages = passport_metadata.get('ranked_pages')
+        # Сканы, пропущенные из-за сбоев LLM: результат без них неполный
+        failed_scans = {
+            'tz': tz_metadata.get('failed_scans', []),
+            'passport': passport_metadata.get('failed_scans', []),
+        }
+        # Большое ТЗ, извлечённое частями
+        tz_chunks = tz_metadata.get('chunks')
+        # Способ извлечения ТЗ: по правилам или через LLM
+        tz_extraction = tz_metadata.get('extraction')
 
         self.update_state(
             state='PROGRESS',
@@ -81,6 +115,14 @@ def process_analysis_task(self, analysis_id: int, tz_path: str, passport_path: s
         processing_time = int(end_time - start_time)
 
         analysis.status = AnalysisStatus.COMPLETED
+        # Результат задачи Celery со временем удаляется — сведения об извлечении хранятся в анализе
+        analysis.extraction_details = json.dumps({
+            'skipped_pages': skipped_pages,
+            'failed_scans': failed_scans,
+            'ranked_pages': ranked_pages,
+            'tz_chunks': tz_chunks,
+            'tz_extraction': tz_extraction,
+        }, ensure_ascii=False)
 
         self.db.commit()
 
@@ -97,14 +139,24 @@ def process_analysis_task(self, analysis_id: int, tz_path: str, passport_path: s
                 'status': 'Анализ завершен успешно',
                 'progress': 100,
                 'analysis_id': analysis_id,
-                'processing_time': processing_time
+                'processing_time': processing_time,
+                'skipped_pages': skipped_pages,
+                'failed_scans': failed_scans,
+                'ranked_pages': ranked_pages,
+                'tz_chunks': tz_chunks,
+                'tz_extraction': tz_extraction
             }
         )
 
         return {
             'status': 'completed',
             'analysis_id': analysis_id,
-            'processing_time': processing_time
+            'processing_time': processing_time,
+            'skipped_pages': skipped_pages,
+            'failed_scans': failed_scans,
+            'ranked_pages': ranked_pages,
+            'tz_chunks': tz_chunks,
+            'tz_extraction': tz_extraction
         }
 
     except Exception as e:
@@ -127,6 +179,7 @@ def process_analysis_task(self, analysis_id: int, tz_path: str, passport_path: s
         raise
 
     finally:
+        set_rate_limit_user(None)
         try:
             if os.path.exists(tz_path):
                 os.remove(tz_path)
@@ -136,6 +189,46 @@ def process_analysis_task(self, analysis_id: int, tz_path: str, passport_path: s
             print(f"Error cleaning up files: {e}")
 
 
+def make_partial_progress_callback(task, status: str, progress: int, min_interval: float = 1.0):
+    """
+    Колбэк для потокового режима LLM: копит характеристики по мере появления
+    и публикует их в meta задачи (не чаще раза в min_interval секунд).
+    Возвращает (callback, flush): flush публикует характеристики, пришедшие после
+    последней публикации, — вызывается по окончании извлечения.
+    """
+    partial = {}
+    lock = threading.Lock()
+    last_update = [0.0]
+    pending = [False]
+
+    def publish():
+        last_update[0] = time.time()
+        pending[0] = False
+        task.update_state(
+            state='PROGRESS',
+            meta={
+                'status': status,
+                'progress': progress,
+                'partial_characteristics': dict(partial)
+            }
+        )
+
+    def callback(characteristics: dict):
+        with lock:
+            partial.update(characteristics)
+            pending[0] = True
+            if time.time() - last_update[0] < min_interval:
+                return
+            publish()
+
+    def flush():
+        with lock:
+            if pending[0]:
+                publish()
+
+    return callback, flush
+
+
 def create_field_verifications_from_result(analysis_id: int, comparison_result: dict, db):
     details = None
 
@@ -0,0 +1,10 @@
+from celery_app import celery_app
+from llm.health_monitor import probe_llm_targets
+
+
+@celery_app.task(name="tasks.probe_llm_health", ignore_result=True)
+def probe_llm_health_task():
+    results = probe_llm_targets()
+    for key, status in results.items():
+        print(f"[DEBUG] Статус LLM {key}: healthy={status['healthy']} | latency={status['latency']}s")
+    return results
@@ -0,0 +1,143 @@
+"""
+Сравнение пресетов растеризации PDF: время рендера и кодирования, размер
+полезной нагрузки (байты и base64 в запросе) и стоимость в vision-токенах.
+С --adaptive каждый пресет прогоняется дважды — с фиксированным масштабом и
+с DPI по странице (PDF_RENDER_ADAPTIVE) — и в отчёт добавляются средний DPI и
+читаемость: доля страниц, где мелкий текст после рендера не ниже --legible-px.
+С --llm страницы каждого прогона отправляются в LLM, и точность оценивается
+числом найденных характеристик.
+
+    python tools/benchmark_render.py passport.pdf
+    python tools/benchmark_render.py passport.pdf --presets png,jpeg,gray --max-size 1600 --pages 10
+    python tools/benchmark_render.py corpus/*.pdf --presets jpeg --adaptive --llm
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings  # noqa: E402
+
+from handlers.render_dpi import PDF_DPI, SMALL_FONT_PERCENTILE, _font_sizes  # noqa: E402
+from handlers.render_presets import RENDER_PRESETS, RenderPreset  # noqa: E402
+from llm.page_batcher import estimate_image_tokens  # noqa: E402
+
+
+def benchmark_preset(
+    doc: fitz.Document,
+    preset: RenderPreset,
+    page_count: int,
+    adaptive: bool = False,
+    legible_px: float = 16,
+    keep_images: bool = False
+) -> dict:
+    render_time = 0.0
+    encode_time = 0.0
+    payload_bytes = 0
+    base64_bytes = 0
+    tokens = 0
+    dpis = []
+    text_pages = 0
+    legible_pages = 0
+    images = []
+
+    for page_num in range(page_count):
+        page = doc.load_page(page_num)
+
+        start = time.perf_counter()
+        zoom = preset.zoom_for(page, adaptive)
+        img = preset.rasterize(page, adaptive)
+        render_time += time.perf_counter() - start
+        dpis.append(zoom * PDF_DPI)
+
+        sizes = _font_sizes(page)
+        if sizes:
+            text_pages += 1
+            legible_pages += sizes[int(len(sizes) * SMALL_FONT_PERCENTILE)] * zoom >= legible_px
+
+        # Постобработка и кодирование — то, что отличает пресеты
+        start = time.perf_counter()
+        data = preset.encode(preset.postprocess(img))
+        encode_time += time.perf_counter() - start
+
+        payload_bytes += len(data)
+        base64_bytes += len(base64.b64encode(data))
+        tokens += estimate_image_tokens(data)
+        if keep_images:
+            images.append(data)
+
+    return {
+        "preset": preset.name,
+        "mode": "adaptive" if adaptive else "fixed",
+        "render_s": render_time,
+        "encode_s": encode_time,
+        "bytes": payload_bytes,
+        "base64": base64_bytes,
+        "tokens": tokens,
+        "dpi": sum(dpis) / max(len(dpis), 1),
+        "legible": f"{legible_pages}/{text_pages}" if text_pages else "-",
+        "images": images,
+    }
+
+
+def count_characteristics(images: list) -> int:
+    """Сколько характеристик LLM извлекла из страниц (оценка точности прогона)."""
+    from llm.async_llm_service import create_llm_service
+    from services import prompts_service
+    from utils.json_flattener import flatten_json
+
+    result = create_llm_service().extract_characteristics_via_llm(images, prompts_service.get_passport_initial_analyze_prompt())
+    return len(flatten_json(result)) if isinstance(result, dict) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пресетов растеризации PDF")
+    parser.add_argument("pdf", nargs="+", help="один или несколько PDF (корпус)")
+    parser.add_argument("--presets", default=",".join(RENDER_PRESETS), help="через запятую")
+    parser.add_argument("--max-size", type=int, help="длинная сторона, px (по умолчанию PDF_RENDER_MAX_SIZE)")
+    parser.add_argument("--pages", type=int, default=0, help="сколько первых страниц (0 — все)")
+    parser.add_argument("--adaptive", action="store_true", help="сравнить фиксированный масштаб и DPI по странице")
+    parser.add_argument("--legible-px", type=float, default=16, help="мин. высота мелкого текста, px, для читаемости")
+    parser.add_argument("--llm", action="store_true", help="оценить точность извлечением характеристик через LLM")
+    args = parser.parse_args()
+
+    modes = [False, True] if args.adaptive else [None]
+
+    for pdf in args.pdf:
+        with fitz.open(pdf) as doc:
+            page_count = min(len(doc), args.pages) if args.pages else len(doc)
+            print(f"{pdf}: {page_count} стр.\n")
+            print(
+                f"{'пресет':<8} {'режим':<9} {'DPI':>5} {'рендер, с':>10} {'кодир., с':>10} {'всего, с':>9} "
+                f"{'КБ':>9} {'КБ base64':>10} {'КБ/стр':>8} {'токены':>8} {'читаемо':>8}"
+                + (f" {'характ.':>8}" if args.llm else "")
+            )
+
+            for name in args.presets.split(","):
+                base = RENDER_PRESETS[name.strip()]
+                preset = RenderPreset(
+                    base.name, base.image_format, base.quality, base.grayscale,
+                    base.binarize_threshold, base.enhance, base.optimize, args.max_size
+                )
+                for adaptive in modes:
+                    r = benchmark_preset(doc, preset, page_count, adaptive, args.legible_px, keep_images=args.llm)
+                    if adaptive is None:
+                        r["mode"] = "adaptive" if settings.PDF_RENDER_ADAPTIVE else "fixed"
+                    line = (
+                        f"{r['preset']:<8} {r['mode']:<9} {r['dpi']:>5.0f} {r['render_s']:>10.2f} {r['encode_s']:>10.2f} "
+                        f"{r['render_s'] + r['encode_s']:>9.2f} {r['bytes'] / 1024:>9.0f} {r['base64'] / 1024:>10.0f} "
+                        f"{r['bytes'] / 1024 / max(page_count, 1):>8.0f} {r['tokens']:>8} {r['legible']:>8}"
+                    )
+                    if args.llm:
+                        line += f" {count_characteristics(r['images']):>8}"
+                    print(line)
+            print()
+
+
+if __name__ == "__main__":
+    main()
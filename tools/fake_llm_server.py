@@ -0,0 +1,362 @@
+"""
+Детерминированная заглушка OpenAI-совместимого LLM для нагрузочного тестирования.
+
+Реализует /v1/chat/completions (обычный и потоковый SSE-ответ) и /v1/models — то,
+что использует провайдер local. Задержка, ошибки и ответ зависят только от хэша
+запроса и --seed, поэтому прогоны воспроизводимы.
+
+Запуск:
+    python tools/fake_llm_server.py --port 1234 --latency lognormal:0.0,0.5 --per-image 0.3 \\
+        --max-concurrency 4 --rpm 120 --error-rate 0.02
+
+В .env воркера:
+    LLM_PROVIDER=local
+    LLM_API_URL=http://127.0.0.1:1234/v1
+    LLM_API_KEY=fake
+    LLM_MODEL=fake-model
+
+GET /stats — счётчики и перцентили задержек, POST /stats/reset — сброс.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def parse_latency(spec: str):
+    """
+    fixed:0.5 | uniform:0.2,1.5 | normal:1.0,0.3 | lognormal:mu,sigma | exp:mean.
+    Возвращает функцию rng -> секунды.
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v.strip()]
+
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class FakeLLM:
+
+    def __init__(self, args):
+        self.args = args
+        self.latency = parse_latency(args.latency)
+        self.canned = self._load_canned(args.canned)
+        self.slots = threading.Semaphore(args.max_concurrency) if args.max_concurrency else None
+        self._rpm_window: deque = deque()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @staticmethod
+    def _load_canned(path: Optional[str]) -> Dict[str, Any]:
+        """JSON {"<sha256 промпта или изображения>": <ответ: строка или объект>}."""
+        if not path:
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {"requests": 0, "errors": 0, "rate_limited": 0, "images": 0, "in_flight": 0, "max_in_flight": 0}
+            self.latencies: List[float] = []
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            result = dict(self.stats)
+            latencies = list(self.latencies)
+        result["latency"] = {
+            f"p{p}": percentile(latencies, p) for p in (50, 90, 95, 99)
+        }
+        result["latency"]["max"] = max(latencies) if latencies else None
+        return result
+
+    def check_rpm(self) -> Optional[float]:
+        """None — запрос пропускается, иначе число секунд для Retry-After."""
+        if not self.args.rpm:
+            return None
+        now = time.time()
+        with self._lock:
+            while self._rpm_window and now - self._rpm_window[0] >= 60:
+                self._rpm_window.popleft()
+            if len(self._rpm_window) >= self.args.rpm:
+                self.stats["rate_limited"] += 1
+                return max(0.1, 60 - (now - self._rpm_window[0]))
+            self._rpm_window.append(now)
+        return None
+
+    def split_messages(self, messages: List[Dict[str, Any]]) -> Tuple[str, List[bytes]]:
+        texts, images = [], []
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, str):
+                texts.append(content)
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    texts.append(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    url = part.get("image_url", {}).get("url", "")
+                    try:
+                        images.append(base64.b64decode(url.split(",", 1)[1]))
+                    except (IndexError, ValueError):
+                        images.append(url.encode("utf-8"))
+        return "\n".join(texts), images
+
+    def build_content(self, prompt: str, images: List[bytes]) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        image_hashes = [hashlib.sha256(image).hexdigest() for image in images]
+
+        for key in [prompt_hash] + image_hashes:
+            if key in self.canned:
+                value = self.canned[key]
+                return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+        if "Паспорт:" in prompt and "ТЗ:" in prompt:
+            return self._comparison_output(prompt, prompt_hash)
+        if '"items"' in prompt:
+            return json.dumps(self._tz_output(prompt_hash), ensure_ascii=False)
+        if images:
+            result = {}
+            for index, image_hash in enumerate(image_hashes):
+                result.update(self._characteristics(image_hash, 4, prefix=f"Стр{index + 1} "))
+            return json.dumps(result, ensure_ascii=False)
+        return json.dumps(self._characteristics(prompt_hash, 6), ensure_ascii=False)
+
+    @staticmethod
+    def _characteristics(digest: str, count: int, prefix: str = "") -> Dict[str, str]:
+        return {
+            f"{prefix}Характеристика {digest[i * 4:i * 4 + 4]}": f"{int(digest[i * 4:i * 4 + 4], 16) % 1000} ед."
+            for i in range(count)
+        }
+
+    def _tz_output(self, digest: str) -> Dict[str, Any]:
+        return {"items": [{
+            "Наименование": f"Изделие {digest[:6]}",
+            "Ед. изм.": "шт",
+            "Кол-во": str(int(digest[6:8], 16) % 10 + 1),
+            "Характеристики": self._characteristics(digest[8:], 5),
+        }]}
+
+    @staticmethod
+    def _comparison_output(prompt: str, digest: str) -> str:
+        # Ключи ТЗ берём из плоского JSON после "ТЗ:", чтобы ответ был похож на настоящий
+        tz_part = prompt.split("ТЗ:", 1)[1].split("Паспорт:", 1)[0]
+        keys = re.findall(r"'([^']+)':", tz_part)[:20] or [f"criterion_{digest[:4]}"]
+        details = {}
+        for index, key in enumerate(keys):
+            matched = int(digest[index % 64], 16) % 3 != 0
+            details[key] = {
+                "status": "matched" if matched else "mismatched",
+                "expected": "значение из ТЗ",
+                "actual": "значение из паспорта",
+                "message": "заглушка",
+                "quote": "заглушка",
+            }
+        result = {
+            "matched": all(d["status"] == "matched" for d in details.values()),
+            "criteria_success": [k for k, d in details.items() if d["status"] == "matched"],
+            "criteria_error": [k for k, d in details.items() if d["status"] != "matched"],
+            "details": details,
+        }
+        return "```json\n" + json.dumps(result, ensure_ascii=False, indent=2) + "\n```"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    llm: FakeLLM = None
+
+    def log_message(self, format, *args):
+        if self.llm.args.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": self.llm.args.model, "object": "model"}]})
+        elif self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.llm.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+
+        if self.path.rstrip("/") == "/stats/reset":
+            self.llm.reset_stats()
+            self._send_json(200, {"ok": True})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        try:
+            request = json.loads(raw)
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+
+        self._handle_completion(request, raw)
+
+    def _handle_completion(self, request: Dict[str, Any], raw: bytes) -> None:
+        llm = self.llm
+        retry_after = llm.check_rpm()
+        if retry_after is not None:
+            self._send_json(429, {"error": {"message": "rate limit"}}, {"Retry-After": f"{retry_after:.1f}"})
+            return
+
+        prompt, images = llm.split_messages(request.get("messages", []))
+        # Отдельный генератор на запрос: одинаковый запрос даёт одинаковые задержку и ошибки
+        rng = random.Random(f"{llm.args.seed}:{hashlib.sha256(raw).hexdigest()}")
+        delay = llm.latency(rng) + llm.args.per_image * len(images)
+        fail = rng.random() < llm.args.error_rate
+
+        start = time.time()
+        if llm.slots is not None:
+            llm.slots.acquire()
+        with llm._lock:
+            llm.stats["requests"] += 1
+            llm.stats["images"] += len(images)
+            llm.stats["in_flight"] += 1
+            llm.stats["max_in_flight"] = max(llm.stats["max_in_flight"], llm.stats["in_flight"])
+        try:
+            time.sleep(delay)
+            if fail:
+                with llm._lock:
+                    llm.stats["errors"] += 1
+                self._send_json(llm.args.error_status, {"error": {"message": "injected error"}})
+                return
+
+            content = llm.build_content(prompt, images)
+            if request.get("stream"):
+                self._send_stream(content, request)
+            else:
+                self._send_json(200, self._completion(content, request, prompt, images))
+        finally:
+            with llm._lock:
+                llm.stats["in_flight"] -= 1
+                llm.latencies.append(time.time() - start)
+            if llm.slots is not None:
+                llm.slots.release()
+
+    def _completion(self, content: str, request: Dict[str, Any], prompt: str, images: List[bytes]) -> Dict[str, Any]:
+        prompt_tokens = len(prompt) // 3 + 765 * len(images)
+        completion_tokens = len(content) // 3
+        return {
+            "id": f"chatcmpl-{hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", self.llm.args.model),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _send_stream(self, content: str, request: Dict[str, Any]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        chunk_size = self.llm.args.stream_chunk
+        try:
+            for i in range(0, len(content), chunk_size):
+                event = {
+                    "object": "chat.completion.chunk",
+                    "model": request.get("model", self.llm.args.model),
+                    "choices": [{"index": 0, "delta": {"content": content[i:i + chunk_size]}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if self.llm.args.stream_delay:
+                    time.sleep(self.llm.args.stream_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл поток досрочно (JSON уже собран) — это нормально
+            pass
+
+
+def create_server(args) -> ThreadingHTTPServer:
+    handler = type("FakeLLMHandler", (Handler,), {"llm": FakeLLM(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого LLM")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--model", default="fake-model")
+    parser.add_argument("--latency", default="fixed:0.5",
+                        help="fixed:S | uniform:A,B | normal:MU,SIGMA | lognormal:MU,SIGMA | exp:MEAN")
+    parser.add_argument("--per-image", type=float, default=0.0, help="доп. задержка на изображение, с")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="одновременно обрабатываемых запросов (0 — без ограничения)")
+    parser.add_argument("--rpm", type=int, default=0, help="лимит запросов в минуту, сверх — 429 с Retry-After")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов, завершающихся ошибкой")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--canned", help="JSON {sha256 промпта/изображения: ответ}")
+    parser.add_argument("--stream-chunk", type=int, default=16, help="символов в одном SSE-событии")
+    parser.add_argument("--stream-delay", type=float, default=0.0, help="пауза между SSE-событиями, с")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    server = create_server(args)
+    print(f"Fake LLM: http://{args.host}:{args.port}/v1 | latency={args.latency} | rpm={args.rpm} | error_rate={args.error_rate}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
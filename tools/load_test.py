@@ -0,0 +1,201 @@
+"""
+Нагрузочный прогон пайплайна анализа через HTTP API.
+
+Логинится, отправляет N анализов в /api/analysis/create с заданной параллельностью,
+опрашивает /api/analysis/{id}/status и считает перцентили длительности этапов
+(по смене task_info.status) и общую пропускную способность.
+
+Пример (воркер настроен на tools/fake_llm_server.py):
+    python tools/load_test.py --base-url http://127.0.0.1:8000 --username admin --password admin \\
+        --tz samples/tz.docx --passport samples/passport.pdf -n 20 -c 5 \\
+        --fake-llm-url http://127.0.0.1:1234
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import requests
+
+
+FINAL_STATES = {"SUCCESS", "FAILURE", "REVOKED"}
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def login(base_url: str, username: str, password: str) -> requests.Session:
+    session = requests.Session()
+    response = session.post(f"{base_url}/api/login", data={"username": username, "password": password}, timeout=30)
+    if response.status_code != 200 or not response.json().get("success"):
+        raise RuntimeError(f"Не удалось авторизоваться: {response.status_code} {response.text[:200]}")
+    return session
+
+
+def run_analysis(session: requests.Session, args) -> Dict[str, Any]:
+    """Один анализ: отправка, опрос до финального состояния, времена этапов."""
+    result = {"stages": {}, "state": None, "error": None}
+    start = time.time()
+
+    with open(args.tz, "rb") as tz_file, open(args.passport, "rb") as passport_file:
+        response = session.post(
+            f"{args.base_url}/api/analysis/create",
+            files={
+                "tz_file": (os.path.basename(args.tz), tz_file),
+                "passport_file": (os.path.basename(args.passport), passport_file),
+            },
+            data={"comparison_mode": args.mode},
+            timeout=120,
+        )
+    result["submit"] = time.time() - start
+
+    payload = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+    if response.status_code != 200 or not payload.get("success"):
+        result["state"] = "SUBMIT_ERROR"
+        result["error"] = f"{response.status_code}: {response.text[:200]}"
+        result["total"] = time.time() - start
+        return result
+
+    analysis_id = payload["analysis_id"]
+    result["analysis_id"] = analysis_id
+
+    stage, stage_start = "В очереди", time.time()
+    deadline = start + args.timeout
+    while time.time() < deadline:
+        try:
+            status = session.get(f"{args.base_url}/api/analysis/{analysis_id}/status", timeout=30).json()
+        except (requests.RequestException, ValueError) as e:
+            result["error"] = str(e)
+            time.sleep(args.poll_interval)
+            continue
+
+        state = status.get("task_state")
+        info = status.get("task_info") or {}
+        current = info.get("status") if isinstance(info, dict) else None
+
+        if current and current != stage and state not in FINAL_STATES:
+            result["stages"][stage] = result["stages"].get(stage, 0) + time.time() - stage_start
+            stage, stage_start = current, time.time()
+
+        if state in FINAL_STATES:
+            result["stages"][stage] = result["stages"].get(stage, 0) + time.time() - stage_start
+            result["state"] = state
+            if state != "SUCCESS":
+                result["error"] = info.get("error") if isinstance(info, dict) else str(info)
+            break
+
+        time.sleep(args.poll_interval)
+    else:
+        result["state"] = "TIMEOUT"
+
+    result["total"] = time.time() - start
+    return result
+
+
+def format_stats(values: List[float]) -> str:
+    if not values:
+        return "нет данных"
+    parts = [f"p{p}={percentile(values, p):.2f}s" for p in (50, 90, 95, 99)]
+    return f"n={len(values)} " + " ".join(parts) + f" max={max(values):.2f}s"
+
+
+def print_report(results: List[Dict[str, Any]], wall_time: float, fake_stats: Optional[Dict[str, Any]]) -> None:
+    states = defaultdict(int)
+    for r in results:
+        states[r["state"]] += 1
+    succeeded = [r for r in results if r["state"] == "SUCCESS"]
+
+    print("\n=== Итоги ===")
+    print(f"Анализов: {len(results)} | " + ", ".join(f"{k}={v}" for k, v in sorted(states.items())))
+    print(f"Общее время: {wall_time:.1f}s | пропускная способность: {len(succeeded) / wall_time * 60:.2f} анализов/мин")
+    print(f"Отправка:  {format_stats([r['submit'] for r in results if 'submit' in r])}")
+    print(f"Полностью: {format_stats([r['total'] for r in succeeded])}")
+
+    stage_times = defaultdict(list)
+    stage_order = []
+    for r in succeeded:
+        for name, value in r["stages"].items():
+            if name not in stage_times:
+                stage_order.append(name)
+            stage_times[name].append(value)
+
+    print("\nЭтапы (по смене статуса задачи, точность — интервал опроса):")
+    for name in stage_order:
+        print(f"  {name:<30} {format_stats(stage_times[name])}")
+
+    errors = [r for r in results if r.get("error") and r["state"] != "SUCCESS"]
+    for r in errors[:5]:
+        print(f"Ошибка (analysis_id={r.get('analysis_id')}): {r['error']}")
+
+    if fake_stats:
+        print("\nЗаглушка LLM:")
+        print(json.dumps(fake_stats, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /api/analysis/create")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--tz", required=True, help="файл ТЗ")
+    parser.add_argument("--passport", required=True, help="файл паспорта")
+    parser.add_argument("--mode", default="flexible", choices=["flexible", "strict"])
+    parser.add_argument("-n", "--total", type=int, default=10, help="всего анализов")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="одновременно отправляемых анализов")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=1800, help="предел на один анализ, с")
+    parser.add_argument("--fake-llm-url", help="адрес tools/fake_llm_server.py для сбора его /stats")
+    parser.add_argument("--json", help="сохранить сырые результаты в файл")
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+
+    if args.fake_llm_url:
+        requests.post(f"{args.fake_llm_url.rstrip('/')}/stats/reset", timeout=10)
+
+    # Сессия на поток: requests.Session не потокобезопасна
+    local = threading.local()
+
+    def worker(index: int) -> Dict[str, Any]:
+        if not hasattr(local, "session"):
+            local.session = login(args.base_url, args.username, args.password)
+        result = run_analysis(local.session, args)
+        print(f"[{index + 1}/{args.total}] {result['state']} за {result.get('total', 0):.1f}s")
+        return result
+
+    start = time.time()
+    results = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(worker, i) for i in range(args.total)]
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({"state": "CLIENT_ERROR", "error": str(e), "stages": {}})
+    wall_time = time.time() - start
+
+    fake_stats = None
+    if args.fake_llm_url:
+        try:
+            fake_stats = requests.get(f"{args.fake_llm_url.rstrip('/')}/stats", timeout=10).json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Не удалось получить статистику заглушки: {e}")
+
+    print_report(results, wall_time, fake_stats)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"wall_time": wall_time, "results": results, "fake_llm": fake_stats}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,8 +25,10 @@ def deduplicate_tz_items(data: Dict[str, Any]) -> Dict[str, Any]:
             continue
 
         if name not in grouped_items:
-            # Первое вхождение - сохраняем как есть
+            # Первое вхождение - сохраняем как есть (словарь характеристик копируем, его дополняют дубли)
             grouped_items[name] = item.copy()
+            if isinstance(item.get('Характеристики'), dict):
+                grouped_items[name]['Характеристики'] = _merge_characteristics({}, item['Характеристики'])
         else:
             # Дубликат - объединяем характеристики
             existing = grouped_items[name]
@@ -40,8 +42,16 @@ def deduplicate_tz_items(data: Dict[str, Any]) -> Dict[str, Any]:
                 combined = f"{existing_chars} {new_chars}".strip()
                 existing['Технические характеристики'] = combined
 
-            # Количество берем из первого вхождения (уже есть в existing)
-            # Единицу измерения тоже берем из первого
+            # Характеристики по схеме промпта — словарь: добавляем недостающие ключи
+            if isinstance(item.get('Характеристики'), dict):
+                existing['Характеристики'] = _merge_characteristics(
+                    existing.get('Характеристики'), item['Характеристики']
+                )
+
+            # Единица и количество — из первого вхождения, где они указаны
+            for field in ('Ед. изм.', 'Кол-во'):
+                if not existing.get(field) and item.get(field):
+                    existing[field] = item[field]
 
     # Преобразуем обратно в список
     result = {
@@ -50,4 +60,19 @@ def deduplicate_tz_items(data: Dict[str, Any]) -> Dict[str, Any]:
 
     print(f"[DEBUG] Дедупликация ТЗ: было {len(items)} позиций, стало {len(result['items'])}")
 
-    return result
\ No newline at end of file
+    return result
+
+
+def _merge_characteristics(existing: Any, new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Объединяет словари характеристик одной позиции (в том числе вложенные группы).
+    При совпадении ключа остаётся первое непустое значение.
+    """
+    merged = dict(existing) if isinstance(existing, dict) else {}
+    for key, value in new.items():
+        current = merged.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            merged[key] = _merge_characteristics(current, value)
+        elif current in (None, '', {}):
+            merged[key] = _merge_characteristics({}, value) if isinstance(value, dict) else value
+    return merged
@@ -0,0 +1,108 @@
+"""
+Инкрементальный разбор JSON-объекта из потокового ответа LLM.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class IncrementalJsonParser:
+    """
+    Принимает ответ модели кусками и отдаёт пары ключ/значение верхнего уровня,
+    как только каждая из них полностью пришла.
+
+    Всё до первой '{' (текст, ```json) пропускается. Как только корневой объект
+    закрылся, complete = True — остаток ответа можно не дочитывать.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.complete = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start: Optional[int] = None
+        self._pair_start: Optional[int] = None
+        self._array_root = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        if self.complete or not chunk:
+            return []
+
+        self.buffer += chunk
+        pairs = []
+
+        if self._array_root:
+            # Корень — массив: по парам не разбираем, ответ дочитывается целиком
+            return pairs
+
+        while self._pos < len(self.buffer):
+            char = self.buffer[self._pos]
+
+            if self._object_start is None:
+                if char == "[":
+                    self._array_root = True
+                    return pairs
+                if char == "{":
+                    self._object_start = self._pos
+                    self._pair_start = self._pos + 1
+                    self._depth = 1
+                self._pos += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    pair = self._parse_pair(self._pos)
+                    if pair is not None:
+                        pairs.append(pair)
+                    self.complete = True
+                    self._pos += 1
+                    break
+            elif char == "," and self._depth == 1:
+                pair = self._parse_pair(self._pos)
+                if pair is not None:
+                    pairs.append(pair)
+                self._pair_start = self._pos + 1
+
+            self._pos += 1
+
+        return pairs
+
+    def _parse_pair(self, end: int) -> Optional[Tuple[str, Any]]:
+        segment = self.buffer[self._pair_start:end].strip()
+        if not segment:
+            return None
+        try:
+            parsed = json.loads("{" + segment + "}")
+        except json.JSONDecodeError:
+            return None
+        if not parsed:
+            return None
+        return next(iter(parsed.items()))
+
+    @property
+    def text(self) -> str:
+        """Текст корневого объекта (после завершения) или всё, что пришло."""
+        if self.complete and self._object_start is not None:
+            return self.buffer[self._object_start:self._pos]
+        return self.buffer
+
+    def result(self) -> Dict[str, Any]:
+        if not self.complete:
+            return {}
+        try:
+            return json.loads(self.text)
+        except json.JSONDecodeError:
+            return {}
@@ -0,0 +1,142 @@
+"""
+Отсев пустых и повторяющихся страниц перед vision-запросами.
+
+Пустая страница — доля «чернил» (пикселей заметно темнее фона бумаги) ниже
+PAGE_BLANK_INK_THRESHOLD. Повтор — страница, чей dHash 16x16 отличается от уже
+встреченной не больше чем на PAGE_DUPLICATE_MAX_DISTANCE бит и у которой доля
+заметно отличающихся пикселей не больше PAGE_DUPLICATE_MAX_DIFF: одного хэша мало,
+у страниц таблиц с одинаковой вёрсткой он почти совпадает.
+Текстовые страницы не трогаются.
+"""
+import io
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image, ImageChops
+
+from config import settings
+from handlers.render_presets import is_image_data
+
+
+# Страница сравнивается в уменьшенной копии такой ширины — тонкие штрихи текста ещё различимы
+DETAIL_WIDTH = 512
+HASH_SIZE = 16
+# Пиксель считается «чернилами», если он темнее фона бумаги на INK_CONTRAST
+INK_CONTRAST = 50
+# Пиксели двух страниц различаются, если разница яркостей больше DIFF_LEVEL
+DIFF_LEVEL = 64
+
+
+class PageFingerprint:
+
+    def __init__(self, img_data):
+        with Image.open(io.BytesIO(img_data)) as img:
+            # draft ускоряет декодирование JPEG сразу в уменьшенном размере
+            img.draft("L", (DETAIL_WIDTH, DETAIL_WIDTH * 2))
+            gray = img.convert("L")
+
+        height = max(1, round(gray.height * DETAIL_WIDTH / max(gray.width, 1)))
+        self.detail = gray.resize((DETAIL_WIDTH, height), Image.Resampling.BOX)
+        self.ink_coverage = self._ink_coverage(self.detail)
+        self.dhash = self._dhash(self.detail)
+
+    @staticmethod
+    def _ink_coverage(gray: Image.Image) -> float:
+        histogram = gray.histogram()
+        total = max(sum(histogram), 1)
+
+        # Фон — самый светлый уровень, ниже которого лежат 90% пикселей (сканы бывают серыми)
+        count = 0
+        background = 255
+        for level, pixels in enumerate(histogram):
+            count += pixels
+            if count >= total * 0.9:
+                background = level
+                break
+
+        return sum(histogram[:max(0, background - INK_CONTRAST)]) / total
+
+    @staticmethod
+    def _dhash(gray: Image.Image) -> int:
+        small = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+        pixels = list(small.getdata())
+        value = 0
+        for row in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1)
+            for col in range(HASH_SIZE):
+                value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+        return value
+
+    def is_duplicate_of(self, other: "PageFingerprint") -> bool:
+        if bin(self.dhash ^ other.dhash).count("1") > settings.PAGE_DUPLICATE_MAX_DISTANCE:
+            return False
+        if self.detail.size != other.detail.size:
+            return False
+
+        histogram = ImageChops.difference(self.detail, other.detail).histogram()
+        differing = sum(histogram[DIFF_LEVEL + 1:]) / max(sum(histogram), 1)
+        return differing <= settings.PAGE_DUPLICATE_MAX_DIFF
+
+
+def filter_pages(
+    pages: Iterable[Any],
+    fingerprints: Optional[Dict[int, PageFingerprint]] = None
+) -> Tuple[List[Any], List[Dict[str, Any]]]:
+    """
+    Возвращает (оставшиеся страницы в исходном порядке, пропущенные страницы):
+    [{"page": 3, "reason": "blank", "ink": 0.001}, {"page": 7, "reason": "duplicate", "duplicate_of": 2}].
+    Номера страниц — позиции в документе, начиная с 1. Если передан fingerprints,
+    в него складываются отпечатки оставшихся сканов по номерам страниц (для ранжирования).
+    """
+    skipped: List[Dict[str, Any]] = []
+    kept = list(iter_filtered_pages(pages, skipped, fingerprints))
+    return kept, skipped
+
+
+def iter_filtered_pages(
+    pages: Iterable[Any],
+    skipped: List[Dict[str, Any]],
+    fingerprints: Optional[Dict[int, PageFingerprint]] = None
+) -> Iterator[Any]:
+    """
+    То же, что filter_pages, для потока страниц (FileHandler.iter_data_from_file):
+    оставшиеся страницы отдаются по мере чтения, пропущенные сразу отбрасываются
+    и дописываются в skipped.
+    """
+    if not settings.PAGE_FILTER_ENABLED:
+        yield from pages
+        return
+
+    seen: List[Tuple[int, PageFingerprint]] = []
+    total = 0
+
+    for index, page in enumerate(pages):
+        page_num = index + 1
+        total = page_num
+        if not is_image_data(page):
+            yield page
+            continue
+
+        try:
+            fingerprint = PageFingerprint(page)
+        except Exception as e:
+            print(f"[DEBUG] Фильтр страниц: страница {page_num} не прочитана ({str(e)}), оставлена")
+            yield page
+            continue
+
+        if fingerprint.ink_coverage < settings.PAGE_BLANK_INK_THRESHOLD:
+            skipped.append({"page": page_num, "reason": "blank", "ink": round(fingerprint.ink_coverage, 5)})
+            continue
+
+        original = next((num for num, other in seen if fingerprint.is_duplicate_of(other)), None)
+        if original is not None:
+            skipped.append({"page": page_num, "reason": "duplicate", "duplicate_of": original})
+            continue
+
+        seen.append((page_num, fingerprint))
+        if fingerprints is not None:
+            fingerprints[page_num] = fingerprint
+        yield page
+
+    if skipped:
+        blank = sum(1 for s in skipped if s["reason"] == "blank")
+        print(f"[DEBUG] Фильтр страниц: пропущено {len(skipped)} из {total} (пустых={blank}, повторов={len(skipped) - blank})")
@@ -0,0 +1,151 @@
+"""
+Ранжирование страниц паспорта по вероятности наличия технических характеристик.
+
+Текстовые страницы оцениваются по ключевым словам и плотности «число + единица
+измерения», сканы — по плотности линий таблиц. В LLM уходят лучшие страницы,
+набирающие PAGE_RANK_COVERAGE суммарной оценки; остальные остаются в резерве
+на случай, если характеристик найдено слишком мало.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from config import settings
+from handlers.render_presets import is_image_data
+from utils.page_filter import PageFingerprint
+
+
+SPEC_KEYWORDS = (
+    "технические характеристики", "технические данные", "основные параметры", "характеристик",
+    "параметр", "мощность", "напряжение", "давление", "масса", "вес", "габарит", "размер",
+    "температур", "материал", "ток", "частота", "производительность", "подача", "напор",
+    "расход", "диаметр", "класс защиты", "степень защиты", "объем", "объём", "тип", "модель",
+)
+# Разделы, где характеристик обычно нет
+OFF_TOPIC_KEYWORDS = (
+    "безопасност", "гаранти", "предупрежден", "утилизац", "внимание", "запрещается",
+    "транспортиров", "хранени", "свидетельство о приемке", "рекламац",
+)
+UNIT_PATTERN = re.compile(
+    r"\d+(?:[.,]\d+)?\s*(?:мм|см|м|км|мкм|кг|г|т|в|кв|вт|квт|мвт|а|ма|гц|кгц|бар|мпа|кпа|па|атм|"
+    r"°\s*c|°с|°|л/мин|л/ч|м3/ч|м³/ч|об/мин|%|дб|ip\s?\d{2}|л|мл|ч|мин|с)\b",
+    re.IGNORECASE
+)
+
+# Ключевые слова не длиннее этого — целые слова с окончанием до двух букв («тока», «типа»),
+# иначе они находятся внутри других слов («поток», «прототип»)
+SHORT_KEYWORD_LENGTH = 3
+
+
+def _keyword_pattern(keywords: Tuple[str, ...]) -> "re.Pattern[str]":
+    """Ключевые слова с начала слова: основы («характеристик») — с любым окончанием."""
+    parts = [
+        re.escape(keyword) + (r"\w{0,2}\b" if len(keyword) <= SHORT_KEYWORD_LENGTH else "")
+        for keyword in sorted(keywords, key=len, reverse=True)
+    ]
+    return re.compile(r"(?<!\w)(?:" + "|".join(parts) + ")")
+
+
+SPEC_KEYWORD_PATTERN = _keyword_pattern(SPEC_KEYWORDS)
+OFF_TOPIC_KEYWORD_PATTERN = _keyword_pattern(OFF_TOPIC_KEYWORDS)
+
+# Доля тёмных пикселей в строке/столбце, при которой это линия таблицы, а не текст
+HORIZONTAL_LINE_FILL = 0.5
+VERTICAL_LINE_FILL = 0.25
+
+
+def score_text_page(text: str) -> float:
+    lowered = text.lower()
+    keywords = len(SPEC_KEYWORD_PATTERN.findall(lowered))
+    off_topic = len(OFF_TOPIC_KEYWORD_PATTERN.findall(lowered))
+    units = len(UNIT_PATTERN.findall(lowered))
+    return max(0.0, keywords + 2 * units - off_topic)
+
+
+def _count_lines(profile: List[int], threshold: float) -> int:
+    """Число непрерывных участков профиля, где доля тёмных пикселей выше порога."""
+    lines = 0
+    inside = False
+    for value in profile:
+        if value / 255 >= threshold:
+            if not inside:
+                lines += 1
+            inside = True
+        else:
+            inside = False
+    return lines
+
+
+def score_image_page(fingerprint: PageFingerprint) -> float:
+    detail = fingerprint.detail
+    # Тёмные пиксели -> 255, затем средние по строкам и столбцам
+    dark = detail.point(lambda value: 255 if value < 128 else 0)
+    rows = list(dark.resize((1, dark.height), Image.Resampling.BOX).getdata())
+    columns = list(dark.resize((dark.width, 1), Image.Resampling.BOX).getdata())
+
+    horizontal = _count_lines(rows, HORIZONTAL_LINE_FILL)
+    vertical = _count_lines(columns, VERTICAL_LINE_FILL)
+    # Таблица — это пересечение горизонтальных и вертикальных линий
+    return float(horizontal + vertical) if horizontal and vertical else float(horizontal) / 2
+
+
+def _page_text(page: Any) -> Optional[str]:
+    if isinstance(page, dict):
+        return "\n".join([page.get("text", "")] + page.get("tables", []))
+    if isinstance(page, str):
+        return page
+    return None
+
+
+def rank_pages(
+    pages: List[Any],
+    page_numbers: List[int],
+    fingerprints: Optional[Dict[int, PageFingerprint]] = None
+) -> Tuple[List[int], List[int], Dict[int, float]]:
+    """
+    Делит страницы на отправляемые сразу и резервные. Возвращает (индексы выбранных,
+    индексы резервных — оба списка в порядке документа, оценки по номерам страниц).
+    Оценки текстовых страниц и сканов нормируются отдельно — шкалы у них разные.
+    """
+    fingerprints = fingerprints or {}
+    text_scores: Dict[int, float] = {}
+    image_scores: Dict[int, float] = {}
+    # Страницы непонятного типа не ранжируются и отправляются всегда
+    always: List[int] = []
+
+    for index, page in enumerate(pages):
+        text = _page_text(page)
+        if text is not None:
+            text_scores[index] = score_text_page(text)
+        elif is_image_data(page):
+            fingerprint = fingerprints.get(page_numbers[index])
+            try:
+                image_scores[index] = score_image_page(fingerprint or PageFingerprint(page))
+            except Exception as e:
+                print(f"[DEBUG] Ранжирование: страница {page_numbers[index]} не прочитана ({str(e)})")
+                image_scores[index] = 0.0
+        else:
+            always.append(index)
+
+    scores: Dict[int, float] = {}
+    for group in (text_scores, image_scores):
+        top = max(group.values(), default=0.0) or 1.0
+        for index, value in group.items():
+            scores[index] = value / top
+
+    total = sum(scores.values())
+    ordered = sorted(scores, key=lambda index: (-scores[index], index))
+
+    selected = list(always)
+    covered = 0.0
+    for index in ordered:
+        if len(selected) >= settings.PAGE_RANK_MIN_PAGES and total and covered / total >= settings.PAGE_RANK_COVERAGE:
+            break
+        selected.append(index)
+        covered += scores[index]
+
+    selected_set = set(selected)
+    rest = [index for index in range(len(pages)) if index not in selected_set]
+
+    return sorted(selected), rest, {page_numbers[index]: round(value, 3) for index, value in scores.items()}
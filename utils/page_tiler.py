@@ -0,0 +1,286 @@
+"""
+Нарезка растеризованных страниц на фрагменты для vision-модели.
+
+Крупная страница (A3, широкая таблица характеристик), ужатая целиком до
+лимита модели, теряет мелкие цифры, а поля и пустые области всё равно
+оплачиваются токенами. Здесь на уменьшенной копии страницы ищутся блоки
+текста и таблиц (рекурсивный XY-cut по пустым полосам), соседние блоки
+собираются во фрагменты не больше PAGE_TILE_MAX_SIZE пикселей, и в модель
+уходят только фрагменты с содержимым в исходном разрешении рендера.
+Высокие блоки режутся по самой светлой строке (между строками таблицы),
+по ширине блоки не режутся — строка таблицы остаётся целиком в одном фрагменте.
+Фрагмент шире PAGE_TILE_MAX_SIZE (широкий блок) и страница, отправляемая
+целиком, крупнее PDF_RENDER_MAX_SIZE (при нарезке рендер идёт в большем
+разрешении) уменьшаются до лимита перед отправкой.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import List, Tuple, Union
+
+from PIL import Image, ImageFilter
+
+from config import settings
+from handlers.render_presets import get_image_mime_type
+from llm.page_batcher import estimate_image_tokens, estimate_image_tokens_for_size
+
+Box = Tuple[int, int, int, int]
+
+# Анализ вёрстки ведётся на копии такой ширины (около 72 DPI для A4)
+LAYOUT_WIDTH = 600
+# Пиксель считается «чернилами», если он темнее фона бумаги на INK_CONTRAST
+INK_CONTRAST = 50
+# Пустая полоса такой высоты/ширины (в пикселях копии) разделяет блоки
+ROW_GAP = 6
+COLUMN_GAP = 12
+# Поля вокруг блока во фрагменте, пиксели копии
+BLOCK_MARGIN = 4
+# Если строка разреза задевает текст, фрагменты перекрываются на столько пикселей копии
+CUT_OVERLAP = 12
+# Фрагменты не нужны, если обрезка полей экономит меньше этой доли площади
+MIN_CROP_SAVING = 0.1
+MAX_DEPTH = 12
+
+# Добавляется к промпту, если хотя бы одна страница ушла фрагментами
+TILES_PROMPT_NOTE = (
+    "Некоторые изображения — фрагменты одной страницы (блоки текста и таблиц) в порядке "
+    "сверху вниз; соседние фрагменты могут немного перекрываться. Не дублируй характеристики "
+    "из перекрывающихся частей."
+)
+
+_plan_cache: "OrderedDict[bytes, Tuple[Tuple[int, int], List[Box]]]" = OrderedDict()
+_plan_cache_lock = threading.Lock()
+PLAN_CACHE_SIZE = 256
+
+
+class _InkMask:
+    """Маска чернил уменьшенной копии: профили по строкам и столбцам считаются срезами bytes."""
+
+    def __init__(self, mask: Image.Image):
+        self.width, self.height = mask.size
+        self._rows = mask.tobytes()
+        self._columns = mask.transpose(Image.Transpose.TRANSPOSE).tobytes()
+
+    def row_profile(self, box: Box) -> List[int]:
+        x0, y0, x1, y1 = box
+        w = self.width
+        return [self._rows[y * w + x0:y * w + x1].count(255) for y in range(y0, y1)]
+
+    def column_profile(self, box: Box) -> List[int]:
+        x0, y0, x1, y1 = box
+        h = self.height
+        return [self._columns[x * h + y0:x * h + y1].count(255) for x in range(x0, x1)]
+
+
+def _ink_mask(img: Image.Image) -> _InkMask:
+    gray = img.convert("L")
+    height = max(1, round(gray.height * LAYOUT_WIDTH / max(gray.width, 1)))
+    gray = gray.resize((LAYOUT_WIDTH, height), Image.Resampling.BOX)
+
+    histogram = gray.histogram()
+    total = max(sum(histogram), 1)
+    # Фон — уровень, ниже которого лежат 90% пикселей (сканы бывают серыми)
+    count = 0
+    background = 255
+    for level, pixels in enumerate(histogram):
+        count += pixels
+        if count >= total * 0.9:
+            background = level
+            break
+
+    threshold = background - INK_CONTRAST
+    mask = gray.point(lambda value: 255 if value < threshold else 0)
+    # Склеиваем буквы в слова, чтобы межбуквенные просветы не считались разделителями
+    return _InkMask(mask.filter(ImageFilter.MaxFilter(3)))
+
+
+def _runs(profile: List[int], min_gap: int) -> List[Tuple[int, int]]:
+    """Участки с чернилами (начало, конец), слитые через просветы короче min_gap."""
+    runs: List[Tuple[int, int]] = []
+    start = None
+    for pos, value in enumerate(profile):
+        if value:
+            if start is None:
+                start = runs.pop()[0] if runs and pos - runs[-1][1] < min_gap else pos
+        elif start is not None:
+            runs.append((start, pos))
+            start = None
+    if start is not None:
+        runs.append((start, len(profile)))
+    return runs
+
+
+def _xy_cut(mask: _InkMask, box: Box, depth: int = 0) -> List[Box]:
+    """Блоки содержимого в порядке чтения: сверху вниз, внутри полосы — слева направо."""
+    x0, y0, x1, y1 = box
+    rows = _runs(mask.row_profile(box), ROW_GAP)
+    if not rows:
+        return []
+    if len(rows) > 1 and depth < MAX_DEPTH:
+        blocks = []
+        for start, end in rows:
+            blocks.extend(_xy_cut(mask, (x0, y0 + start, x1, y0 + end), depth + 1))
+        return blocks
+
+    y0, y1 = y0 + rows[0][0], y0 + rows[0][1]
+    columns = _runs(mask.column_profile((x0, y0, x1, y1)), COLUMN_GAP)
+    if len(columns) > 1 and depth < MAX_DEPTH:
+        blocks = []
+        for start, end in columns:
+            blocks.extend(_xy_cut(mask, (x0 + start, y0, x0 + end, y1), depth + 1))
+        return blocks
+    if not columns:
+        return []
+    return [(x0 + columns[0][0], y0, x0 + columns[0][1], y1)]
+
+
+def _slice_tall(mask: _InkMask, box: Box, max_height: int) -> List[Box]:
+    """Режет высокий блок по самой светлой строке в нижней четверти каждого окна."""
+    x0, y0, x1, y1 = box
+    profile = mask.row_profile(box)
+    slices = []
+    top = y0
+    while y1 - top > max_height:
+        window_end = top + max_height
+        window_start = top + max_height * 3 // 4
+        cut = min(range(window_start, window_end), key=lambda y: (profile[y - y0], -y))
+        slices.append((x0, top, x1, cut))
+        # Разрез прошёл по тексту — следующий фрагмент начинается чуть выше
+        top = cut - CUT_OVERLAP if profile[cut - y0] else cut
+    slices.append((x0, top, x1, y1))
+    return slices
+
+
+def _group_blocks(mask: _InkMask, blocks: List[Box], max_size: int) -> List[Box]:
+    tiles = []
+    current = None
+    for block in blocks:
+        x0, y0, x1, y1 = block
+        if y1 - y0 > max_size:
+            if current:
+                tiles.append(current)
+                current = None
+            tiles.extend(_slice_tall(mask, block, max_size))
+            continue
+
+        if current is None:
+            current = block
+            continue
+
+        union = (min(current[0], x0), min(current[1], y0), max(current[2], x1), max(current[3], y1))
+        # Блок шире лимита остаётся отдельным фрагментом (его уменьшит split_page)
+        if union[3] - union[1] > max_size or union[2] - union[0] > max_size:
+            tiles.append(current)
+            current = block
+        else:
+            current = union
+
+    if current:
+        tiles.append(current)
+    return tiles
+
+
+def plan_tiles(img: Image.Image) -> List[Box]:
+    """Фрагменты страницы в координатах исходного изображения (пустой список — не резать)."""
+    mask = _ink_mask(img)
+    scale = img.width / mask.width
+    max_size = max(1, int(settings.PAGE_TILE_MAX_SIZE / scale))
+
+    blocks = _xy_cut(mask, (0, 0, mask.width, mask.height))
+    if not blocks:
+        return []
+
+    tiles = []
+    for x0, y0, x1, y1 in _group_blocks(mask, blocks, max_size):
+        tiles.append((
+            max(0, int((x0 - BLOCK_MARGIN) * scale)),
+            max(0, int((y0 - BLOCK_MARGIN) * scale)),
+            min(img.width, int((x1 + BLOCK_MARGIN) * scale)),
+            min(img.height, int((y1 + BLOCK_MARGIN) * scale)),
+        ))
+
+    if len(tiles) == 1:
+        x0, y0, x1, y1 = tiles[0]
+        if (x1 - x0) * (y1 - y0) > img.width * img.height * (1 - MIN_CROP_SAVING):
+            return []
+    return tiles
+
+
+def _cached_plan(img_data: Union[bytes, memoryview]) -> Tuple[Tuple[int, int], List[Box]]:
+    """План фрагментов с кэшем: батчер и сборка запроса разбирают одни и те же страницы."""
+    key = hashlib.sha1(img_data).digest()
+    with _plan_cache_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return _plan_cache[key]
+
+    with Image.open(io.BytesIO(img_data)) as img:
+        img.load()
+        plan = (img.size, plan_tiles(img))
+
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+def _fitted_size(width: int, height: int, limit: int) -> Tuple[int, int]:
+    """Размер, вписанный в limit по длинной стороне (меньшие изображения не увеличиваются)."""
+    scale = min(1.0, limit / max(width, height, 1))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode(img: Image.Image, size: Tuple[int, int], image_format: str) -> bytes:
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    params = {} if image_format == "PNG" else {"quality": 90}
+    img.save(buffer, format=image_format, **params)
+    return buffer.getvalue()
+
+
+def split_page(img_data: Union[bytes, memoryview]) -> List[Union[bytes, memoryview]]:
+    """
+    Страница -> фрагменты с содержимым, каждый не крупнее PAGE_TILE_MAX_SIZE. Страница
+    без фрагментов уходит целиком, уменьшенная до PDF_RENDER_MAX_SIZE, если она крупнее.
+    """
+    if not settings.PAGE_TILING_ENABLED:
+        return [img_data]
+    try:
+        size, tiles = _cached_plan(img_data)
+    except Exception as e:
+        print(f"[DEBUG] Нарезка страницы не удалась, отправляется целиком: {str(e)}")
+        return [img_data]
+
+    whole_size = _fitted_size(*size, settings.PDF_RENDER_MAX_SIZE)
+    if not tiles and whole_size == tuple(size):
+        return [img_data]
+
+    mime_type = get_image_mime_type(img_data)
+    image_format = {"image/png": "PNG", "image/webp": "WEBP"}.get(mime_type, "JPEG")
+
+    with Image.open(io.BytesIO(img_data)) as img:
+        if not tiles:
+            return [_encode(img, whole_size, image_format)]
+        return [
+            _encode(img.crop(box), _fitted_size(box[2] - box[0], box[3] - box[1], settings.PAGE_TILE_MAX_SIZE), image_format)
+            for box in tiles
+        ]
+
+
+def estimate_page_tokens(img_data: Union[bytes, memoryview]) -> int:
+    """Стоимость страницы в vision-токенах с учётом нарезки и уменьшения (как в split_page)."""
+    if not settings.PAGE_TILING_ENABLED:
+        return estimate_image_tokens(img_data)
+    try:
+        size, tiles = _cached_plan(img_data)
+    except Exception:
+        return estimate_image_tokens(img_data)
+    if not tiles:
+        return estimate_image_tokens_for_size(*_fitted_size(*size, settings.PDF_RENDER_MAX_SIZE))
+    return sum(
+        estimate_image_tokens_for_size(*_fitted_size(x1 - x0, y1 - y0, settings.PAGE_TILE_MAX_SIZE))
+        for x0, y0, x1, y1 in tiles
+    )
@@ -0,0 +1,144 @@
+"""
+Компактное представление извлечённых из документа данных для текстового промпта.
+
+Раньше в промпт уходил repr вложенных списков и словарей: кавычки, скобки и
+повторяющиеся пустые строки тоже стоят токенов. Здесь таблицы DOCX/XLS и
+текстовые страницы PDF превращаются в Markdown-таблицы (или TSV,
+PROMPT_TABLE_FORMAT=tsv), повторы шапки таблицы (на каждой странице, у таблиц,
+разбитых разрывом страницы) и строки с номерами колонок «1 | 2 | 3» убираются.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from llm.page_batcher import estimate_text_tokens
+
+
+def _cell(text: Any, line_separator: str = "; ") -> str:
+    """
+    Ячейка в одну строку: пробелы схлопываются внутри каждой строки, а строки ячейки
+    (абзацы DOCX, переносы в ячейке XLS — по ним делятся характеристики) соединяются
+    line_separator, чтобы модель видела границы между ними.
+    """
+    lines = (" ".join(line.split()) for line in str(text if text is not None else "").splitlines())
+    return line_separator.join(line for line in lines if line)
+
+
+def is_column_numbers_row(row: List[str]) -> bool:
+    """Строка «1, 2, 3, ...» под шапкой таблицы ТЗ — нумерация колонок, а не данные."""
+    filled = [cell for cell in row if cell]
+    return len(filled) >= 2 and filled == [str(n) for n in range(1, len(filled) + 1)]
+
+
+def _format_row(row: List[str], table_format: str) -> str:
+    if table_format == "tsv":
+        return "\t".join(row)
+    # Без пробелов вокруг «|»: модели читают такую таблицу так же, а символов меньше
+    return "|" + "|".join(cell.replace("|", "\\|") for cell in row) + "|"
+
+
+def format_table(rows: List[List[Any]], header: Optional[List[Any]] = None, table_format: Optional[str] = None) -> str:
+    """
+    Таблица в Markdown (шапка + разделитель) или TSV. Без явной шапки первой строкой
+    считается первая строка таблицы. Пустые строки, повторы шапки и нумерация колонок
+    пропускаются, хвостовые пустые ячейки обрезаются. Строка, где во всех заполненных
+    ячейках один и тот же текст (объединённая ячейка раздела), сворачивается в одну ячейку.
+    Строки внутри ячейки разделяются «<br>» в Markdown и «; » в TSV.
+    """
+    table_format = (table_format or settings.PROMPT_TABLE_FORMAT or "markdown").lower()
+    line_separator = "; " if table_format == "tsv" else "<br>"
+    cleaned = []
+    for row in rows:
+        cells = [_cell(cell, line_separator) for cell in row]
+        while cells and not cells[-1]:
+            cells.pop()
+        filled = {cell for cell in cells if cell}
+        if len(filled) == 1 and sum(1 for cell in cells if cell) > 1:
+            cells = [filled.pop()]
+        if cells:
+            cleaned.append(cells)
+
+    if header is None and cleaned:
+        header, cleaned = cleaned[0], cleaned[1:]
+    header = [_cell(cell, line_separator) for cell in header or []]
+
+    while header and not header[-1]:
+        header.pop()
+
+    width = max([len(header)] + [len(row) for row in cleaned])
+    lines = []
+    if header:
+        lines.append(_format_row(header + [""] * (width - len(header)), table_format))
+        if table_format != "tsv":
+            lines.append("|" + "-|" * width)
+
+    for row in cleaned:
+        if row == header or is_column_numbers_row(row):
+            continue
+        lines.append(_format_row(row, table_format))
+
+    return "\n".join(lines)
+
+
+def _serialize_tables(tables: List[List[List[Any]]]) -> str:
+    """Таблицы DOCX: подряд идущие таблицы с одинаковой шапкой (разрыв страницы) склеиваются."""
+    groups: List[List[List[Any]]] = []
+    previous_header = None
+    for table in tables:
+        rows = [row for row in table if any(_cell(cell) for cell in row)]
+        if not rows:
+            continue
+        header = [_cell(cell) for cell in rows[0]]
+        if header == previous_header:
+            # Продолжение предыдущей таблицы: шапку не повторяем
+            groups[-1].extend(rows[1:])
+        else:
+            groups.append(rows)
+            previous_header = header
+    return "\n\n".join(format_table(rows) for rows in groups)
+
+
+def _serialize_sheet(sheet: Dict[str, Any]) -> str:
+    parts = [f"## Лист: {sheet.get('sheet_name', '')}"]
+    parts.extend(line for line in sheet.get("title", []) if line)
+    table = format_table(sheet.get("rows", []), sheet.get("header"))
+    if table:
+        parts.append(table)
+    return "\n".join(parts)
+
+
+def _serialize_page(page: Dict[str, Any]) -> str:
+    parts = [f"## Стр. {page.get('page')}"]
+    if page.get("text"):
+        parts.append(page["text"])
+    # Таблицы страницы уже в компактном виде (см. PdfHandler._extract_text_page)
+    parts.extend(page.get("tables", []))
+    return "\n".join(parts)
+
+
+def serialize_for_prompt(data: Any) -> str:
+    """Данные документа в виде текста для промпта (таблицы DOCX/XLS, страницы PDF, строки)."""
+    if isinstance(data, str):
+        return data
+    if isinstance(data, list) and data:
+        if all(isinstance(item, dict) and "sheet_name" in item for item in data):
+            return "\n\n".join(_serialize_sheet(sheet) for sheet in data)
+        if all(isinstance(item, dict) and "page" in item for item in data):
+            return "\n\n".join(_serialize_page(page) for page in data)
+        if all(isinstance(item, list) and all(isinstance(row, (list, tuple)) for row in item) for item in data):
+            return _serialize_tables(data)
+        if all(isinstance(item, (list, tuple)) for item in data):
+            return format_table(data)
+    # Неизвестная структура — JSON без отступов всё равно короче repr
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def build_text_prompt(prompt: str, data: Any) -> str:
+    """Промпт с данными документа; печатает оценку токенов до отправки."""
+    serialized = serialize_for_prompt(data)
+    tokens = estimate_text_tokens(serialized)
+    print(
+        f"[DEBUG] Данные для промпта | format={settings.PROMPT_TABLE_FORMAT} | chars={len(serialized)} | "
+        f"tokens≈{tokens} (repr≈{estimate_text_tokens(str(data))}) | prompt_tokens≈{estimate_text_tokens(prompt) + tokens}"
+    )
+    return f"{prompt}\n\nДанные:\n{serialized}"
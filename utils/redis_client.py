@@ -0,0 +1,30 @@
+import os
+import threading
+from typing import Optional
+
+import redis
+
+from config import settings
+
+
+_lock = threading.Lock()
+_client: Optional[redis.Redis] = None
+_pid: Optional[int] = None
+
+
+def get_redis_client() -> redis.Redis:
+    """Общий для процесса клиент Redis (тот же инстанс, что у Celery), пересоздаётся после fork."""
+    global _client, _pid
+
+    with _lock:
+        if _client is None or _pid != os.getpid():
+            _client = redis.Redis(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                password=settings.REDIS_PASSWORD or None,
+                socket_timeout=5,
+                socket_connect_timeout=5,
+            )
+            _pid = os.getpid()
+        return _client
@@ -0,0 +1,152 @@
+"""
+Разбиение таблиц ТЗ на части по позициям для параллельного извлечения.
+
+Большое ТЗ с сотнями позиций в одном запросе медленно, может не поместиться
+в контекст, а один испорченный ответ теряет весь результат. Здесь строки
+таблиц группируются в позиции (строка с номером «1», «2.», ... открывает
+позицию, строки без номера и продолжения объединённых ячеек относятся к ней),
+позиции набираются в части до TZ_CHUNK_TOKENS токенов. Позиция никогда не
+разрезается, шапка таблицы повторяется в каждой части. Таблица без нумерации
+позиций считается одной позицией.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from llm.page_batcher import estimate_text_tokens
+from utils.prompt_serializer import is_column_numbers_row
+
+# Номер позиции верхнего уровня: «1», «12.», «№ 3»
+ITEM_NUMBER = re.compile(r"^(?:№\s*)?\d+\.?$")
+
+
+def _row_tokens(row: List[Any]) -> int:
+    return estimate_text_tokens("|".join(str(cell or "") for cell in row)) + 1
+
+
+def _split_positions(rows: List[List[Any]]) -> List[List[List[Any]]]:
+    """Строки таблицы (без шапки) -> позиции. Без нумерации вся таблица — одна позиция."""
+    keys = [str(row[0]).strip() if row else "" for row in rows]
+    if not any(ITEM_NUMBER.match(key) for key in keys):
+        return [rows] if rows else []
+
+    positions: List[List[List[Any]]] = []
+    current_key = None
+    for row, key in zip(rows, keys):
+        # Строка с новым номером открывает позицию; повтор номера — продолжение объединённой ячейки
+        if not positions or (ITEM_NUMBER.match(key) and key != current_key):
+            positions.append([])
+            current_key = key
+        positions[-1].append(row)
+    return positions
+
+
+def _header_rows(rows: List[List[Any]]) -> int:
+    """
+    Сколько первых строк таблицы DOCX — шапка (шапка и строка нумерации колонок).
+    Таблица, которая начинается с позиции («5 | Насос | ...»), — продолжение предыдущей
+    таблицы после разрыва страницы, своей шапки у неё нет.
+    """
+    if rows and rows[0] and ITEM_NUMBER.match(str(rows[0][0]).strip()):
+        return 0
+    count = 1 if rows else 0
+    if len(rows) > 1 and is_column_numbers_row([str(cell or "") for cell in rows[1]]):
+        count += 1
+    return count
+
+
+def split_tz_data(data: Any, max_tokens: int) -> List[Any]:
+    """
+    Части данных ТЗ той же структуры, что и исходные (список таблиц DOCX или список
+    листов XLS), не больше max_tokens каждая (кроме позиций, которые крупнее сами по себе).
+    Прочие структуры и маленькие документы возвращаются одной частью.
+    """
+    if max_tokens <= 0 or not isinstance(data, list) or not data:
+        return [data]
+
+    # Таблица (лист) без строк данных — одна пустая позиция, чтобы её шапка не потерялась
+    if all(isinstance(sheet, dict) and "sheet_name" in sheet for sheet in data):
+        sections = [
+            (sheet, sheet.get("header"), _split_positions(sheet.get("rows", [])) or [[]])
+            for sheet in data
+        ]
+    elif all(isinstance(table, list) for table in data):
+        sections = []
+        previous_header: List[List[Any]] = []
+        for table in data:
+            if not table:
+                # Таблица без строк (python-docx отбрасывает пустые строки) — в частях не нужна
+                continue
+            header_count = _header_rows(table)
+            header = table[:header_count]
+            if not header and previous_header and len(previous_header[0]) == len(table[0]):
+                # Продолжение таблицы: в каждой её части — шапка предыдущей таблицы
+                header = previous_header
+            previous_header = header
+            sections.append((None, header, _split_positions(table[header_count:]) or [[]]))
+    else:
+        return [data]
+
+    chunks: List[List[Any]] = []
+    current: List[Any] = []
+    current_tokens = 0
+
+    for sheet, header, positions in sections:
+        header_tokens = sum(_row_tokens(row) for row in header) if sheet is None else _row_tokens(header or [])
+        part = None
+
+        for position in positions:
+            tokens = sum(_row_tokens(row) for row in position)
+            if current and current_tokens + tokens + (header_tokens if part is None else 0) > max_tokens:
+                chunks.append(current)
+                current, current_tokens, part = [], 0, None
+
+            if part is None:
+                # Таблица (лист) начинается в текущей части — со своей шапкой
+                if sheet is None:
+                    part = [list(row) for row in header]
+                else:
+                    part = {**sheet, "rows": []}
+                current.append(part)
+                current_tokens += header_tokens
+
+            if sheet is None:
+                part.extend(position)
+            else:
+                part["rows"].extend(position)
+            current_tokens += tokens
+
+    if current:
+        chunks.append(current)
+
+    return chunks or [data]
+
+
+def describe_chunks(chunks: List[Any], failed_chunks: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Сводка для метаданных анализа: число частей и строк таблиц в каждой. Несработавшие
+    части (см. LLMService.extract_chunks_via_llm) попадают в "failed" с диапазоном
+    своих позиций — по нему видно, какие позиции ТЗ в результате отсутствуют.
+    """
+    sizes = []
+    for chunk in chunks:
+        rows = 0
+        for part in chunk if isinstance(chunk, list) else []:
+            rows += len(part.get("rows", [])) if isinstance(part, dict) else len(part)
+        sizes.append(rows)
+
+    failed = []
+    for failure in failed_chunks or []:
+        failed.append({**failure, "positions": _position_ranges(chunks[failure["chunk"] - 1])})
+
+    return {"chunks": len(chunks), "rows_per_chunk": sizes, "complete": not failed, "failed": failed}
+
+
+def _position_ranges(chunk: Any) -> List[str]:
+    """Диапазоны номеров позиций части по таблицам: ["388–400", "1–182"]."""
+    ranges = []
+    for part in chunk if isinstance(chunk, list) else []:
+        rows = part.get("rows", []) if isinstance(part, dict) else part
+        keys = [str(row[0]).strip() for row in rows if row and ITEM_NUMBER.match(str(row[0]).strip())]
+        if keys:
+            ranges.append(keys[0] if keys[0] == keys[-1] else f"{keys[0]}–{keys[-1]}")
+    return ranges
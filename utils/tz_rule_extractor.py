@@ -0,0 +1,258 @@
+"""
+Извлечение позиций ТЗ из таблиц стандартного вида без LLM.
+
+Большинство ТЗ — таблица с колонками «Наименование», «Ед. изм.», «Кол-во» и
+характеристиками в одном из двух видов:
+- колонка «Технические характеристики», где в ячейке пары «Параметр: значение»
+  по абзацам или через «;»;
+- колонки «Наименование показателя» / «Значение показателя» (и, возможно,
+  «Ед. изм. показателя»), по строке на характеристику.
+Позицию открывает новый номер в колонке «№», строки без номера — её продолжение;
+без колонки «№» — новое наименование. Колонки сопоставляются по месту в шапке,
+поэтому таблица со строкой другой ширины целиком уходит в LLM. Повторы одного
+наименования в разных местах сливает deduplicate_tz_items.
+Результат — тот же {"items": [...]}, что описан в get_tz_analyze_prompt, и
+уверенность: доля строк характеристик, разобранных на пару ключ/значение.
+При низкой уверенности документ извлекается через LLM.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.prompt_serializer import is_column_numbers_row
+
+# Шапка ищется в первых строках таблицы
+HEADER_SCAN_ROWS = 3
+# «Параметр: значение»
+PAIR_PATTERN = re.compile(r"^(?P<key>[^:;]{2,120}?)\s*:\s*(?P<value>.+)$")
+# «Параметр — значение»; в ключе нет цифр, иначе «220 - 240 В» разрезался бы как диапазон
+DASH_PAIR_PATTERN = re.compile(r"^(?P<key>[^\d:;]{2,120}?)\s+[-–—]\s+(?P<value>.+)$")
+# «… Разрешение: 1920x1080» внутри значения — пары не разделены
+NESTED_PAIR = re.compile(r"[^\W\d_]{2}\s*:\s")
+# Значения, которые промпт запрещает выдавать как характеристику
+EMPTY_VALUES = {"", "-", "–", "—", "не указано", "не указана", "отсутствует", "нет данных"}
+
+
+def _header_role(cell: str) -> Optional[str]:
+    text = cell.lower().replace("ё", "е")
+    if not text:
+        return None
+    if text.startswith("№") or "п/п" in text or text in ("n", "no", "номер", "номер позиции", "поз."):
+        return "number"
+    if "показател" in text or "характеристик" in text or "параметр" in text:
+        if "значени" in text:
+            return "char_value"
+        if ("ед" in text and "изм" in text) or "единиц" in text:
+            return "char_unit"
+        if "наименование" in text or text in ("показатель", "характеристика", "параметр"):
+            return "char_name"
+        return "chars"
+    if "значени" in text:
+        return "char_value"
+    if "наименование" in text or "номенклатур" in text:
+        return "name"
+    if ("ед" in text and "изм" in text) or "единица" in text:
+        return "unit"
+    if "кол-во" in text or "количество" in text or text.startswith("кол."):
+        return "qty"
+    if "описание" in text or "требовани" in text or "технические" in text:
+        return "chars"
+    return None
+
+
+def _detect_columns(header: List[str]) -> Dict[str, List[int]]:
+    columns: Dict[str, List[int]] = {}
+    for idx, cell in enumerate(header):
+        role = _header_role(str(cell or ""))
+        if role:
+            columns.setdefault(role, []).append(idx)
+    return columns
+
+
+def _is_layout(columns: Dict[str, List[int]]) -> bool:
+    """Шапка распознана: есть наименование позиции и характеристики в одном из двух видов."""
+    return "name" in columns and ("chars" in columns or ("char_name" in columns and "char_value" in columns))
+
+
+def _cell(row: List[Any], idx: Optional[int]) -> str:
+    if idx is None or idx >= len(row):
+        return ""
+    return str(row[idx] or "").strip()
+
+
+def _split_pairs(text: str) -> Tuple[Dict[str, str], int, int]:
+    """Ячейка характеристик -> (пары, разобрано сегментов, всего сегментов)."""
+    pairs: Dict[str, str] = {}
+    parsed = 0
+    total = 0
+    for segment in re.split(r"[\n;]+", text):
+        segment = " ".join(segment.split()).strip(" .,")
+        if not segment:
+            continue
+        total += 1
+        match = PAIR_PATTERN.match(segment) or DASH_PAIR_PATTERN.match(segment)
+        if not match or NESTED_PAIR.search(match.group("value")):
+            # Не пара или несколько пар без разделителя — такую ячейку лучше разобрать через LLM
+            continue
+        key = match.group("key").strip()
+        value = match.group("value").strip()
+        if value.lower() in EMPTY_VALUES:
+            # Пустое значение разобрано, но в результат не попадает
+            parsed += 1
+            continue
+        pairs[key] = value
+        parsed += 1
+    return pairs, parsed, total
+
+
+def _is_aligned(row: List[Any], width: int, trimmed: bool) -> bool:
+    """
+    Строка выровнена по шапке. У таблиц DOCX по ячейке на колонку сетки — длина
+    совпадает; у листов XLS хвостовые пустые ячейки обрезаны — строка не длиннее шапки.
+    """
+    return len(row) <= width if trimmed else len(row) == width
+
+
+def _extract_table(
+        rows: List[List[Any]],
+        header: List[Any],
+        trimmed: bool = False
+) -> Optional[Tuple[List[Dict[str, Any]], int, int]]:
+    """
+    Позиции таблицы и счётчики (разобрано, всего) строк характеристик. None — строки
+    не выровнены по шапке: колонки сопоставляются по позиции, и сдвинутая строка дала бы
+    чужие значения полей, такую таблицу разбирает LLM.
+    """
+    columns = _detect_columns([str(cell or "") for cell in header])
+    name_idx = columns["name"][0]
+    number_idx = columns.get("number", [None])[0]
+    unit_idx = columns.get("unit", [None])[0]
+    qty_idx = columns.get("qty", [None])[0]
+    row_layout = "char_name" in columns and "char_value" in columns
+
+    items: List[Dict[str, Any]] = []
+    parsed = 0
+    total = 0
+    char_columns = set(columns.get("chars", []) + columns.get("char_name", []) + columns.get("char_value", []))
+    current_item: Optional[Dict[str, Any]] = None
+    current_name = None
+    current_number = None
+
+    for row in rows:
+        cells = [str(cell or "") for cell in row]
+        if not any(cells) or is_column_numbers_row(cells):
+            continue
+        if not _is_aligned(row, len(header), trimmed):
+            print(f"[DEBUG] Разбор ТЗ по правилам: строка не совпадает с шапкой ({len(row)} из {len(header)} колонок)")
+            return None
+
+        filled = [idx for idx, cell in enumerate(cells) if cell.strip()]
+        if len(filled) == 1 and filled[0] not in char_columns and filled[0] != name_idx:
+            # Заголовок раздела («Раздел 2. Насосы») на всю ширину таблицы — не позиция
+            current_item, current_name, current_number = None, None, None
+            continue
+
+        name = " ".join(_cell(row, name_idx).split())
+        if number_idx is not None:
+            # Есть колонка «№»: позицию открывает новый номер, строка без номера — продолжение
+            number = _cell(row, number_idx)
+            opens = bool(number) and number != current_number
+            if opens:
+                current_number = number
+        else:
+            # Без нумерации — новое наименование; повтор или пусто — продолжение
+            opens = bool(name) and name != current_name
+
+        if opens and name:
+            current_item = {"Наименование": name}
+            if _cell(row, unit_idx):
+                current_item["Ед. изм."] = _cell(row, unit_idx)
+            if _cell(row, qty_idx):
+                current_item["Кол-во"] = _cell(row, qty_idx)
+            current_item["Характеристики"] = {}
+            items.append(current_item)
+            current_name = name
+        elif opens or current_item is None:
+            # Позиция без наименования или характеристики до первой позиции — разобрать
+            # некуда, строки продолжения такой позиции тоже не учитываются
+            current_item = None
+            total += 1
+            continue
+
+        characteristics = current_item["Характеристики"]
+
+        if row_layout:
+            key = " ".join(_cell(row, columns["char_name"][0]).split())
+            value = " ".join(_cell(row, columns["char_value"][0]).split())
+            unit = _cell(row, columns.get("char_unit", [None])[0])
+            if not key and not value:
+                continue
+            total += 1
+            if key and value:
+                parsed += 1
+                if value.lower() not in EMPTY_VALUES:
+                    characteristics[key] = f"{value} {unit}".strip() if unit and unit not in value else value
+            continue
+
+        for idx in columns["chars"]:
+            pairs, cell_parsed, cell_total = _split_pairs(_cell(row, idx))
+            characteristics.update(pairs)
+            parsed += cell_parsed
+            total += cell_total
+
+    for item in items:
+        if not item["Характеристики"]:
+            # Позиция без единой характеристики — вероятно, нестандартная вёрстка
+            total += 1
+            del item["Характеристики"]
+
+    return items, parsed, total
+
+
+def _tables(data: Any) -> List[Tuple[List[Any], List[List[Any]], bool]]:
+    """
+    (шапка, строки, обрезаны ли хвостовые ячейки) для таблиц DOCX и листов XLS;
+    шапка DOCX ищется в первых строках.
+    """
+    if not isinstance(data, list):
+        return []
+
+    tables = []
+    for table in data:
+        if isinstance(table, dict) and "sheet_name" in table:
+            if table.get("header"):
+                tables.append((table["header"], table.get("rows", []), True))
+            continue
+        if not isinstance(table, list):
+            return []
+        for idx, row in enumerate(table[:HEADER_SCAN_ROWS]):
+            if _is_layout(_detect_columns([str(cell or "") for cell in row])):
+                tables.append((row, table[idx + 1:], False))
+                break
+    return tables
+
+
+def extract_tz_items(data: Any) -> Tuple[Optional[Dict[str, Any]], float]:
+    """
+    Позиции ТЗ по правилам и уверенность 0..1. (None, 0.0) — таблиц стандартного вида нет.
+    Таблицы без распознанной шапки (график поставки, подписи) не учитываются.
+    """
+    items: List[Dict[str, Any]] = []
+    parsed = 0
+    total = 0
+
+    for header, rows, trimmed in _tables(data):
+        columns = _detect_columns([str(cell or "") for cell in header])
+        if not _is_layout(columns):
+            continue
+        table = _extract_table(rows, header, trimmed)
+        if table is None:
+            return None, 0.0
+        table_items, table_parsed, table_total = table
+        items.extend(table_items)
+        parsed += table_parsed
+        total += table_total
+
+    if not items:
+        return None, 0.0
+
+    return {"items": items}, parsed / max(total, 1)